@@ -0,0 +1,236 @@
+"""
+File: CameraReplay.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import numpy as np
+
+from CameraZED import CameraZED, CALIBRATION_CACHE_DIR
+
+# A recording is a directory of raw side-by-side frames back to back, their timestamps as float64
+# and the calibration file of the camera. A frame is found by its offset, so seeking is free.
+RECORDING_INFO_NAME = "recording.json"
+RECORDING_FRAMES_NAME = "frames.raw"
+RECORDING_TIMESTAMPS_NAME = "timestamps.raw"
+# The info file is rewritten every this many frames, a recording cut short by a crash replays up to the last one
+RECORDING_CHECKPOINT_INTERVAL = 30
+
+class CameraRecorder(object):
+    """
+    description: A CameraRecorder class that writes the raw side-by-side stream of a CameraZED with timestamps,
+                 so the exact same frames can be replayed by CameraReplay on any host.
+    """
+
+    def __init__(self, record_path, camera_wrapper):
+        """
+        param:
+            record_path:    directory of the recording, created if missing
+            camera_wrapper: the CameraZED to record, its calibration file is copied into the recording
+        """
+        print("CameraRecorder init")
+
+        if os.path.isdir(record_path) == False:
+            os.makedirs(record_path)
+
+        calibration_name = os.path.basename(camera_wrapper.calibration_file)
+        shutil.copyfile(camera_wrapper.calibration_file, os.path.join(record_path, calibration_name))
+
+        self.record_path = record_path
+        self.camera_wrapper = camera_wrapper
+        self.info = {'serial_number': camera_wrapper.serial_number,
+                     'width': camera_wrapper.width,
+                     'height': camera_wrapper.height,
+                     'fps': camera_wrapper.fps,
+                     'calibration_file': calibration_name,
+                     'frame_count': 0}
+
+        self.frames_file = open(os.path.join(record_path, RECORDING_FRAMES_NAME), "wb")
+        self.timestamps_file = open(os.path.join(record_path, RECORDING_TIMESTAMPS_NAME), "wb")
+        self.write_info()
+
+    def destroy(self):
+        print("CameraRecorder destroy")
+
+        self.write_info()
+        self.frames_file.close()
+        self.timestamps_file.close()
+
+    def write_info(self):
+        # The frames it counts are flushed first, and it is replaced in one step, so it is never ahead of the data or half written
+        self.frames_file.flush()
+        self.timestamps_file.flush()
+        info_path = os.path.join(self.record_path, RECORDING_INFO_NAME)
+        with open(info_path + ".tmp", "w") as info_file:
+            json.dump(self.info, info_file, indent=2)
+        os.replace(info_path + ".tmp", info_path)
+
+    def write(self, frame, timestamp):
+        """
+        description: Append one raw frame.
+        param:
+            frame:      a (height, width * 2, 3) uint8 side-by-side frame
+            timestamp:  time.time() when the frame was read
+        return:
+            no return
+        """
+
+        frame_shape = (self.info['height'], self.info['width'] * 2, 3)
+        if frame.shape != frame_shape:
+            raise ValueError("Frame shape %s does not match the recording %s" % (frame.shape, frame_shape))
+
+        self.frames_file.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self.timestamps_file.write(np.float64(timestamp).tobytes())
+        self.info['frame_count'] += 1
+        if self.info['frame_count'] % RECORDING_CHECKPOINT_INTERVAL == 0:
+            self.write_info()
+
+    def record(self, num_frames):
+        """
+        description: Read num_frames raw frames from the camera, stops early when a read fails.
+        return:
+            frame_count: number of frames recorded
+        """
+
+        for _ in range(num_frames):
+            retval, frame = self.camera_wrapper.cap.read()
+            if retval is False:
+                break
+            self.write(frame, time.time())
+        return self.info['frame_count']
+
+class ReplayCapture(object):
+    """
+    description: A cv2.VideoCapture like reader of a recording. The frames are memory-mapped.
+                 With real-time pacing read() waits until a frame is due by its recorded timestamp,
+                 otherwise it returns the frames as fast as possible.
+    """
+
+    def __init__(self, record_path, enable_realtime=True):
+        with open(os.path.join(record_path, RECORDING_INFO_NAME), "r") as info_file:
+            info = json.load(info_file)
+
+        frame_count = info['frame_count']
+        frame_shape = (info['height'], info['width'] * 2, 3)
+
+        self.info = info
+        self.frames = np.memmap(os.path.join(record_path, RECORDING_FRAMES_NAME), dtype=np.uint8, mode="r", shape=(frame_count,) + frame_shape)
+        self.timestamps = np.fromfile(os.path.join(record_path, RECORDING_TIMESTAMPS_NAME), dtype=np.float64, count=frame_count)
+        self.enable_realtime = enable_realtime
+
+        self.position = 0
+        self.start_time = None
+        self.opened = frame_count > 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop_id, value):
+        # The resolution and frame rate are those of the recording
+        return False
+
+    def release(self):
+        self.opened = False
+
+    def seek(self, position):
+        """
+        description: Continue reading at a frame index, the real-time pacing restarts there.
+        """
+
+        self.position = max(0, min(position, len(self.frames)))
+        self.start_time = None
+        self.opened = self.position < len(self.frames)
+
+    def read(self):
+        if self.position >= len(self.frames):
+            # Like a closed camera, the background capture stops on it
+            self.opened = False
+            return False, None
+
+        if self.enable_realtime is True:
+            now = time.time()
+            if self.start_time is None:
+                self.start_time = now - (self.timestamps[self.position] - self.timestamps[0])
+            delay = self.start_time + (self.timestamps[self.position] - self.timestamps[0]) - now
+            if delay > 0:
+                time.sleep(delay)
+
+        frame = self.frames[self.position]
+        self.position += 1
+        return True, frame
+
+class CameraReplay(CameraZED):
+    """
+    description: A CameraReplay class that replays a recording through the CameraZED interface,
+                 capture_left, capture_right and capture_stereo rectify the recorded frames with the recorded calibration.
+    """
+
+    def __init__(self, record_path, enable_realtime=True, enable_background_capture=False, calibration_cache_dir=CALIBRATION_CACHE_DIR, infer_size=None, pad_value=0):
+        """
+        param:
+            record_path:        directory of a CameraRecorder recording
+            enable_realtime:    pace the frames by their recorded timestamps, otherwise read them as fast as possible
+        """
+
+        replay_capture = ReplayCapture(record_path, enable_realtime)
+        info = replay_capture.info
+
+        self.record_path = record_path
+        self.replay_capture = replay_capture
+        CameraZED.__init__(self, info['serial_number'], info['width'], info['height'], info['fps'], enable_background_capture,
+                           calibration_cache_dir, infer_size, pad_value, capture=replay_capture)
+
+    def __len__(self):
+        return len(self.replay_capture)
+
+    def download_calibration_file(self, serial_number):
+        return os.path.join(self.record_path, self.replay_capture.info['calibration_file'])
+
+def benchmark(record_path, enable_realtime=False):
+    """
+    description: Replay a recording through capture_left and print the capture time per frame.
+    """
+
+    camera_wrapper = CameraReplay(record_path, enable_realtime)
+    dst = np.empty((camera_wrapper.height, camera_wrapper.width, 3), dtype=np.uint8)
+
+    frame_count = 0
+    start = time.time()
+    while camera_wrapper.capture_left(dst) is not None:
+        frame_count += 1
+    elapsed = time.time() - start
+    camera_wrapper.destroy()
+
+    print("Replayed frame         : ", frame_count)
+    if frame_count > 0:
+        print("Avg. Capture time      : ", elapsed * 1000 / frame_count, " msec")
+        print("Avg. FPS               : ", frame_count / elapsed)
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'record':
+        # python CameraReplay.py record <serial number> <recording directory> [frames]
+        num_frames = int(sys.argv[4]) if len(sys.argv) > 4 else 300
+        camera_wrapper = CameraZED(int(sys.argv[2]), 1920, 1080, 30)
+        camera_recorder = CameraRecorder(sys.argv[3], camera_wrapper)
+        print("Recorded frame         : ", camera_recorder.record(num_frames))
+        camera_recorder.destroy()
+        camera_wrapper.destroy()
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'replay':
+        # python CameraReplay.py replay <recording directory> [realtime]
+        benchmark(sys.argv[2], len(sys.argv) > 3 and sys.argv[3] == 'realtime')
+    else:
+        print("Usage: %s record <serial number> <recording directory> [frames]" % sys.argv[0])
+        print("       %s replay <recording directory> [realtime]" % sys.argv[0])
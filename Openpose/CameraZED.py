@@ -11,17 +11,38 @@ For more information, contact us at <jw.jeong@keti.re.kr>.
 
 import sys
 import os
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import configparser
 import cv2
 import wget
 
+# Rectification maps are cached per serial number, resolution and calibration file content
+CALIBRATION_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "zed_rectify")
+CALIBRATION_CACHE_VERSION = 1
+CALIBRATION_CACHE_KEYS = ("camera_matrix_left", "camera_matrix_right", "map_left_x", "map_left_y", "map_right_x", "map_right_y")
+
 class CameraZED(object):
     """
     description: A CameraZED class that warps image capture ops.
     """
     
-    def __init__(self, serial_number, image_width, image_height, fps):
+    def __init__(self, serial_number, image_width, image_height, fps, enable_background_capture=False, calibration_cache_dir=CALIBRATION_CACHE_DIR, infer_size=None, pad_value=0, capture=None):
+        """
+        param:
+            enable_background_capture:  grab and rectify continuously on a background thread,
+                                        capture_left then returns the newest frame instead of the next queued one
+            calibration_cache_dir:      directory of the memory-mapped rectification map cache, None disables it
+            infer_size:                 (width, height) of the inference input, builds the fused rectify and letterbox map
+                                        of capture_left_infer, the background capture then rectifies to this size only
+            pad_value:                  value of the letterbox border of capture_left_infer
+            capture:                    a cv2.VideoCapture like object of side-by-side frames, e.g. a ReplayCapture,
+                                        the ZED on /dev/video0 by default
+        """
         print("CameraZED init")
         
         self.serial_number = serial_number
@@ -29,7 +50,7 @@ class CameraZED(object):
         self.height = image_height
         self.fps = fps
         
-        self.cap = cv2.VideoCapture(0)
+        self.cap = capture if capture is not None else cv2.VideoCapture(0)
         if self.cap.isOpened() == 0:
             exit(-1)
         
@@ -40,9 +61,21 @@ class CameraZED(object):
         calibration_file = self.download_calibration_file(self.serial_number)
         if calibration_file  == "":
             exit(1)
+        self.calibration_file = calibration_file
+        
+        calibration = None
+        if calibration_cache_dir is not None:
+            cache_path = self.get_calibration_cache_path(calibration_cache_dir, calibration_file)
+            calibration = self.load_calibration_cache(cache_path)
         
-        print("Calibration file found. Loading...")
-        camera_matrix_left, camera_matrix_right, map_left_x, map_left_y, map_right_x, map_right_y = self.init_calibration(calibration_file)
+        if calibration is None:
+            print("Calibration file found. Loading...")
+            calibration = self.init_calibration(calibration_file)
+            if calibration_cache_dir is not None:
+                self.save_calibration_cache(cache_path, calibration)
+        else:
+            print("Calibration cache found. Loading...")
+        camera_matrix_left, camera_matrix_right, map_left_x, map_left_y, map_right_x, map_right_y = calibration
         
         self.camera_matrix_left = camera_matrix_left
         self.camera_matrix_right = camera_matrix_right
@@ -50,12 +83,139 @@ class CameraZED(object):
         self.map_left_y = map_left_y
         self.map_right_x = map_right_x
         self.map_right_y = map_right_y
+        
+        self.map_infer_x = None
+        self.map_infer_y = None
+        if infer_size is not None:
+            self.init_infer_map(infer_size[0], infer_size[1], pad_value)
+        
+        # Rectifies the right half while the caller's thread rectifies the left one
+        self.rectify_executor = ThreadPoolExecutor(max_workers=1)
+        
+        # time.perf_counter_ns() when the frame last returned by a capture was read from the camera
+        self.capture_time = None
+        
+        self.capture_thread = None
+        if enable_background_capture is True:
+            self.start_background_capture()
     
     def destroy(self):
         print("CameraZED destroy")
         
+        if self.capture_thread is not None:
+            self.running = False
+            self.capture_thread.join()
+        
+        self.rectify_executor.shutdown(wait=True)
         self.cap.release()
     
+    def start_background_capture(self):
+        # Double buffer: the thread rectifies into the back buffer while readers copy the front one
+        if self.map_infer_x is not None:
+            self.buffers = [np.empty((self.infer_height, self.infer_width, 3), dtype=np.uint8) for _ in range(2)]
+        else:
+            self.buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(2)]
+        # Raw left halves of the buffered frames, for the full resolution image on demand
+        self.raw_frames = [None, None]
+        self.front = 0
+        self.timestamp = 0
+        self.front_capture_time = None
+        self.sequence = 0
+        self.consumed_sequence = 0
+        self.dropped_count = 0
+        self.condition = threading.Condition()
+        
+        self.running = True
+        self.capture_thread = threading.Thread(target=self.background_capture)
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+    
+    def background_capture(self):
+        back = 1
+        while self.running is True:
+            retval, frame = self.cap.read()
+            if retval is False:
+                # A closed capture is the end of a recording, a live camera only skips a frame
+                if self.cap.isOpened() == 0:
+                    break
+                time.sleep(1.0 / self.fps)
+                continue
+            timestamp = time.time()
+            capture_time = time.perf_counter_ns()
+            
+            left_right_image = np.split(frame, 2, axis=1)
+            if self.map_infer_x is not None:
+                self.remap_infer(left_right_image[0], self.buffers[back])
+            else:
+                cv2.remap(left_right_image[0], self.map_left_x, self.map_left_y, interpolation=cv2.INTER_LINEAR, dst=self.buffers[back])
+            self.raw_frames[back] = left_right_image[0]
+            
+            with self.condition:
+                # The current front frame was never read, it is replaced by a newer one
+                if self.sequence > self.consumed_sequence:
+                    self.dropped_count += 1
+                self.front, back = back, self.front
+                self.timestamp = timestamp
+                self.front_capture_time = capture_time
+                self.sequence += 1
+                self.condition.notify_all()
+        
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+    
+    def read_latest(self, dst=None, timeout=1.0):
+        """
+        description: Get the newest rectified left image of the background capture.
+                     Waits for a frame that was not returned before, so no frame is processed twice.
+                     With infer_size the image is the letterboxed inference input of capture_left_infer.
+                     The image is None once the capture ended.
+        param:
+            dst:        an optional (height, width, 3) uint8 array the image is copied into
+            timeout:    seconds to wait for a new frame
+        return:
+            left_rect:      the rectified left image
+            timestamp:      time.time() when the frame was read from the camera
+            dropped_count:  number of frames replaced by a newer one before anybody read them
+        """
+        
+        left_rect, raw_left, timestamp, dropped_count = self.read_latest_raw(dst, timeout)
+        return left_rect, timestamp, dropped_count
+    
+    def read_latest_raw(self, dst=None, timeout=1.0):
+        with self.condition:
+            while self.sequence == self.consumed_sequence and self.running is True:
+                if self.condition.wait(timeout) is False:
+                    raise RuntimeError("No frame from camera %d within %0.1f sec" % (self.serial_number, timeout))
+            
+            if self.sequence == self.consumed_sequence:
+                return None, None, self.timestamp, self.dropped_count
+            
+            image = self.buffers[self.front]
+            if dst is None:
+                dst = np.copy(image)
+            else:
+                np.copyto(dst, image)
+            self.consumed_sequence = self.sequence
+            self.capture_time = self.front_capture_time
+            return dst, self.raw_frames[self.front], self.timestamp, self.dropped_count
+    
+    def read_frame(self):
+        # The capture time is the clock of time.perf_counter_ns(), so it can be compared with the pipeline latencies
+        retval, frame = self.cap.read()
+        if retval is True:
+            self.capture_time = time.perf_counter_ns()
+        return retval, frame
+    
+    def get_capture_time(self):
+        """
+        description: Get when the frame last returned by capture_left, capture_left_infer, capture_right,
+                     capture_stereo or read_latest was read from the camera.
+        return:
+            capture_time: time.perf_counter_ns() of the read, None before the first frame
+        """
+        return self.capture_time
+    
     def download_calibration_file(self, serial_number) :
         if os.name == 'nt' :
             #hidden_path = os.getenv('APPDATA') + '\\Stereolabs\\settings\\'
@@ -74,6 +234,41 @@ class CameraZED(object):
         
         return calibration_file
     
+    def get_calibration_cache_path(self, cache_dir, calibration_file):
+        with open(calibration_file, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:16]
+        cache_name = 'SN%s_%dx%d_%s_v%d' % (self.serial_number, self.width, self.height, digest, CALIBRATION_CACHE_VERSION)
+        return os.path.join(cache_dir, cache_name)
+    
+    def load_calibration_cache(self, cache_path):
+        """
+        description: Memory-map the cached projection matrices and rectification maps.
+        return:
+            calibration: the tuple init_calibration returns, None if there is no usable cache
+        """
+        if os.path.isdir(cache_path) == False:
+            return None
+        
+        try:
+            return tuple(np.load(os.path.join(cache_path, key + '.npy'), mmap_mode='r') for key in CALIBRATION_CACHE_KEYS)
+        except (IOError, OSError, ValueError) as e:
+            print('Invalid calibration cache %s: %s' % (cache_path, e))
+            return None
+    
+    def save_calibration_cache(self, cache_path, calibration):
+        # Written to a temporary directory and renamed, a concurrent start never sees half a cache
+        temp_path = '%s.tmp%d' % (cache_path, os.getpid())
+        try:
+            if os.path.isdir(temp_path) == False:
+                os.makedirs(temp_path)
+            for key, value in zip(CALIBRATION_CACHE_KEYS, calibration):
+                np.save(os.path.join(temp_path, key + '.npy'), value)
+            os.rename(temp_path, cache_path)
+        except (IOError, OSError) as e:
+            # The cache is only an optimization, e.g. a read-only home or another process that won the rename
+            print('Calibration cache not written: %s' % e)
+            shutil.rmtree(temp_path, ignore_errors=True)
+    
     def init_calibration(self, calibration_file):
         cameraMarix_left = cameraMatrix_right = map_left_y = map_left_x = map_right_y = map_right_x = np.array([])
         
@@ -152,27 +347,139 @@ class CameraZED(object):
                                            imageSize=(self.width, self.height),
                                            newImageSize=(self.width, self.height))[0:4]
         
-        map_left_x, map_left_y = cv2.initUndistortRectifyMap(cameraMatrix_left, distCoeffs_left, R1, P1, (self.width, self.height), cv2.CV_32FC1)
-        map_right_x, map_right_y = cv2.initUndistortRectifyMap(cameraMatrix_right, distCoeffs_right, R2, P2, (self.width, self.height), cv2.CV_32FC1)
+        # Fixed-point maps: map_x holds the integer source coordinates and map_y the sub-pixel interpolation index.
+        # cv2.remap uses them as they are instead of converting float maps on every call
+        map_left_x, map_left_y = cv2.initUndistortRectifyMap(cameraMatrix_left, distCoeffs_left, R1, P1, (self.width, self.height), cv2.CV_16SC2)
+        map_right_x, map_right_y = cv2.initUndistortRectifyMap(cameraMatrix_right, distCoeffs_right, R2, P2, (self.width, self.height), cv2.CV_16SC2)
         
         cameraMatrix_left = P1
         cameraMatrix_right = P2
         
         return cameraMatrix_left, cameraMatrix_right, map_left_x, map_left_y, map_right_x, map_right_y
     
-    def capture_left(self):
-        retval, frame = self.cap.read()
+    def init_infer_map(self, infer_width, infer_height, pad_value):
+        """
+        description: Compose the left rectification map with the letterbox of the inference input,
+                     so one remap turns a raw frame into the padded inference image.
+                     The letterbox is the one of YoLov5TRT.preprocess_image, the resize samples at pixel centers like cv2.resize.
+        """
+        r_w = infer_width / self.width
+        r_h = infer_height / self.height
+        if r_h > r_w:
+            tw = infer_width
+            th = int(r_w * self.height)
+            tx1 = 0
+            ty1 = int((infer_height - th) / 2)
+        else:
+            tw = int(r_h * self.width)
+            th = infer_height
+            tx1 = int((infer_width - tw) / 2)
+            ty1 = 0
+        
+        # Position of every letterbox pixel in the full resolution rectified image
+        x = ((np.arange(tw, dtype=np.float32) + 0.5) * (self.width / tw) - 0.5).clip(0, self.width - 1)
+        y = ((np.arange(th, dtype=np.float32) + 0.5) * (self.height / th) - 0.5).clip(0, self.height - 1)
+        resize_x, resize_y = np.meshgrid(x, y)
+        
+        # Sample the rectification map there, it gives the position in the raw frame
+        map_left_x, map_left_y = cv2.convertMaps(np.asarray(self.map_left_x), np.asarray(self.map_left_y), cv2.CV_32FC1)
+        map_infer_x = np.full((infer_height, infer_width), -infer_width, dtype=np.float32)
+        map_infer_y = np.full((infer_height, infer_width), -infer_height, dtype=np.float32)
+        map_infer_x[ty1:ty1 + th, tx1:tx1 + tw] = cv2.remap(map_left_x, resize_x, resize_y, interpolation=cv2.INTER_LINEAR)
+        map_infer_y[ty1:ty1 + th, tx1:tx1 + tw] = cv2.remap(map_left_y, resize_x, resize_y, interpolation=cv2.INTER_LINEAR)
+        
+        # The border maps far outside the raw frame, so the remap fills it with the pad value
+        self.map_infer_x, self.map_infer_y = cv2.convertMaps(map_infer_x, map_infer_y, cv2.CV_16SC2)
+        self.infer_width = infer_width
+        self.infer_height = infer_height
+        self.pad_value = pad_value
+    
+    def remap_infer(self, raw_left, dst=None):
+        return cv2.remap(raw_left, self.map_infer_x, self.map_infer_y, interpolation=cv2.INTER_LINEAR,
+                         dst=dst, borderMode=cv2.BORDER_CONSTANT, borderValue=(self.pad_value,) * 3)
+    
+    def capture_left_infer(self, dst=None):
+        """
+        description: Capture the left image, rectified and letterboxed to the inference size in one remap.
+                     It touches about a fifth of the pixels of capture_left followed by a resize.
+        param:
+            dst:    an optional (infer_height, infer_width, 3) uint8 array the image is written into
+        return:
+            infer_img:  the letterboxed, rectified left image
+            raw_left:   the raw left half of the frame, rectify_left(raw_left) gives the full resolution image
+            Both are None once the capture ended.
+        """
+        if self.map_infer_x is None:
+            raise RuntimeError("capture_left_infer needs the infer_size of the camera")
+        
+        if self.capture_thread is not None:
+            infer_img, raw_left, timestamp, dropped_count = self.read_latest_raw(dst)
+            return infer_img, raw_left
+        
+        retval, frame = self.read_frame()
+        if retval is False:
+            return None, None
+        left_right_image = np.split(frame, 2, axis=1)
+        return self.remap_infer(left_right_image[0], dst), left_right_image[0]
+    
+    def rectify_left(self, raw_left, dst=None):
+        """
+        description: Rectify a raw left half at full resolution, e.g. for drawing the results of capture_left_infer.
+        """
+        return cv2.remap(raw_left, self.map_left_x, self.map_left_y, interpolation=cv2.INTER_LINEAR, dst=dst)
+    
+    def capture_left(self, dst=None):
+        """
+        description: Capture and rectify the left image.
+        param:
+            dst:    an optional (height, width, 3) uint8 array the image is written into, e.g. a staging buffer
+        return:
+            left_rect: the rectified left image, None once the capture ended
+        """
+        if self.capture_thread is not None:
+            if self.map_infer_x is not None:
+                infer_img, raw_left = self.capture_left_infer()
+                return self.rectify_left(raw_left, dst) if raw_left is not None else None
+            return self.read_latest(dst)[0]
+        
+        retval, frame = self.read_frame()
+        if retval is False:
+            return None
         left_right_image = np.split(frame, 2, axis=1)
-        left_rect = cv2.remap(left_right_image[0], self.map_left_x, self.map_left_y, interpolation=cv2.INTER_LINEAR)
+        left_rect = cv2.remap(left_right_image[0], self.map_left_x, self.map_left_y, interpolation=cv2.INTER_LINEAR, dst=dst)
         return left_rect
         
-    def capture_right(self):
-        retval, frame = self.cap.read()
+    def capture_right(self, dst=None):
+        # The background capture reads the camera, a second reader would take frames from it
+        if self.capture_thread is not None:
+            raise RuntimeError("capture_right is not available with the background capture")
+        
+        retval, frame = self.read_frame()
+        if retval is False:
+            return None
         left_right_image = np.split(frame, 2, axis=1)
-        right_rect = cv2.remap(left_right_image[1], self.map_right_x, self.map_right_y, interpolation=cv2.INTER_LINEAR)
+        right_rect = cv2.remap(left_right_image[1], self.map_right_x, self.map_right_y, interpolation=cv2.INTER_LINEAR, dst=dst)
         return right_rect
         
-    def capture_stereo(self):
-        retval, frame = self.cap.read()
+    def capture_stereo(self, dst_left=None, dst_right=None):
+        """
+        description: Capture one frame and rectify both of its halves, so the pair is taken at the same time.
+                     The halves are rectified in parallel, cv2.remap releases the GIL.
+        param:
+            dst_left:   an optional (height, width, 3) uint8 array the left image is written into
+            dst_right:  an optional (height, width, 3) uint8 array the right image is written into
+        return:
+            left_rect, right_rect: the rectified left and right images, None once the capture ended
+        """
+        if self.capture_thread is not None:
+            raise RuntimeError("capture_stereo is not available with the background capture")
+        
+        retval, frame = self.read_frame()
+        if retval is False:
+            return None, None
         left_right_image = np.split(frame, 2, axis=1)
-        return left_right_image
+        right_future = self.rectify_executor.submit(cv2.remap, left_right_image[1], self.map_right_x, self.map_right_y,
+                                                    interpolation=cv2.INTER_LINEAR, dst=dst_right)
+        left_rect = cv2.remap(left_right_image[0], self.map_left_x, self.map_left_y, interpolation=cv2.INTER_LINEAR, dst=dst_left)
+        right_rect = right_future.result()
+        return left_rect, right_rect
@@ -26,8 +26,11 @@ import torchvision.transforms as transforms
 import PIL.Image
 
 from CameraZED import CameraZED
+from CameraReplay import CameraReplay
+from Tracer import tracer
 
 ENABLE_DRAW_FPS = True
+ENABLE_TRACE = False
 
 INPUT_WIDTH = 1920
 INPUT_HEIGHT = 1080
@@ -37,10 +40,21 @@ INFER_WIDTH = 224
 INFER_HEIGHT = 224
 
 TOTAL_FRAME = 1000
+# Grab continuously on a background thread and always hand out the newest frame
+ENABLE_BACKGROUND_CAPTURE = True
+# A recording of CameraReplay.py replayed instead of the camera, for reproducible measurements without a ZED
+REPLAY_PATH = None
+# Pace the replay by the recorded timestamps, otherwise replay as fast as possible
+ENABLE_REPLAY_REALTIME = True
 
 ORIG_MODEL_PATH = "resnet18_baseline_att_224x224_A_epoch_249.pth"
 TRT_MODEL_PATH = "resnet18_baseline_att_224x224_A_epoch_249_trt.pth"
 
+# Chrome trace-event JSON, open it in chrome://tracing or ui.perfetto.dev
+# It is written at the end of the run and on SIGUSR1
+TRACE_PATH = "./trace.json"
+TRACE_BUFFER_SIZE = 100000
+
 def draw_fps(img, fps):
     tl = (
         round(0.002 * (img.shape[0] + img.shape[1]) / 2) + 1
@@ -81,11 +95,18 @@ def preprocess(image):
     return image[None, ...]
 
 def main():
+    if ENABLE_TRACE is True:
+        tracer.enable(TRACE_BUFFER_SIZE)
+        tracer.dump_on_signal(TRACE_PATH)
+    
     if len(sys.argv) == 1 :
         serial_number = 22246603
     else:
         serial_number = int(sys.argv[1])
-    camera_wrapper = CameraZED(serial_number, INPUT_WIDTH, INPUT_HEIGHT, INPUT_FPS)
+    if REPLAY_PATH is not None:
+        camera_wrapper = CameraReplay(REPLAY_PATH, ENABLE_REPLAY_REALTIME, ENABLE_BACKGROUND_CAPTURE)
+    else:
+        camera_wrapper = CameraZED(serial_number, INPUT_WIDTH, INPUT_HEIGHT, INPUT_FPS, ENABLE_BACKGROUND_CAPTURE)
     
     with open ('human_pose.json', 'r') as f:
         human_pose = json.load(f)
@@ -115,51 +136,84 @@ def main():
     pre_process_time = 0
     inference_time = 0
     post_process_time = 0
+    display_latency = 0
     fps = 0
+    total_frame = 0
     
     for index in range(0, TOTAL_FRAME):
-        capture_img = camera_wrapper.capture_left()
+        # The frame index is the trace ID of the frame
+        tracer.frame_begin(index)
+        with tracer.span("capture", {'frame': index}):
+            if ENABLE_BACKGROUND_CAPTURE is True:
+                capture_img, capture_timestamp, dropped_count = camera_wrapper.read_latest()
+            else:
+                capture_img = camera_wrapper.capture_left()
+                capture_timestamp = time.time()
+        if capture_img is None:
+            # The end of a replayed recording
+            tracer.frame_end(index)
+            break
+        total_frame += 1
         
+        tracer.begin("pre-process", {'frame': index})
         start = time.time()
         capture_img_resize = cv2.resize(capture_img, (INFER_WIDTH, INFER_HEIGHT))
         data = preprocess(capture_img_resize)
         end = time.time()
+        tracer.end("pre-process")
         
         pre_process_time += (end - start) * 1000
         fps += (end - start) * 1000
         
+        tracer.begin("inference", {'frame': index})
         start = time.time()
         cmap, paf = model_trt(data)
         cmap, paf = cmap.detach().cpu(), paf.detach().cpu()
         end = time.time()
+        tracer.end("inference")
         
         inference_time += (end - start) * 1000
         fps += (end - start) * 1000
         
+        tracer.begin("post-process", {'frame': index})
         start = time.time()
         counts, objects, peaks = parse_objects(cmap, paf)  # , cmap_threshold=0.15, link_threshold=0.15)
         end = time.time()
+        tracer.end("post-process")
         
         post_process_time += (end - start) * 1000
         fps += (end - start) * 1000
         
-        draw_objects(capture_img, counts, objects, peaks)
+        with tracer.span("draw", {'frame': index}):
+            draw_objects(capture_img, counts, objects, peaks)
+            
+            if ENABLE_DRAW_FPS is True:
+                draw_fps(capture_img, 1000 / fps)
+                fps = 0
         
-        if ENABLE_DRAW_FPS is True:
-            draw_fps(capture_img, 1000 / fps)
-            fps = 0
-        
-        cv2.imshow("result", capture_img)
-        if cv2.waitKey(1) >= 0:
+        with tracer.span("show", {'frame': index}):
+            cv2.imshow("result", capture_img)
+            key = cv2.waitKey(1)
+        tracer.frame_end(index)
+        display_latency += (time.time() - capture_timestamp) * 1000
+        if key >= 0:
             break
     
     total_time = pre_process_time + inference_time + post_process_time
-    print("Total frame : ", TOTAL_FRAME)
-    print("Avg. pre process time  : %0.3f msec" % (pre_process_time / TOTAL_FRAME))
-    print("Avg. inference time    : %0.3f msec" % (inference_time / TOTAL_FRAME))
-    print("Avg. post process time : %0.3f msec" % (post_process_time / TOTAL_FRAME))
-    print("Avg. total time        : %0.3f msec" % (total_time / TOTAL_FRAME))
-    print("Avg. FPS               : %0.3f FPS" % (1000 / (total_time / TOTAL_FRAME)))
+    print("Total frame : ", total_frame)
+    print("Avg. pre process time  : %0.3f msec" % (pre_process_time / total_frame))
+    print("Avg. inference time    : %0.3f msec" % (inference_time / total_frame))
+    print("Avg. post process time : %0.3f msec" % (post_process_time / total_frame))
+    print("Avg. total time        : %0.3f msec" % (total_time / total_frame))
+    print("Avg. FPS               : %0.3f FPS" % (1000 / (total_time / total_frame)))
+    print("Avg. display latency   : %0.3f msec" % (display_latency / total_frame))
+    if ENABLE_BACKGROUND_CAPTURE is True:
+        print("Camera dropped frame   : %d" % camera_wrapper.dropped_count)
+    
+    camera_wrapper.destroy()
+    
+    if ENABLE_TRACE is True:
+        tracer.dump(TRACE_PATH)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,161 @@
+"""
+File: Tracer.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import time
+import json
+import signal
+import threading
+import collections
+
+if hasattr(time, "perf_counter_ns"):
+    def get_timestamp():
+        return time.perf_counter_ns() / 1000
+else:
+    def get_timestamp():
+        return time.perf_counter() * 1e6
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tracer.begin(self.name, self.args)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.end(self.name)
+        return False
+
+class Tracer(object):
+    """
+    description: A Tracer class that records begin and end events of every thread into its own ring buffer
+                 and dumps them as a Chrome trace-event JSON, viewable in chrome://tracing or Perfetto.
+                 A thread only appends to its own deque, so recording takes no lock.
+                 Frames are followed across threads by their trace ID, the frame index.
+    """
+
+    def __init__(self, buffer_size=100000):
+        """
+        param:
+            buffer_size:    events kept per thread, the oldest are dropped first
+        """
+
+        self.enabled = False
+        self.buffer_size = buffer_size
+        self.local = threading.local()
+        self.buffers = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def enable(self, buffer_size=None):
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.enabled = True
+
+    def get_buffer(self):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = collections.deque(maxlen=self.buffer_size)
+            # Only the first event of a thread takes the lock
+            with self.lock:
+                tid = len(self.buffers)
+                self.buffers.append((tid, threading.current_thread().name, buffer))
+            self.local.buffer = buffer
+            self.local.tid = tid
+        return buffer
+
+    def begin(self, name, args=None):
+        """
+        description: Record the begin of a span on the calling thread.
+        param:
+            name:   span name, e.g. "inference"
+            args:   a dict shown with the span, e.g. {'frames': [0, 1]}
+        """
+
+        if self.enabled is True:
+            self.get_buffer().append(("B", name, get_timestamp(), None, args))
+
+    def end(self, name):
+        if self.enabled is True:
+            self.get_buffer().append(("E", name, get_timestamp(), None, None))
+
+    def span(self, name, args=None):
+        """
+        description: A context manager recording a begin and an end event around its block.
+        """
+
+        if self.enabled is True:
+            return Span(self, name, args)
+        return NULL_SPAN
+
+    def frame_begin(self, trace_id, name="frame"):
+        """
+        description: Open the lane of one frame, it spans every thread the frame passes through.
+        """
+
+        if self.enabled is True:
+            self.get_buffer().append(("b", name, get_timestamp(), trace_id, None))
+
+    def frame_end(self, trace_id, name="frame"):
+        if self.enabled is True:
+            self.get_buffer().append(("e", name, get_timestamp(), trace_id, None))
+
+    def get_events(self):
+        with self.lock:
+            buffers = list(self.buffers)
+
+        events = []
+        for tid, thread_name, buffer in buffers:
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid, 'args': {'name': thread_name}})
+            for phase, name, timestamp, trace_id, args in list(buffer):
+                event = {'ph': phase, 'name': name, 'ts': timestamp, 'pid': self.pid, 'tid': tid}
+                if trace_id is not None:
+                    event['id'] = trace_id
+                    event['cat'] = name
+                if args is not None:
+                    event['args'] = args
+                events.append(event)
+        return events
+
+    def dump(self, trace_path):
+        """
+        description: Write the recorded events as Chrome trace-event JSON.
+        param:
+            trace_path: path of the JSON file
+        """
+
+        events = self.get_events()
+        with open(trace_path, "w") as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        print("Trace dumped : %s (%d events)" % (trace_path, len(events)))
+
+    def dump_on_signal(self, trace_path):
+        """
+        description: Dump the trace whenever the process gets SIGUSR1, e.g. kill -USR1 <pid>.
+                     Must be called from the main thread.
+        """
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump(trace_path))
+
+tracer = Tracer()
@@ -9,6 +9,8 @@ import numpy as np
 import pandas as pd
 from operator import itemgetter
 
+from ResultWriter import load_json_lines
+
 MINOVERLAP = 0.50
 BASELINE_PARAMS = 7255094
 BASELINE_INF = 400
@@ -60,6 +62,52 @@ def compute_AP(tp, fp, gt_len):
 
 
 def cal_IoU(ground_truth_data, dr_data):
+    """
+    description: Mark every detection as TP or FP. A detection is matched with the ground truth of its highest IoU,
+                 it is a TP if that IoU is at least MINOVERLAP and no earlier detection took that ground truth.
+                 Same result as cal_IoU_loop, with the IoU of all pairs of an image in one NumPy computation.
+    param:
+        ground_truth_data:  a list of [x1, y1, x2, y2, ...] ground truth boxes
+        dr_data:            a list of [x1, y1, x2, y2] detections, sorted by decreasing confidence
+    return:
+        tp, fp: lists of 0 or 1 per detection
+    """
+
+    if len(ground_truth_data) == 0:
+        if len(dr_data) == 0:
+            return [], []
+        else:
+            return [0]*len(dr_data), [1]*len(dr_data)
+    else:
+        if len(dr_data) == 0:
+            return [], []
+
+    bb = np.array([box[:4] for box in dr_data], dtype=np.float64)
+    bbgt = np.array([obj[:4] for obj in ground_truth_data], dtype=np.float64)
+
+    # Same operations in the same order as the loop, so the IoU is bit identical
+    iw = np.minimum(bb[:, None, 2], bbgt[None, :, 2]) - np.maximum(bb[:, None, 0], bbgt[None, :, 0]) + 1
+    ih = np.minimum(bb[:, None, 3], bbgt[None, :, 3]) - np.maximum(bb[:, None, 1], bbgt[None, :, 1]) + 1
+    ua = ((bb[:, 2] - bb[:, 0] + 1) * (bb[:, 3] - bb[:, 1] + 1))[:, None] + \
+         ((bbgt[:, 2] - bbgt[:, 0] + 1) * (bbgt[:, 3] - bbgt[:, 1] + 1))[None, :] - iw * ih
+    overlapping = (iw > 0) & (ih > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ov = np.where(overlapping, iw * ih / ua, -1)
+
+    # argmax takes the first of equal overlaps, like the strict comparison of the loop
+    gt_match = np.argmax(ov, axis=1)
+    ovmax = ov[np.arange(len(dr_data)), gt_match]
+
+    # A ground truth is used by the first detection matched with it, every later one is a FP
+    matched = np.nonzero(ovmax >= MINOVERLAP)[0]
+    _, first = np.unique(gt_match[matched], return_index=True)
+    tp = np.zeros(len(dr_data), dtype=np.int64)
+    tp[matched[first]] = 1
+
+    return tp.tolist(), (1 - tp).tolist()
+
+
+def cal_IoU_loop(ground_truth_data, dr_data):
 
     if len(ground_truth_data) == 0:
         if len(dr_data) == 0:
@@ -122,9 +170,12 @@ def AP_evaluation(gt, pred):
 
         gt_len += len(img['objects'])
 
-    # predictions
-    with open(pred, 'r') as json_file:
-        pred_data = json.load(json_file)
+    # predictions, either one JSON document or the JSON Lines stream of ResultWriter
+    if pred.endswith('.jsonl'):
+        pred_data = load_json_lines(pred)
+    else:
+        with open(pred, 'r') as json_file:
+            pred_data = json.load(json_file)
 
     param_num = int(pred_data['param_num'])
     inference_time = int(pred_data['inference_time'])
@@ -193,8 +244,50 @@ def AP_evaluation(gt, pred):
     return ap
 
 
+def check_parity(num_images=500, seed=0):
+    """
+    description: Compare cal_IoU against cal_IoU_loop on random images with integer and float boxes,
+                 duplicates, touching boxes and empty images.
+    return:
+        mismatches: number of images whose TP/FP differ
+    """
+
+    rng = np.random.RandomState(seed)
+    mismatches = 0
+    for index in range(num_images):
+        num_gt = rng.randint(0, 20)
+        num_dt = rng.randint(0, 300)
+        gt_xy = rng.uniform(0, 600, (num_gt, 2))
+        gt_boxes = np.concatenate([gt_xy, gt_xy + rng.uniform(1, 120, (num_gt, 2))], axis=1)
+
+        # Jittered copies of the ground truths, exact duplicates and random boxes
+        dt_boxes = rng.uniform(0, 600, (num_dt, 2))
+        dt_boxes = np.concatenate([dt_boxes, dt_boxes + rng.uniform(-2, 120, (num_dt, 2))], axis=1)
+        if num_gt > 0:
+            copies = rng.rand(num_dt) < 0.5
+            dt_boxes[copies] = gt_boxes[rng.randint(0, num_gt, copies.sum())] + rng.normal(0, 10, (copies.sum(), 4)) * (rng.rand(copies.sum(), 1) < 0.8)
+        if index % 2 == 0:
+            gt_boxes = np.round(gt_boxes)
+            dt_boxes = np.round(dt_boxes)
+            ground_truth_data = gt_boxes.astype(int).tolist()
+        else:
+            ground_truth_data = gt_boxes.tolist()
+        dr_data = dt_boxes.tolist()
+
+        if cal_IoU(ground_truth_data, dr_data) != cal_IoU_loop(ground_truth_data, dr_data):
+            mismatches += 1
+            print('Mismatch in image {}'.format(index))
+
+    return mismatches
+
+
 if __name__ == '__main__':
 
+    if len(sys.argv) > 1 and sys.argv[1] == 'parity':
+        mismatches = check_parity()
+        print('cal_IoU parity mismatches : {}'.format(mismatches))
+        sys.exit(1 if mismatches > 0 else 0)
+
     gt = sys.argv[1]
     pred = sys.argv[2]
 
@@ -0,0 +1,384 @@
+"""
+File: Backend.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import time
+import numpy as np
+import cv2
+
+from CPUPreProcessor import CPUPreProcessor, get_letterbox, PAD_VALUE
+from PostProcessor import PostProcessor
+from Metrics import now_ns, LatencyHistogram
+from Tracer import tracer
+
+MAX_OUTPUT_BBOX_COUNT = 1000
+
+class PipelineBackend(object):
+    """
+    description: The interface the pipeline stages run against.
+                 infer() must return an output array that stays valid after the next call.
+    """
+
+    def infer(self, input_img, batch_size):
+        """
+        description: Pre-process a batch of images and run the model on it.
+        param:
+            input_img:  a (batch, height, width, 3) uint8 BGR array
+            batch_size: number of valid images in input_img
+        return:
+            output: the raw model output, [num_boxes,cx,cy,w,h,conf,cls_id, ...] per image
+        """
+        raise NotImplementedError
+
+    def post_process(self, output, batch_size):
+        """
+        description: Decode the raw model output and run NMS.
+        return:
+            result_boxes, result_scores, result_classid
+        """
+        raise NotImplementedError
+
+    def get_proc_times(self):
+        """
+        description: Get and reset the accumulated pre-process, inference and post-process time.
+        return:
+            (pre_process_time, inference_time, post_process_time) in msec
+        """
+        raise NotImplementedError
+
+    def get_histograms(self):
+        """
+        description: Get the latency histograms of the pre-process, inference and post-process.
+        return:
+            histograms: a list of (name, LatencyHistogram) tuples
+        """
+        raise NotImplementedError
+
+    def destroy(self):
+        pass
+
+class TRTBackend(PipelineBackend):
+    """
+    description: A backend that runs the CUDA pre-processor and the TensorRT engine.
+    """
+
+    def __init__(self, pre_proc, infer_proc, post_proc):
+        print("TRTBackend init")
+
+        self.pre_proc = pre_proc
+        self.infer_proc = infer_proc
+        self.post_proc = post_proc
+
+    def destroy(self):
+        print("TRTBackend destroy")
+
+        self.pre_proc.destroy()
+        self.infer_proc.destroy()
+        self.post_proc.destroy()
+
+    def infer(self, input_img, batch_size):
+        with tracer.span("pre-process"):
+            self.pre_proc.preprocess_image(input_img, self.infer_proc.get_infer_ptr(), batch_size)
+        # The host output buffer is reused by the next inference, so hand a copy downstream
+        with tracer.span("inference"):
+            return np.copy(self.infer_proc.inference(batch_size))
+
+    def post_process(self, output, batch_size):
+        return self.post_proc.post_process(output, batch_size)
+
+    def get_proc_times(self):
+        proc_times = (self.pre_proc.proc_time, self.infer_proc.proc_time, self.post_proc.proc_time)
+
+        self.pre_proc.proc_time = 0
+        self.infer_proc.proc_time = 0
+        self.post_proc.proc_time = 0
+
+        return proc_times
+
+    def get_histograms(self):
+        return [("pre_process", self.pre_proc.latency),
+                ("inference", self.infer_proc.latency),
+                ("post_process", self.post_proc.latency)]
+
+class CPUBackend(PipelineBackend):
+    """
+    description: A CPU stand-in for the TensorRT engine. It pre-processes the input with CPUPreProcessor and
+                 emits a fixed set of synthetic detections in the engine output layout,
+                 so the pipeline can be run and tested without CUDA.
+    """
+
+    def __init__(self, input_shape, infer_shape, conf_threshold, iou_threshold, enable_profiling, nms_backend="numpy", pre_nms_top_k=-1, num_boxes=100, infer_delay=0, seed=0, frame_shape=None):
+        """
+        param:
+            input_shape:    shape the boxes are scaled back to
+            frame_shape:    shape of the images given to infer, input_shape unless the source letterboxes them already
+            nms_backend:    NMS backend of the PostProcessor, "numpy" or "torch"
+            pre_nms_top_k:  number of boxes per image the PostProcessor passes to NMS, -1 keeps all
+            num_boxes:      number of synthetic detections per image
+            infer_delay:    msec to sleep in every inference call, emulates the engine latency
+            seed:           random seed of the synthetic detections
+        """
+        print("CPUBackend init")
+
+        max_batch_size, input_height, input_width, input_channel = input_shape
+        max_batch_size, infer_height, infer_width, infer_channel = infer_shape
+
+        num_boxes = min(num_boxes, MAX_OUTPUT_BBOX_COUNT)
+        rng = np.random.RandomState(seed)
+        pred = np.zeros((num_boxes, 6), dtype=np.float32)
+        pred[:, 0] = rng.uniform(0, infer_width, num_boxes)
+        pred[:, 1] = rng.uniform(0, infer_height, num_boxes)
+        pred[:, 2] = rng.uniform(8, infer_width / 4, num_boxes)
+        pred[:, 3] = rng.uniform(8, infer_height / 4, num_boxes)
+        pred[:, 4] = rng.uniform(0, 1, num_boxes)
+        pred[:, 5] = rng.randint(0, 80, num_boxes)
+
+        output_size = 1 + MAX_OUTPUT_BBOX_COUNT * 6
+        output_template = np.zeros(output_size, dtype=np.float32)
+        output_template[0] = num_boxes
+        output_template[1:1 + num_boxes * 6] = pred.ravel()
+
+        self.max_batch_size = max_batch_size
+
+        self.infer_input = np.zeros((max_batch_size, infer_channel, infer_height, infer_width), dtype=np.float32)
+        self.output_template = output_template
+        self.output_size = output_size
+        self.infer_delay = infer_delay
+
+        self.pre_proc = CPUPreProcessor(frame_shape if frame_shape is not None else input_shape, infer_shape, enable_profiling)
+        self.post_proc = PostProcessor(input_shape, infer_shape, conf_threshold, iou_threshold, enable_profiling, nms_backend, pre_nms_top_k)
+
+        self.infer_proc_time = 0
+        self.infer_latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("CPUBackend destroy")
+
+        self.pre_proc.destroy()
+        self.post_proc.destroy()
+
+    def infer(self, input_img, batch_size):
+        with tracer.span("pre-process"):
+            self.pre_proc.preprocess_image(input_img, self.infer_input, batch_size)
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        with tracer.span("inference"):
+            if self.infer_delay > 0:
+                time.sleep(self.infer_delay / 1000)
+            output = np.tile(self.output_template, self.max_batch_size)
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.infer_latency.record(elapsed)
+            self.infer_proc_time += elapsed / 1e6
+
+        return output
+
+    def post_process(self, output, batch_size):
+        return self.post_proc.post_process(output, batch_size)
+
+    def get_proc_times(self):
+        proc_times = (self.pre_proc.proc_time, self.infer_proc_time, self.post_proc.proc_time)
+
+        self.pre_proc.proc_time = 0
+        self.infer_proc_time = 0
+        self.post_proc.proc_time = 0
+
+        return proc_times
+
+    def get_histograms(self):
+        return [("pre_process", self.pre_proc.latency),
+                ("inference", self.infer_latency),
+                ("post_process", self.post_proc.latency)]
+
+def get_tile_offsets(image_width, image_height, tile_width, tile_height, overlap):
+    """
+    description: Place overlapping tiles over an image, evenly spread so that the last tiles end at the image edges.
+    param:
+        overlap:    minimum overlap of neighbouring tiles in pixels, objects up to this size are whole in some tile
+    return:
+        tile_offsets: a (num_tiles, 2) int64 array of the [x, y] of every tile, row by row
+    """
+
+    if image_width < tile_width or image_height < tile_height:
+        raise ValueError("The image %dx%d is smaller than a tile %dx%d" % (image_width, image_height, tile_width, tile_height))
+    if overlap < 0 or overlap >= min(tile_width, tile_height):
+        raise ValueError("The tile overlap must be in [0, %d)" % min(tile_width, tile_height))
+
+    def get_starts(image_size, tile_size):
+        num = max(1, int(np.ceil((image_size - overlap) / (tile_size - overlap))))
+        return np.round(np.linspace(0, image_size - tile_size, num)).astype(np.int64)
+
+    xs = get_starts(image_width, tile_width)
+    ys = get_starts(image_height, tile_height)
+    return np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+
+class TiledBackend(PipelineBackend):
+    """
+    description: A backend that runs another backend on overlapping tiles of the frames instead of a letterbox
+                 of the whole frame, so small objects keep their full resolution. The tiles of the batch go
+                 through the engine as one batch and PostProcessor.post_process_tiles merges them per frame.
+    """
+
+    def __init__(self, tile_backend, frame_shape, tile_offsets, enable_profiling):
+        """
+        param:
+            tile_backend:   a TRTBackend or CPUBackend for (max_batch_size * num_tiles) tiles of the tile size,
+                            with the same tile size as input and inference shape
+            frame_shape:    (max_batch_size, height, width, channel) of the frames
+            tile_offsets:   a (num_tiles, 2) array from get_tile_offsets
+        """
+        print("TiledBackend init")
+
+        max_batch_size, frame_height, frame_width, frame_channel = frame_shape
+        tile_height = tile_backend.post_proc.input_height
+        tile_width = tile_backend.post_proc.input_width
+        num_tiles = len(tile_offsets)
+
+        if tile_backend.post_proc.max_batch_size < max_batch_size * num_tiles:
+            raise ValueError("The tile backend takes %d tiles, a batch has %d" % (tile_backend.post_proc.max_batch_size, max_batch_size * num_tiles))
+
+        self.tile_backend = tile_backend
+        self.tile_offsets = np.asarray(tile_offsets)
+        self.tiles = np.empty((max_batch_size * num_tiles, tile_height, tile_width, frame_channel), dtype=np.uint8)
+
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("TiledBackend destroy")
+
+        self.tile_backend.destroy()
+
+    def infer(self, input_img, batch_size):
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        tiles = self.tiles
+        tile_height, tile_width = tiles.shape[1:3]
+        num_tiles = len(self.tile_offsets)
+        with tracer.span("tile"):
+            for index in range(0, batch_size):
+                for tile_index, (x, y) in enumerate(self.tile_offsets):
+                    np.copyto(tiles[index * num_tiles + tile_index], input_img[index][y:y + tile_height, x:x + tile_width])
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return self.tile_backend.infer(tiles, batch_size * num_tiles)
+
+    def post_process(self, output, batch_size):
+        return self.tile_backend.post_proc.post_process_tiles(output, batch_size, self.tile_offsets)
+
+    def get_proc_times(self):
+        pre_process_time, inference_time, post_process_time = self.tile_backend.get_proc_times()
+        # Cutting the tiles is part of the pre-process
+        pre_process_time += self.proc_time
+        self.proc_time = 0
+
+        return pre_process_time, inference_time, post_process_time
+
+    def get_histograms(self):
+        return [("tile", self.latency)] + self.tile_backend.get_histograms()
+
+class CropBackend(PipelineBackend):
+    """
+    description: A backend that runs another backend on letterboxed regions of the frames instead of the whole frames,
+                 e.g. the moving regions of a MotionROI. The crops of a batch go through the engine as one batch and
+                 PostProcessor.post_process_crops maps their boxes back into the frames.
+    """
+
+    def __init__(self, crop_backend, enable_profiling):
+        """
+        param:
+            crop_backend:   a TRTBackend or CPUBackend with the inference shape as input and inference shape,
+                            its max batch size is the number of crops of a batch
+        """
+        print("CropBackend init")
+
+        post_proc = crop_backend.post_proc
+        self.crop_backend = crop_backend
+        self.crops = np.empty((post_proc.max_batch_size, post_proc.infer_height, post_proc.infer_width, post_proc.infer_channel), dtype=np.uint8)
+
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("CropBackend destroy")
+
+        self.crop_backend.destroy()
+
+    def infer(self, input_img, batch_size):
+        height, width = input_img[0].shape[:2]
+        return self.infer_crops(input_img, batch_size, [np.array([[0, 0, width, height]])] * batch_size)
+
+    def infer_crops(self, input_img, batch_size, rois):
+        """
+        description: Letterbox the regions of every image and run the model on all of them at once.
+        param:
+            rois:   a list of (N, 4) arrays, the [x, y, w, h] regions of every image, an image may have none
+        return:
+            output: the model output with the regions, for post_process
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        crops = np.concatenate([np.asarray(roi, dtype=np.int64).reshape(-1, 4) for roi in rois[:batch_size]])
+        crop_image_index = np.repeat(np.arange(batch_size), [len(roi) for roi in rois[:batch_size]])
+        if len(crops) > len(self.crops):
+            raise ValueError("A batch has %d crops, the crop backend takes %d" % (len(crops), len(self.crops)))
+
+        infer_height, infer_width = self.crops.shape[1:3]
+        with tracer.span("crop", {'crops': len(crops)}):
+            for index, (x, y, w, h) in enumerate(crops):
+                # The letterbox of CPUPreProcessor, so the boxes map back the same way
+                tw, th, tx1, ty1 = get_letterbox(w, h, infer_width, infer_height)
+                dst = self.crops[index]
+                dst[:ty1] = PAD_VALUE
+                dst[ty1 + th:] = PAD_VALUE
+                dst[ty1:ty1 + th, :tx1] = PAD_VALUE
+                dst[ty1:ty1 + th, tx1 + tw:] = PAD_VALUE
+                cv2.resize(input_img[crop_image_index[index]][y:y + h, x:x + w], (tw, th), dst=dst[ty1:ty1 + th, tx1:tx1 + tw])
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        output = None
+        if len(crops) > 0:
+            output = self.crop_backend.infer(self.crops, len(crops))
+        return (output, crops, crop_image_index)
+
+    def post_process(self, output, batch_size):
+        output, crops, crop_image_index = output
+        if output is None:
+            empty = np.zeros(0, dtype=np.float32)
+            return [np.zeros((0, 4), dtype=np.float32)] * batch_size, [empty] * batch_size, [empty] * batch_size
+        return self.crop_backend.post_proc.post_process_crops(output, batch_size, crops, crop_image_index)
+
+    def get_proc_times(self):
+        pre_process_time, inference_time, post_process_time = self.crop_backend.get_proc_times()
+        # Cropping is part of the pre-process
+        pre_process_time += self.proc_time
+        self.proc_time = 0
+
+        return pre_process_time, inference_time, post_process_time
+
+    def get_histograms(self):
+        return [("crop", self.latency)] + self.crop_backend.get_histograms()
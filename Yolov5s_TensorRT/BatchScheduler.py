@@ -0,0 +1,629 @@
+"""
+File: BatchScheduler.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import queue
+import threading
+import collections
+import numpy as np
+
+from Metrics import now_ns, LatencyHistogram
+from Tracer import tracer
+
+# Overload policies, every one but "none" is also the reason a shed frame is counted under
+SHED_POLICIES = ("none", "drop_oldest", "every_k", "deadline")
+
+class ScheduledBatch(object):
+    """
+    description: A batch of frames from one or more sources that lives in one slot of a StagingRing.
+                 The slot is reused once release() is called, so the images must not be used after it.
+    """
+
+    def __init__(self, scheduler, slot, images, batch_size, frame_indices, source_ids, frame_data):
+        self.scheduler = scheduler
+        self.slot = slot
+        self.images = images
+        self.batch_size = batch_size
+        self.frame_indices = frame_indices
+        self.source_ids = source_ids
+        self.frame_data = frame_data
+
+    def release(self):
+        self.scheduler.release_slot(self.slot)
+
+class ReleaseCounter(object):
+    """
+    description: Call release once it was called count times, for a batch whose frames are routed to several sinks.
+    """
+
+    def __init__(self, count, release):
+        self.count = count
+        self.release = release
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.count -= 1
+            done = self.count == 0
+        if done is True:
+            self.release()
+
+class PendingFrame(object):
+    """
+    description: A frame position in the staging slot of a BatchFill, the source reads the frame straight into it.
+    """
+
+    def __init__(self, fill, position, source_id, release):
+        self.fill = fill
+        self.position = position
+        self.source_id = source_id
+        # Gives the credit back to the source once the frame is batched or dropped
+        self.release = release
+
+        self.state = "reading"
+        # The position in a later slot the frame goes to when its own slot was batched before it arrived
+        self.moved_to = None
+        self.arrival = None
+        # now_ns() when the frame was captured, its age for the "deadline" policy counts from it
+        self.capture_time = None
+        self.frame_index = None
+        self.frame_data = None
+
+    def get_image(self):
+        return self.fill.images[self.position]
+
+class BatchFill(object):
+    """
+    description: The positions of a staging slot from first on, they are handed to the sources and the ready frames
+                 become one batch. Frames still being read into it when it is batched either stay in place as a new
+                 BatchFill of the positions behind the batch, or are copied to positions reserved for them in the slot being filled.
+    """
+
+    def __init__(self, slot, images, first=0):
+        self.slot = slot
+        self.images = images
+        self.first = first
+        self.frames = []
+        self.closed = False
+        self.full = False
+        self.batched = False
+
+    def count(self, state):
+        return sum(1 for frame in self.frames if frame.state == state)
+
+    def get_free_position(self):
+        used = set(frame.position for frame in self.frames)
+        for position in range(self.first, len(self.images)):
+            if position not in used:
+                return position
+        return None
+
+    def get_window(self, num_ready):
+        """
+        description: Find the run of num_ready positions no frame is being read into that holds most of the ready frames,
+                     the batch is compacted into it.
+        return:
+            start: first position of the run, None when every run of that length has a frame being read into it
+        """
+
+        states = ["free"] * len(self.images)
+        for frame in self.frames:
+            states[frame.position] = frame.state
+        best = None
+        for start in range(self.first, len(states) - num_ready + 1):
+            window = states[start:start + num_ready]
+            if "reading" in window:
+                continue
+            num_in_place = window.count("ready")
+            if best is None or num_in_place > best[1]:
+                best = (start, num_in_place)
+        return best[0] if best is not None else None
+
+class SourceWorker(threading.Thread):
+    """
+    description: A thread that reads frames of one source straight into positions of the staging slots and
+                 hands them to the scheduler. It blocks when num_buffers of its frames are still waiting for a batch.
+    """
+
+    def __init__(self, scheduler, source_id, read, num_frames, num_buffers, get_capture_time):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.scheduler = scheduler
+        self.source_id = source_id
+        self.read = read
+        self.num_frames = num_frames
+        self.get_capture_time = get_capture_time
+
+        # Credits for the frames of this source in the staging slots that are not batched yet
+        self.free_buffers = queue.Queue()
+        for _ in range(num_buffers):
+            self.free_buffers.put(True)
+
+        self.frame_count = 0
+        self.error = None
+
+    def get_frame(self):
+        # Never wait for the pipeline, the oldest frame of this source still waiting for a batch makes room
+        if self.scheduler.shed_policy == "drop_oldest":
+            try:
+                credit = self.free_buffers.get_nowait()
+            except queue.Empty:
+                frame = self.scheduler.drop_oldest(self.source_id)
+                if frame is not None:
+                    return frame
+                credit = self.free_buffers.get()
+        else:
+            credit = self.free_buffers.get()
+        if credit is None or self.scheduler.closed is True:
+            return None
+        return self.scheduler.reserve(self.source_id, self.free_buffers.put)
+
+    def run(self):
+        skip_interval = self.scheduler.skip_interval if self.scheduler.shed_policy == "every_k" else 1
+        frame = None
+        try:
+            for read_index in range(self.num_frames):
+                if frame is None:
+                    frame = self.get_frame()
+                    if frame is None:
+                        break
+
+                frame_index = self.scheduler.get_frame_index()
+                tracer.frame_begin(frame_index)
+                with tracer.span("capture", {'frame': frame_index, 'source': self.source_id}):
+                    result = self.read(frame.get_image())
+                if result is False:
+                    tracer.frame_end(frame_index)
+                    break
+
+                self.frame_count += 1
+                if read_index % skip_interval != 0:
+                    # Read to keep the source current, but only every k-th frame goes to a batch,
+                    # the next frame is read into the same position
+                    self.scheduler.count_shed("every_k", 1)
+                    tracer.frame_end(frame_index)
+                    continue
+
+                frame_data = None if result is True else result
+                capture_time = self.get_capture_time() if self.get_capture_time is not None else None
+                self.scheduler.put(frame, frame_index, frame_data, capture_time)
+                frame = None
+        except Exception as e:
+            print("Source '%s' failed: %s" % (self.source_id, e))
+            self.error = e
+        finally:
+            if frame is not None:
+                self.scheduler.cancel(frame)
+            self.scheduler.source_done()
+
+class BatchScheduler(object):
+    """
+    description: A BatchScheduler class that batches frames from several independent sources.
+                 A batch is flushed when it is full or when its oldest frame waited max_delay msec,
+                 so a large batch engine serves many sources without paying the full-batch latency at low load.
+                 The sources read straight into positions of the StagingRing slots and the batches are windows
+                 of them, a frame is only copied when it missed the batch of its slot while a later slot was
+                 being filled, or when a dropped frame left a gap in front of it.
+    """
+
+    def __init__(self, staging_ring, max_delay, num_buffers=2, shed_policy="none", skip_interval=2, max_age=None):
+        """
+        param:
+            staging_ring:   a StagingRing, its buffer shape sets the maximum batch size and the frame size
+            max_delay:      msec a frame may wait for the batch to fill
+            num_buffers:    frames per source that may wait for a batch
+            shed_policy:    what to do when the pipeline can't keep up with the sources,
+                            "none" processes every frame, the sources wait for the pipeline,
+                            "drop_oldest" keeps reading and drops the oldest frame of a source that waits for a batch,
+                            "every_k" only batches every skip_interval-th frame of a source,
+                            "deadline" drops the frames that were not batched within max_age msec of their capture
+            skip_interval:  k of the "every_k" policy
+            max_age:        msec of the "deadline" policy, must be larger than max_delay
+        """
+        print("BatchScheduler init")
+
+        if shed_policy not in SHED_POLICIES:
+            raise ValueError("Unknown shed policy: %s" % shed_policy)
+        if shed_policy == "every_k" and skip_interval < 1:
+            raise ValueError("Skip interval must be at least 1: %s" % skip_interval)
+        if shed_policy == "deadline" and (max_age is None or max_age <= max_delay):
+            raise ValueError("Max age must be larger than the max delay of %s msec: %s" % (max_delay, max_age))
+
+        max_batch_size, input_height, input_width, input_channel = staging_ring.input_shape
+
+        self.staging_ring = staging_ring
+        self.max_batch_size = max_batch_size
+        self.frame_shape = (input_height, input_width, input_channel)
+        self.max_delay_ns = int(max_delay * 1e6)
+        self.num_buffers = num_buffers
+        self.shed_policy = shed_policy
+        self.skip_interval = skip_interval
+        self.max_age_ns = int(max_age * 1e6) if max_age is not None else None
+
+        # The slots being filled in batch order and their ready frames in arrival order
+        self.fills = collections.deque()
+        self.pending = collections.deque()
+        self.acquiring = False
+        # Number of fills, batches and late frames that hold each slot, a slot goes back to the ring at zero
+        self.slot_holders = {}
+        self.condition = threading.Condition()
+        self.workers = []
+        self.active_sources = 0
+        self.next_frame_index = 0
+        self.closed = False
+
+        self.full_flush_count = 0
+        self.deadline_flush_count = 0
+        self.copy_count = 0
+        self.wait_latency = LatencyHistogram()
+        self.shed_counts = collections.OrderedDict((reason, 0) for reason in SHED_POLICIES[1:])
+
+    def destroy(self):
+        print("BatchScheduler destroy")
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        # Wake up the sources waiting for a slot or for their frames to be batched
+        self.staging_ring.close()
+        for worker in self.workers:
+            worker.free_buffers.put(None)
+            worker.join()
+
+        with self.condition:
+            for frame in self.pending:
+                tracer.frame_end(frame.frame_index)
+            self.pending.clear()
+            for fill in self.fills:
+                self.release_slot(fill.slot)
+            self.fills.clear()
+
+    def add_source(self, source_id, read, num_frames, get_capture_time=None):
+        """
+        description: Start reading a source.
+        param:
+            source_id:  an ID routed back with every frame of the source, e.g. a camera serial number
+            read:       read(dst) fills the (height, width, 3) uint8 array dst, returns False at the end of the source,
+                        any other value than True is handed on with the frame as its frame data
+            num_frames: maximum number of frames to read
+            get_capture_time:   optional, get_capture_time() gives the now_ns() when the frame just read was captured,
+                                else the frame counts as captured when the read returned
+        return:
+            no return
+        """
+
+        worker = SourceWorker(self, source_id, read, num_frames, self.num_buffers, get_capture_time)
+        with self.condition:
+            self.active_sources += 1
+        self.workers.append(worker)
+        worker.start()
+
+    def get_frame_index(self):
+        # Frame indices are unique over all sources, they are the trace IDs as well
+        with self.condition:
+            frame_index = self.next_frame_index
+            self.next_frame_index += 1
+        return frame_index
+
+    def add_fill(self):
+        """
+        description: Take a free slot of the ring as the slot being filled, called with the condition held.
+                     The condition is released while the ring is waited for, the caller has to check its state again.
+        """
+
+        if self.acquiring is True:
+            # Another thread is taking the next slot
+            self.condition.wait()
+            return
+
+        self.acquiring = True
+        self.condition.release()
+        try:
+            slot = self.staging_ring.acquire()
+        finally:
+            self.condition.acquire()
+            self.acquiring = False
+            self.condition.notify_all()
+
+        if slot is None:
+            self.closed = True
+        else:
+            self.slot_holders[slot] = 1
+            self.fills.append(BatchFill(slot, self.staging_ring.get_buffer(slot)))
+
+    def reserve(self, source_id, release):
+        """
+        description: Hand a source the next free position of the slot being filled, a new slot is taken when it is full.
+        param:
+            source_id:  the source that reads into the position
+            release:    gives the credit of the frame back to the source, called with True
+        return:
+            frame: a PendingFrame to read into, None once the scheduler is closed
+        """
+
+        with self.condition:
+            while self.closed is False:
+                fill = self.fills[-1] if len(self.fills) > 0 else None
+                if fill is None or fill.closed is True:
+                    self.add_fill()
+                    continue
+
+                return self.add_frame(fill, source_id, release)
+
+        release(True)
+        return None
+
+    def add_frame(self, fill, source_id, release):
+        # Called with the condition held and a free position in the fill
+        frame = PendingFrame(fill, fill.get_free_position(), source_id, release)
+        fill.frames.append(frame)
+        if fill.get_free_position() is None:
+            fill.closed = True
+            fill.full = True
+        return frame
+
+    def put(self, frame, frame_index, frame_data=None, capture_time=None):
+        with self.condition:
+            late_frame = frame.moved_to
+            if late_frame is None:
+                frame.state = "ready"
+                frame.arrival = now_ns()
+                frame.capture_time = capture_time if capture_time is not None else frame.arrival
+                frame.frame_index = frame_index
+                frame.frame_data = frame_data
+                self.pending.append(frame)
+                self.condition.notify_all()
+                return
+
+        # The slot was batched while the frame was being read, it goes to the position reserved for it
+        np.copyto(late_frame.get_image(), frame.get_image())
+        self.copy_count += 1
+        self.release_slot(frame.fill.slot)
+        self.put(late_frame, frame_index, frame_data, capture_time)
+
+    def cancel(self, frame):
+        # A position that was reserved but never filled, e.g. at the end of a source
+        with self.condition:
+            late_frame = frame.moved_to
+        if late_frame is not None:
+            self.release_slot(frame.fill.slot)
+            frame = late_frame
+        with self.condition:
+            frame.state = "dropped"
+            self.condition.notify_all()
+        frame.release(True)
+
+    def release_slot(self, slot):
+        with self.condition:
+            self.slot_holders[slot] -= 1
+            done = self.slot_holders[slot] == 0
+            if done is True:
+                del self.slot_holders[slot]
+        if done is True:
+            self.staging_ring.release(slot)
+
+    def source_done(self):
+        with self.condition:
+            self.active_sources -= 1
+            self.condition.notify_all()
+
+    def count_shed(self, reason, count):
+        with self.condition:
+            self.shed_counts[reason] += count
+
+    def get_shed_count(self):
+        return sum(self.shed_counts.values())
+
+    def drop_oldest(self, source_id):
+        """
+        description: Drop the oldest pending frame of a source and hand its position back to the source to read into.
+        return:
+            frame: the PendingFrame to read into, None when the source has no pending frame
+        """
+
+        with self.condition:
+            for index, frame in enumerate(self.pending):
+                if frame.source_id == source_id:
+                    del self.pending[index]
+                    self.shed_counts["drop_oldest"] += 1
+                    break
+            else:
+                return None
+
+            frame_index = frame.frame_index
+            frame.state = "reading"
+            frame.arrival = None
+            frame.capture_time = None
+            frame.frame_index = None
+            frame.frame_data = None
+
+        tracer.frame_end(frame_index)
+        return frame
+
+    def drop_expired(self):
+        # Called with the condition held, the pending queue is in arrival order but the sources capture at their own pace
+        deadline = now_ns() - self.max_age_ns
+        expired_frames = [frame for frame in self.pending if frame.capture_time < deadline]
+        for frame in expired_frames:
+            self.pending.remove(frame)
+            frame.state = "dropped"
+            self.shed_counts["deadline"] += 1
+            tracer.frame_end(frame.frame_index)
+            frame.release(True)
+
+    def check_error(self):
+        for worker in self.workers:
+            if worker.error is not None:
+                raise RuntimeError("Source '%s' failed" % worker.source_id) from worker.error
+
+    def get_frame_count(self):
+        return sum(worker.frame_count for worker in self.workers)
+
+    def keeps_late_frames(self, fill, start, num_ready):
+        """
+        description: Whether the frames still being read into the oldest slot can stay in place, called with the condition held.
+                     That is when no other slot is being filled and they all lie behind the batch but no ready frame does,
+                     the positions behind the batch are then filled as the next batch.
+        """
+
+        if self.fills[-1] is not fill:
+            return False
+        for frame in fill.frames:
+            behind = frame.position >= start + num_ready
+            if (frame.state == "reading" and behind is False) or (frame.state == "ready" and behind is True):
+                return False
+        return True
+
+    def take_batch(self, fill, start, ready, expired):
+        """
+        description: Take the ready frames of the oldest slot as a batch, called with the condition held.
+                     The frames still being read stay in place when keeps_late_frames() allows it,
+                     else they get their positions in the slot being filled.
+        return:
+            fill, start, frames: the slot, the first position of the batch and its ready frames
+        """
+
+        keep = self.keeps_late_frames(fill, start, len(ready))
+        self.fills.popleft()
+        fill.closed = True
+        fill.batched = True
+        if fill.full is True and expired is False:
+            self.full_flush_count += 1
+        else:
+            self.deadline_flush_count += 1
+
+        # The fill hands its hold of the slot to the batch
+        late_frames = [frame for frame in fill.frames if frame.state == "reading"]
+        if len(late_frames) > 0 and keep is True:
+            rest = BatchFill(fill.slot, fill.images, start + len(ready))
+            for frame in late_frames:
+                frame.fill = rest
+                rest.frames.append(frame)
+            if rest.get_free_position() is None:
+                rest.closed = True
+                rest.full = True
+            self.slot_holders[fill.slot] += 1
+            self.fills.append(rest)
+        elif len(late_frames) > 0:
+            # Every late frame holds the slot until it is copied
+            self.slot_holders[fill.slot] += len(late_frames)
+            open_fill = self.fills[-1]
+            for frame in late_frames:
+                frame.moved_to = self.add_frame(open_fill, frame.source_id, frame.release)
+
+        # Taken out of the pending queue here, so no frame of the batch is dropped any more
+        for frame in ready:
+            self.pending.remove(frame)
+        return fill, start, ready
+
+    def get_room(self):
+        # Free positions of the slot being filled, called with the condition held
+        if len(self.fills) < 2 or self.fills[-1].closed is True:
+            return 0
+        fill = self.fills[-1]
+        return len(fill.images) - fill.first - len(fill.frames)
+
+    def wait_for_batch(self):
+        """
+        description: Wait until the oldest slot is due, i.e. every frame read into it arrived or
+                     its oldest frame waited max_delay msec, and take its ready frames.
+        return:
+            fill, start, frames: see take_batch, None once every source is done
+        """
+
+        with self.condition:
+            while True:
+                if self.max_age_ns is not None and self.shed_policy == "deadline":
+                    self.drop_expired()
+                if len(self.fills) == 0:
+                    if self.active_sources == 0 or self.closed is True:
+                        return None
+                    self.condition.wait()
+                    continue
+
+                fill = self.fills[0]
+                ready = [frame for frame in fill.frames if frame.state == "ready"]
+                reading = fill.count("reading")
+                if self.active_sources == 0:
+                    fill.closed = True
+
+                expired = False
+                timeout = None
+                if len(ready) > 0:
+                    timeout = min(frame.arrival for frame in ready) + self.max_delay_ns - now_ns()
+                    if timeout <= 0:
+                        expired = True
+                        fill.closed = True
+                        timeout = None
+
+                if fill.closed is True and reading == 0:
+                    if len(ready) > 0:
+                        return self.take_batch(fill, fill.get_window(len(ready)), ready, expired)
+                    # Every frame of the slot was dropped
+                    self.fills.popleft()
+                    self.release_slot(fill.slot)
+                    continue
+
+                if expired is True and self.closed is False:
+                    start = fill.get_window(len(ready))
+                    if start is not None and self.keeps_late_frames(fill, start, len(ready)) is True:
+                        return self.take_batch(fill, start, ready, expired)
+                    # The frames still being read follow in the batch of the slot being filled
+                    if self.fills[-1] is fill:
+                        self.add_fill()
+                        continue
+                    if reading <= self.get_room() and start is not None:
+                        return self.take_batch(fill, start, ready, expired)
+
+                if self.closed is True:
+                    return None
+                self.condition.wait(timeout / 1e9 if timeout is not None else None)
+
+    def __iter__(self):
+        """
+        description: Yield the batches in slot order until every source is done.
+        return:
+            batch: a ScheduledBatch, call batch.release() once its images are no longer used
+        """
+
+        while True:
+            item = self.wait_for_batch()
+            if item is None:
+                break
+            fill, start, frames = item
+
+            # The frames in the batch window stay in place, the others move into its free positions
+            batch_size = len(frames)
+            window = [None] * batch_size
+            moved = []
+            for frame in frames:
+                if start <= frame.position < start + batch_size:
+                    window[frame.position - start] = frame
+                else:
+                    moved.append(frame)
+            for index in range(0, batch_size):
+                if window[index] is None:
+                    frame = moved.pop()
+                    np.copyto(fill.images[start + index], fill.images[frame.position])
+                    self.copy_count += 1
+                    window[index] = frame
+
+            flush_time = now_ns()
+            for frame in window:
+                frame.release(True)
+                self.wait_latency.record(flush_time - frame.arrival)
+
+            frame_indices = [frame.frame_index for frame in window]
+            source_ids = [frame.source_id for frame in window]
+            frame_data = [frame.frame_data for frame in window]
+            yield ScheduledBatch(self, fill.slot, fill.images[start:start + batch_size], batch_size, frame_indices, source_ids, frame_data)
+
+        self.check_error()
@@ -0,0 +1,248 @@
+"""
+File: CPUPreProcessor.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import sys
+import types
+import numpy as np
+import cv2
+
+from Metrics import now_ns, LatencyHistogram
+
+# The padding of the CUDA pre-processor (warpaffine_kernel in preprocess.cu), so both backends see the same border
+PAD_VALUE = 128
+
+def get_letterbox(input_width, input_height, infer_width, infer_height):
+    """
+    description: Size and offset of the resized image inside the padded inference image,
+                 computed the same way as YoLov5TRT.preprocess_image.
+    return:
+        tw, th, tx1, ty1: resized width and height, left and top padding
+    """
+
+    r_w = infer_width / input_width
+    r_h = infer_height / input_height
+    if r_h > r_w:
+        tw = infer_width
+        th = int(r_w * input_height)
+        tx1 = 0
+        ty1 = int((infer_height - th) / 2)
+    else:
+        tw = int(r_h * input_width)
+        th = infer_height
+        tx1 = int((infer_width - tw) / 2)
+        ty1 = 0
+    return tw, th, tx1, ty1
+
+class CPUPreProcessor(object):
+    """
+    description: A CPUPreProcessor class that does the transform of CUDA_PreProcessor.so on the CPU:
+                 convert BGR to RGB, resize and pad to target size, normalize to [0,1], transform to NCHW.
+    """
+
+    def __init__(self, input_shape, infer_shape, enable_profiling, enable_device_copy=False, pad_value=PAD_VALUE):
+        """
+        param:
+            input_shape:        (max_batch_size, height, width, channel) of the input images
+            infer_shape:        (max_batch_size, height, width, channel) of the inference input
+            enable_device_copy: copy the result to the device pointer given to preprocess_image,
+                                a drop-in replacement of PreProcessor on hosts without CUDA_PreProcessor.so
+            pad_value:          value of the padded border before the normalization
+        """
+        print("CPUPreProcessor init")
+
+        max_batch_size, input_height, input_width, input_channel = input_shape
+        max_batch_size, infer_height, infer_width, infer_channel = infer_shape
+
+        tw, th, tx1, ty1 = get_letterbox(input_width, input_height, infer_width, infer_height)
+
+        self.cfx = None
+        if enable_device_copy is True:
+            import pycuda.autoinit
+            import pycuda.driver as cuda
+
+            self.cfx = cuda.Device(0).make_context()
+            self.cuda = cuda
+            infer_input = cuda.pagelocked_empty((max_batch_size, infer_channel, infer_height, infer_width), np.float32)
+        else:
+            infer_input = np.empty((max_batch_size, infer_channel, infer_height, infer_width), dtype=np.float32)
+
+        self.input_width = input_width
+        self.input_height = input_height
+
+        self.infer_width = infer_width
+        self.infer_height = infer_height
+
+        self.tw = tw
+        self.th = th
+        self.tx1 = tx1
+        self.ty1 = ty1
+
+        self.pad_value = pad_value
+        self.max_batch_size = max_batch_size
+
+        self.img_resize = np.empty((max_batch_size, th, tw, input_channel), dtype=np.uint8)
+        self.infer_input = infer_input
+
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("CPUPreProcessor destroy")
+
+        if self.cfx is not None:
+            self.cfx.pop()
+
+    def preprocess_image(self, input_image, infer_ptr, batch_size):
+        """
+        description: Letterbox a batch of images into the inference input.
+        param:
+            input_image:    a (batch, height, width, 3) uint8 BGR array
+            infer_ptr:      a (max_batch_size, 3, infer_height, infer_width) float32 array to write into,
+                            or a device pointer when enable_device_copy is set
+            batch_size:     number of valid images in input_image
+        return:
+            infer_input: the written (batch_size, 3, infer_height, infer_width) array
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        if isinstance(infer_ptr, np.ndarray):
+            infer_input = infer_ptr[:batch_size]
+        else:
+            infer_input = self.infer_input[:batch_size]
+
+        tw = self.tw
+        th = self.th
+        tx1 = self.tx1
+        ty1 = self.ty1
+        pad_value = self.pad_value
+        img_resize = self.img_resize[:batch_size]
+
+        # Resizing is per channel, so it can run before the channel swap
+        for index in range(0, batch_size):
+            if input_image[index].shape[:2] == (th, tw):
+                np.copyto(img_resize[index], input_image[index])
+            else:
+                cv2.resize(input_image[index], (tw, th), dst=img_resize[index])
+
+        infer_input[:, :, :ty1, :] = pad_value
+        infer_input[:, :, ty1 + th:, :] = pad_value
+        infer_input[:, :, ty1:ty1 + th, :tx1] = pad_value
+        infer_input[:, :, ty1:ty1 + th, tx1 + tw:] = pad_value
+
+        # BGR to RGB and NHWC to NCHW in one strided copy of the whole batch
+        infer_input[:, :, ty1:ty1 + th, tx1:tx1 + tw] = img_resize[:, :, :, ::-1].transpose(0, 3, 1, 2)
+        infer_input /= 255.0
+
+        if self.cfx is not None and not isinstance(infer_ptr, np.ndarray):
+            self.cfx.push()
+            self.cuda.memcpy_htod(infer_ptr, infer_input)
+            self.cfx.pop()
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return infer_input
+
+def check_parity(sizes=((1920, 1080), (1280, 720), (640, 480), (480, 640), (640, 640)), infer_size=(640, 640), tolerance=1e-6, seed=0):
+    """
+    description: Compare CPUPreProcessor against the letterbox in inference_from_TRT_engine.YoLov5TRT.preprocess_image
+                 on random images of several input sizes. preprocess_image passes (128, 128, 128) in the dst position
+                 of cv2.copyMakeBorder and pads with 0, so its border is compared with the PAD_VALUE of the CUDA kernel.
+    return:
+        max_diff: the largest absolute difference over all sizes
+    """
+
+    tensorrt_c_inference_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Yolov5s_Python", "tensorrt_c_inference")
+    sys.path.insert(0, tensorrt_c_inference_dir)
+
+    # preprocess_image needs neither CUDA nor TensorRT, so empty modules stand in for the ones that are not installed
+    stubs = []
+    for name in ["pycuda", "pycuda.autoinit", "pycuda.driver", "tensorrt"]:
+        try:
+            __import__(name)
+        except Exception:
+            # pycuda.autoinit also fails on a host without a GPU
+            sys.modules[name] = types.ModuleType(name)
+            stubs.append(name)
+    if "pycuda.driver" in stubs:
+        sys.modules["pycuda"].driver = sys.modules["pycuda.driver"]
+    try:
+        from inference_from_TRT_engine import YoLov5TRT
+    finally:
+        for name in stubs:
+            del sys.modules[name]
+
+    class LetterboxShape(object):
+        pass
+
+    infer_width, infer_height = infer_size
+    shape = LetterboxShape()
+    shape.input_w = infer_width
+    shape.input_h = infer_height
+
+    rng = np.random.RandomState(seed)
+    batch_size = 2
+    max_diff = 0
+    for input_width, input_height in sizes:
+        images = rng.randint(0, 256, (batch_size, input_height, input_width, 3)).astype(np.uint8)
+
+        pre_proc = CPUPreProcessor((batch_size, input_height, input_width, 3), (batch_size, infer_height, infer_width, 3), False)
+        infer_input = np.zeros((batch_size, 3, infer_height, infer_width), dtype=np.float32)
+        pre_proc.preprocess_image(images, infer_input, batch_size)
+        pre_proc.destroy()
+
+        tw, th, tx1, ty1 = get_letterbox(input_width, input_height, infer_width, infer_height)
+        for index in range(0, batch_size):
+            reference = YoLov5TRT.preprocess_image(shape, images[index])[0][0]
+            reference[:, :ty1, :] = PAD_VALUE / 255.0
+            reference[:, ty1 + th:, :] = PAD_VALUE / 255.0
+            reference[:, ty1:ty1 + th, :tx1] = PAD_VALUE / 255.0
+            reference[:, ty1:ty1 + th, tx1 + tw:] = PAD_VALUE / 255.0
+            diff = float(np.abs(infer_input[index] - reference).max())
+            max_diff = max(max_diff, diff)
+            if diff > tolerance:
+                print("Mismatch at %dx%d, image %d (max diff: %g)" % (input_width, input_height, index, diff))
+
+    return max_diff
+
+def benchmark(input_size=(1920, 1080), infer_size=(640, 640), batch_sizes=(1, 2, 4, 8), repeat=20):
+    """
+    description: Print the average pre-process time per batch, the baseline the CUDA pre-processor is measured against.
+    """
+
+    input_width, input_height = input_size
+    infer_width, infer_height = infer_size
+
+    print("%8s %12s %12s" % ("batch", "batch(ms)", "image(ms)"))
+    for batch_size in batch_sizes:
+        images = np.random.randint(0, 256, (batch_size, input_height, input_width, 3)).astype(np.uint8)
+        pre_proc = CPUPreProcessor((batch_size, input_height, input_width, 3), (batch_size, infer_height, infer_width, 3), True)
+        infer_input = np.empty((batch_size, 3, infer_height, infer_width), dtype=np.float32)
+        for _ in range(repeat):
+            pre_proc.preprocess_image(images, infer_input, batch_size)
+        pre_proc.destroy()
+
+        batch_time = pre_proc.proc_time / repeat
+        print("%8d %12.3f %12.3f" % (batch_size, batch_time, batch_time / batch_size))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        max_diff = check_parity()
+        print('Pre-process parity max diff : {}'.format(max_diff))
+        sys.exit(1 if max_diff > 1e-6 else 0)
@@ -0,0 +1,163 @@
+"""
+File: FrameSource.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+from Tracer import tracer
+
+class FrameBatch(object):
+    """
+    description: A batch of decoded frames that lives in one slot of a StagingRing.
+                 The slot is reused once release() is called, so the images must not be used after it.
+    """
+
+    def __init__(self, source, slot, images, batch_size, frame_indices, save_names):
+        self.source = source
+        self.slot = slot
+        self.images = images
+        self.batch_size = batch_size
+        self.frame_indices = frame_indices
+        self.save_names = save_names
+
+    def release(self):
+        self.source.release(self.slot)
+
+class FrameSource(object):
+    """
+    description: A FrameSource class that scans an image directory once and decodes the frames
+                 on a thread pool straight into the batch buffers of a StagingRing.
+    """
+
+    def __init__(self, image_dir, name_format, start_frame, end_frame, staging_ring, num_workers):
+        """
+        param:
+            image_dir:      directory of the input images
+            name_format:    file name of a frame index, e.g. "%04d.jpg"
+            start_frame:    first frame index
+            end_frame:      frame index after the last one
+            staging_ring:   a StagingRing, its buffer shape sets the batch size and the frame size,
+                            frames of another size are counted in size_mismatch_count and skipped
+            num_workers:    number of decode threads
+        """
+        print("FrameSource init")
+
+        batch_size, input_height, input_width, input_channel = staging_ring.input_shape
+
+        # One directory scan instead of a failing imread per missing index
+        file_names = set(os.listdir(image_dir))
+        entries = []
+        for index in range(start_frame, end_frame):
+            save_name = name_format % index
+            if save_name in file_names:
+                entries.append((index, save_name, os.path.join(image_dir, save_name)))
+
+        self.entries = entries
+        self.staging_ring = staging_ring
+        self.ready_batches = queue.Queue()
+
+        self.batch_size = batch_size
+        self.input_width = input_width
+        self.input_height = input_height
+
+        self.size_mismatch_count = 0
+        self.count_lock = threading.Lock()
+
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.producer = threading.Thread(target=self.produce)
+        self.producer.daemon = True
+        self.producer.start()
+
+    def destroy(self):
+        print("FrameSource destroy")
+
+        self.closed = True
+        self.staging_ring.close()
+        self.producer.join()
+        self.executor.shutdown(wait=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def release(self, slot):
+        self.staging_ring.release(slot)
+
+    def produce(self):
+        batch_size = self.batch_size
+        entries = self.entries
+
+        for batch_start in range(0, len(entries), batch_size):
+            slot = self.staging_ring.acquire()
+            if slot is None or self.closed is True:
+                break
+
+            chunk = entries[batch_start:batch_start + batch_size]
+            futures = [self.executor.submit(self.decode, slot, index, entry) for index, entry in enumerate(chunk)]
+            self.ready_batches.put((slot, chunk, futures))
+
+        self.ready_batches.put(None)
+
+    def decode(self, slot, index, entry):
+        frame_index, save_name, image_path = entry
+        tracer.frame_begin(frame_index)
+
+        with tracer.span("decode", {'frame': frame_index}):
+            image = cv2.imread(image_path)
+            if image is None:
+                tracer.frame_end(frame_index)
+                return False
+
+            dst = self.staging_ring.get_buffer(slot)[index]
+            if image.shape != dst.shape:
+                # A resized frame would not match the boxes of the full size frames, so it is skipped
+                with self.count_lock:
+                    self.size_mismatch_count += 1
+                print("FrameSource skipped %s: %dx%d instead of %dx%d" % (save_name, image.shape[1], image.shape[0], self.input_width, self.input_height))
+                tracer.frame_end(frame_index)
+                return False
+            np.copyto(dst, image)
+        return True
+
+    def __iter__(self):
+        """
+        description: Yield the decoded batches in frame order.
+        return:
+            batch: a FrameBatch, call batch.release() once its images are no longer used
+        """
+
+        while True:
+            item = self.ready_batches.get()
+            if item is None:
+                return
+
+            slot, chunk, futures = item
+            decoded = [future.result() for future in futures]
+            images = self.staging_ring.get_buffer(slot)
+
+            # Move the frames that failed to decode out of the batch
+            valid = [index for index, ok in enumerate(decoded) if ok]
+            for dst_index, src_index in enumerate(valid):
+                if dst_index != src_index:
+                    images[dst_index] = images[src_index]
+
+            if len(valid) == 0:
+                self.release(slot)
+                continue
+
+            batch_size = len(valid)
+            frame_indices = [chunk[index][0] for index in valid]
+            save_names = [chunk[index][1] for index in valid]
+            yield FrameBatch(self, slot, images[:batch_size], batch_size, frame_indices, save_names)
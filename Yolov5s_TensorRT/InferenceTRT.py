@@ -9,13 +9,14 @@ The property of program is under Korea Electronics Technology Institute.
 For more information, contact us at <jw.jeong@keti.re.kr>.
 """
 
-import time
 import ctypes
 import pycuda.autoinit
 import pycuda.driver as cuda
 import pycuda.gpuarray as gpuarray
 import tensorrt as trt
 
+from Metrics import now_ns, LatencyHistogram
+
 class InferenceTRT(object):
     """
     description: A InferenceTRT class that warps TensorRT ops
@@ -69,6 +70,7 @@ class InferenceTRT(object):
         self.max_batch_size = max_batch_size
         
         self.proc_time = 0
+        self.latency = LatencyHistogram()
         self.enable_profiling = enable_profiling
         
     def destroy(self):
@@ -86,7 +88,7 @@ class InferenceTRT(object):
         """
         
         if self.enable_profiling == True:
-            start = time.time()
+            start = now_ns()
         
         context = self.context
         cuda_outputs = self.cuda_outputs
@@ -99,8 +101,9 @@ class InferenceTRT(object):
         self.cfx.pop()
         
         if self.enable_profiling == True:
-            end = time.time()
-            self.proc_time += (end - start) * 1000
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
         
         return host_outputs[0]
         
@@ -8,17 +8,34 @@ Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
 The property of program is under Korea Electronics Technology Institute.
 For more information, contact us at <jw.jeong@keti.re.kr>.
 """
-import json
+import os
 import sys
+import time
+import functools
+import threading
+import collections
 import numpy as np
 import random
-import threading
 import cv2
 
 from CameraZED import CameraZED
-from PreProcessor import PreProcessor
-from InferenceTRT import InferenceTRT
+from CameraReplay import CameraReplay
 from PostProcessor import PostProcessor
+from Backend import TRTBackend, CPUBackend, TiledBackend, CropBackend, get_tile_offsets
+from CPUPreProcessor import PAD_VALUE
+from Pipeline import Pipeline
+from FrameSource import FrameSource
+from StagingRing import StagingRing
+from BatchScheduler import BatchScheduler, ReleaseCounter
+from OutputWriter import OutputWriter, VIDEO_EXTENSIONS
+from ResultWriter import ResultWriter
+from SceneGate import SceneGate
+from OverlayRenderer import OverlayRenderer
+from MotionROI import MotionROI
+from SortTracker import SortTracker
+from WorkerPool import WorkerPool
+from Metrics import MetricsRegistry, MetricsExporter
+from Tracer import tracer
 
 ENABLE_DUMMY_INPUT = True
 ENABLE_DRAW_BOX = True
@@ -28,6 +45,12 @@ ENABLE_CAMERA_LIVE = False
 ENABLE_WRITE_JSON = False
 ENABLE_SHOW_OUTPUT = False
 ENABLE_WRITE_OUTPUT = True
+ENABLE_CPU_BACKEND = False
+ENABLE_CPU_PRE_PROCESS = False
+ENABLE_METRICS_EXPORT = False
+ENABLE_TRACE = False
+ENABLE_SCENE_GATE = False
+ENABLE_MOTION_ROI = False
 
 INPUT_WIDTH = 1920
 INPUT_HEIGHT = 1080
@@ -38,18 +61,100 @@ INFER_HEIGHT = 640
 
 CONF_THRESH = 0.01
 IOU_THRESHOLD = 0.6
+NMS_BACKEND = "numpy"
+# Best boxes kept of every decoded image (of every tile with tiled inference) before NMS, -1 keeps all.
+# It has to be below the MAX_OUTPUT_BBOX_COUNT boxes an image decodes into to take effect
+PRE_NMS_TOP_K = 300
 
 BATCH_SIZE = 1
-if BATCH_SIZE > 1:
-    ENABLE_DRAW_FPS = False
-    ENABLE_CAMERA_LIVE = False
-    ENABLE_WRITE_JSON = False
-    ENABLE_SHOW_OUTPUT = False
 
+# Detect on overlapping INFER_WIDTH x INFER_HEIGHT tiles of the full resolution frame instead of its letterbox,
+# the tiles of a batch run as one engine batch of BATCH_SIZE * tiles per frame, at most the engine max batch size
+ENABLE_TILED_INFERENCE = False
+TILE_OVERLAP = 128
+
+# One source per camera, serial numbers given on the command line replace this list
+CAMERA_SERIALS = [22246603]
 CAMERA_TOTAL_FRAME = 1000
+# Grab continuously on a background thread and always hand out the newest frame
+ENABLE_BACKGROUND_CAPTURE = True
+# Rectify and letterbox camera frames to the inference size in one remap,
+# the full resolution frame is rectified only for the output
+ENABLE_FUSED_RECTIFY = False
+# Recordings of CameraReplay.py replayed instead of the cameras, for reproducible measurements without a ZED
+CAMERA_REPLAY_PATHS = []
+# Pace the replay by the recorded timestamps, otherwise replay as fast as possible
+ENABLE_REPLAY_REALTIME = True
+# A batch of camera frames is flushed when it is full or when its oldest frame waited this long (msec)
+BATCH_MAX_DELAY = 20
+# Overload policy of the camera sources: "none", "drop_oldest", "every_k" or "deadline"
+SHED_POLICY = "none"
+# "every_k" batches every SHED_SKIP_INTERVAL-th frame of a camera
+SHED_SKIP_INTERVAL = 2
+# "deadline" drops frames that were not batched this long after their capture (msec)
+SHED_MAX_AGE = 100
+
+# A frame whose thumbnail differs less than SCENE_GATE_THRESHOLD gray levels on average from the last inferred frame
+# of its source reuses those detections, at most SCENE_GATE_MAX_REUSE frames in a row
+SCENE_GATE_THRESHOLD = 1.5
+SCENE_GATE_MAX_REUSE = 30
+SCENE_GATE_SIZE = (64, 36)
+
+# Detect only on the letterboxed regions of a frame that differ from a running average background of the source,
+# kept at 1/MOTION_ROI_SCALE resolution. At most MOTION_ROI_MAX_ROIS regions per frame go into one engine batch,
+# a frame whose regions cover more than MOTION_ROI_MAX_COVERAGE and every MOTION_ROI_FULL_INTERVAL-th frame are detected whole
+MOTION_ROI_SCALE = 8
+MOTION_ROI_THRESHOLD = 15
+MOTION_ROI_MIN_AREA = 4
+MOTION_ROI_MARGIN = 32
+MOTION_ROI_MAX_ROIS = 4
+MOTION_ROI_MAX_COVERAGE = 0.5
+MOTION_ROI_FULL_INTERVAL = 30
+MOTION_ROI_LEARNING_RATE = 0.05
+
+# Run the detector on every KEYFRAME_INTERVAL-th frame of a source, a SORT tracker carries the boxes in between
+KEYFRAME_INTERVAL = 1
+TRACKER_IOU_THRESHOLD = 0.3
+TRACKER_MAX_AGE = 3
+
+PIPELINE_QUEUE_DEPTH = 2
+
+# Boxes below DRAW_SCORE_THRESHOLD are not drawn, the JSON results keep them.
+# With DRAW_PREVIEW_SCALE below 1 the boxes are drawn on a downscaled copy, which is shown and written instead of the frame
+DRAW_SCORE_THRESHOLD = 0.25
+DRAW_PREVIEW_SCALE = 1.0
+
+# Decode, WORKER_POOL_PROCESSES inference and post-process workers and the output run as separate processes
+# that pass the image directory frames through shared memory, Python 3.8 or later
+ENABLE_WORKER_POOL = False
+WORKER_POOL_PROCESSES = 2
+WORKER_POOL_SLOTS = 8
+WORKER_POOL_MAX_BOXES = 1000
+
+IMAGE_DIR = "image/test"
+IMAGE_NAME_FORMAT = "%04d.jpg"
+FRAME_SOURCE_WORKERS = 4
+
+STAGING_RING_BUFFERS = 4
+ENABLE_PAGELOCKED_STAGING = True
+
+OUTPUT_PATH = "output"
+OUTPUT_NAME_FORMAT = "%04d.jpg"
+OUTPUT_WRITER_WORKERS = 2
+OUTPUT_WRITER_QUEUE_SIZE = 4
+OUTPUT_WRITER_POLICY = "block"
 
 ENGINE_PATH = "./yolov5s_w0.04_d0.33_BATCH32.engine"
-JSON_PATH = "./result.json"
+JSON_PATH = "./result.jsonl"
+JSON_FLUSH_INTERVAL = 1
+
+METRICS_PATH = "./metrics.prom"
+METRICS_EXPORT_INTERVAL = 5
+
+# Chrome trace-event JSON, open it in chrome://tracing or ui.perfetto.dev
+# It is written at the end of the run and on SIGUSR1
+TRACE_PATH = "./trace.json"
+TRACE_BUFFER_SIZE = 100000
 
 categories = ["person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
             "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
@@ -124,194 +229,472 @@ def draw_fps(img, fps):
         lineType=cv2.LINE_AA,
     )
 
-def plot_one_box(x, img, class_id=None, label=None, line_thickness=None):
+def capture_camera(camera_wrapper, dst):
+    return camera_wrapper.capture_left(dst) is not None
+
+def capture_camera_infer(camera_wrapper, dst):
+    # The raw left half travels with the frame, the output stage rectifies it at full resolution
+    infer_img, raw_left = camera_wrapper.capture_left_infer(dst)
+    return raw_left if raw_left is not None else False
+
+def get_source_output_path(output_path, source_id, num_sources):
     """
-    description: Plots one bounding box on image img,
-                 this function comes from YoLov5 project.
-    param: 
-        x:      a box likes [x1,y1,x2,y2]
-        img:    a opencv image object
-        color:  color to draw rectangle, such as (0,255,0)
-        label:  str
-        line_thickness: int
-    return:
-        no return
+    description: Output path of one source, a sub-directory or a suffixed video file when there are several.
+    """
+    
+    if num_sources == 1:
+        return output_path
+    
+    root, ext = os.path.splitext(output_path)
+    if output_path.lower().endswith(VIDEO_EXTENSIONS):
+        return "%s_%s%s" % (root, source_id, ext)
+    return os.path.join(output_path, str(source_id))
 
+class BatchJob(object):
+    """
+    description: A batch of frames travelling through the pipeline stages.
+                 The frame indices are also the trace IDs of the frames.
+                 The source IDs route every frame back to the source it came from, None is the only source.
+                 The frame data are the raw frames of a fused rectify source, None otherwise.
+                 release() gives the frame buffers back once, to the first of the output writers or a failed stage.
     """
     
-    tl = (
-        line_thickness or round(0.002 * (img.shape[0] + img.shape[1]) / 2) + 1
-    )  # line/font thickness
-    #color = color or [random.randint(0, 255) for _ in range(3)]
-    color = text_color[class_id % len(text_color)]
-    c1, c2 = (int(x[0]), int(x[1])), (int(x[2]), int(x[3]))
-    cv2.rectangle(img, c1, c2, color, thickness=2, lineType=cv2.LINE_AA)
-    if label:
-        tf = max(tl - 1, 1)  # font thickness
-        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=2)[0]
-        c2 = c1[0] + t_size[0], c1[1] - t_size[1] - 3
-        #cv2.rectangle(img, c1, c2, color, -1, cv2.LINE_AA)  # filled
-        cv2.putText(
-            img,
-            label,
-            (c1[0], c1[1] - 2),
-            0,
-            tl / 3,
-            color,
-            thickness=2,
-            lineType=cv2.LINE_AA,
-        )
-
-def plot_one_box_batch(x, img_arr, class_id=None, label=None, line_thickness=None):
-    x1 = int(x[0]) % INPUT_WIDTH
-    y1 = int(x[1]) % INPUT_WIDTH
-    x2 = int(x[2]) % INPUT_WIDTH
-    y2 = int(x[3]) % INPUT_WIDTH
-    img_idx_1 = int(x[0]) / (INPUT_WIDTH * 2)
-    img_idx_2 = int(x[1]) / (INPUT_WIDTH * 2)
-
-    if img_idx_1 > img_idx_2:
-        img_idx = int(img_idx_1)
+    def __init__(self, input_img, batch_size, frame_indices, save_names, release=None, source_ids=None, frame_data=None):
+        self.input_img = input_img
+        self.batch_size = batch_size
+        self.frame_indices = frame_indices
+        self.save_names = save_names
+        self.release_func = release
+        self.release_lock = threading.Lock()
+        self.source_ids = source_ids if source_ids is not None else [None] * batch_size
+        self.frame_data = frame_data if frame_data is not None else [None] * batch_size
+        
+        # Frames the detector runs on, None is every frame
+        self.infer_indices = None
+        
+        self.output = None
+        self.result_boxes = None
+        self.result_scores = None
+        self.result_classid = None
+        self.result_track_ids = None
+    
+    def release(self):
+        # The output writers release the job, or a pipeline stage that failed on it, whichever comes first
+        with self.release_lock:
+            release_func = self.release_func
+            self.release_func = None
+        if release_func is not None:
+            release_func()
+
+class StageTRT(object):
+    """
+    description: The stage functions of the deployment pipeline.
+                 Decoding runs on the caller's thread, the others on pipeline workers.
+    """
+    
+    def __init__(self, backend, result_writer, output_writers, camera_wrappers=None, scene_gate=None, trackers=None, keyframe_interval=1, motion_roi=None, overlay_renderer=None):
+        """
+        param:
+            output_writers:     a dict of source ID to OutputWriter
+            camera_wrappers:    a dict of source ID to CameraZED, rectifies the raw frames of a fused rectify source
+            scene_gate:         a SceneGate, static frames reuse the detections of the last inferred frame of their source
+            trackers:           a dict of source ID to SortTracker, required when keyframe_interval is above 1
+            keyframe_interval:  the detector runs on every keyframe_interval-th frame of a source, the trackers predict the others
+            motion_roi:         a MotionROI, the detector runs on the moving regions of the frames only, needs a CropBackend
+            overlay_renderer:   an OverlayRenderer that draws the boxes, None draws nothing
+        """
+        
+        self.backend = backend
+        self.result_writer = result_writer
+        self.output_writers = output_writers
+        self.camera_wrappers = camera_wrappers if camera_wrappers is not None else {}
+        self.scene_gate = scene_gate
+        self.trackers = trackers
+        self.keyframe_interval = keyframe_interval
+        self.motion_roi = motion_roi
+        self.overlay_renderer = overlay_renderer
+        self.last_output_time = None
+        
+        # Frames seen per source, only used by the infer stage
+        self.frame_counts = collections.defaultdict(int)
+        # Detections of the last inferred frame of every source, only used by the post-process stage
+        self.last_results = {}
+    
+    def need_inference(self, source_id, image):
+        frame_count = self.frame_counts[source_id]
+        self.frame_counts[source_id] += 1
+        if frame_count % self.keyframe_interval != 0:
+            return False
+        if self.scene_gate is not None:
+            return self.scene_gate.check(source_id, image) is False
+        return True
+    
+    def infer_stage(self, job):
+        if self.scene_gate is not None or self.keyframe_interval > 1:
+            with tracer.span("select frames", {'frames': job.frame_indices}):
+                infer_indices = [index for index in range(0, job.batch_size) if self.need_inference(job.source_ids[index], job.input_img[index])]
+            if len(infer_indices) < job.batch_size:
+                job.infer_indices = infer_indices
+        
+        if job.infer_indices is None:
+            with tracer.span("infer stage", {'frames': job.frame_indices}):
+                job.output = self.infer_frames(job, job.input_img, range(0, job.batch_size))
+        elif len(job.infer_indices) > 0:
+            with tracer.span("infer stage", {'frames': [job.frame_indices[index] for index in job.infer_indices]}):
+                job.output = self.infer_frames(job, job.input_img[job.infer_indices], job.infer_indices)
+        return job
+    
+    def infer_frames(self, job, input_img, indices):
+        if self.motion_roi is None:
+            return self.backend.infer(input_img, len(indices))
+        
+        with tracer.span("motion roi", {'frames': [job.frame_indices[index] for index in indices]}):
+            rois = [self.motion_roi.get_rois(job.source_ids[index], job.input_img[index]) for index in indices]
+        return self.backend.infer_crops(input_img, len(indices), rois)
+    
+    def post_process_stage(self, job):
+        with tracer.span("post-process", {'frames': job.frame_indices}):
+            if job.infer_indices is None:
+                job.result_boxes, job.result_scores, job.result_classid = self.backend.post_process(job.output, job.batch_size)
+            elif len(job.infer_indices) > 0:
+                job.result_boxes, job.result_scores, job.result_classid = self.backend.post_process(job.output, len(job.infer_indices))
+            else:
+                job.result_boxes, job.result_scores, job.result_classid = [], [], []
+        job.output = None
+        
+        if self.keyframe_interval > 1:
+            with tracer.span("track", {'frames': job.frame_indices}):
+                self.fill_tracked_results(job)
+        elif self.scene_gate is not None:
+            self.fill_reused_results(job)
+        return job
+    
+    def get_inferred_results(self, job):
+        infer_indices = job.infer_indices if job.infer_indices is not None else range(0, job.batch_size)
+        return dict(zip(infer_indices, zip(job.result_boxes, job.result_scores, job.result_classid)))
+    
+    def fill_reused_results(self, job):
+        # Jobs arrive in order, so the last inferred frame of a source is known before the frames that reuse it
+        inferred = self.get_inferred_results(job)
+        
+        result_boxes, result_scores, result_classid = [], [], []
+        for index in range(0, job.batch_size):
+            source_id = job.source_ids[index]
+            if index in inferred:
+                self.last_results[source_id] = inferred[index]
+            boxes, scores, classid = self.last_results[source_id]
+            result_boxes.append(boxes)
+            result_scores.append(scores)
+            result_classid.append(classid)
+        
+        job.result_boxes, job.result_scores, job.result_classid = result_boxes, result_scores, result_classid
+    
+    def fill_tracked_results(self, job):
+        # The trackers see the frames of their source in order, the detections correct them and every other frame is predicted
+        inferred = self.get_inferred_results(job)
+        
+        result_boxes, result_scores, result_classid, result_track_ids = [], [], [], []
+        for index in range(0, job.batch_size):
+            tracker = self.trackers[job.source_ids[index]]
+            if index in inferred:
+                boxes, scores, classid, track_ids = tracker.update(*inferred[index])
+            else:
+                boxes, scores, classid, track_ids = tracker.predict()
+            result_boxes.append(boxes)
+            result_scores.append(scores)
+            result_classid.append(classid)
+            result_track_ids.append(track_ids)
+        
+        job.result_boxes, job.result_scores, job.result_classid = result_boxes, result_scores, result_classid
+        job.result_track_ids = result_track_ids
+    
+    def get_output_images(self, job):
+        if job.frame_data[0] is None or (ENABLE_SHOW_OUTPUT is False and len(self.output_writers) == 0):
+            return job.input_img
+        
+        # The batch holds the letterboxed inference images, the boxes belong to the full resolution frames
+        with tracer.span("rectify", {'frames': job.frame_indices}):
+            return [self.camera_wrappers[job.source_ids[index]].rectify_left(job.frame_data[index]) for index in range(0, job.batch_size)]
+    
+    def output_stage(self, job):
+        out_img = self.get_output_images(job)
+        
+        if self.overlay_renderer is not None:
+            with tracer.span("draw", {'frames': job.frame_indices}):
+                out_img = self.overlay_renderer.render_batch(out_img, job.batch_size, job.result_boxes, job.result_scores, job.result_classid, job.result_track_ids)
+        
+        if self.result_writer is not None:
+            with tracer.span("write json", {'frames': job.frame_indices}):
+                for index in range(0, job.batch_size):
+                    track_ids = job.result_track_ids[index] if job.result_track_ids is not None else None
+                    self.result_writer.write(job.save_names[index], job.result_boxes[index], job.result_scores[index], track_ids)
+        
+        if ENABLE_DRAW_FPS is True:
+            now = time.time()
+            if self.last_output_time is not None:
+                fps = job.batch_size / (now - self.last_output_time)
+                for index in range(0, job.batch_size):
+                    draw_fps(out_img[index], fps)
+            self.last_output_time = now
+        
+        # Route the frames back to their sources
+        source_frames = collections.OrderedDict()
+        for index in range(0, job.batch_size):
+            source_frames.setdefault(job.source_ids[index], []).append(index)
+        
+        if ENABLE_SHOW_OUTPUT is True:
+            for source_id, indices in source_frames.items():
+                window_name = "result" if source_id is None else "result %s" % source_id
+                cv2.imshow(window_name, out_img[indices[0]])
+            cv2.waitKey(1)
+        
+        # The writers release the frame buffers once every frame of the batch is encoded
+        release = job.release
+        if len(source_frames) > 1:
+            release = ReleaseCounter(len(source_frames), release)
+        
+        for source_id, indices in source_frames.items():
+            frame_indices = [job.frame_indices[index] for index in indices]
+            output_writer = self.output_writers.get(source_id)
+            if output_writer is not None:
+                images = out_img if len(source_frames) == 1 else [out_img[index] for index in indices]
+                output_writer.write(frame_indices, images, len(indices), release)
+            else:
+                for frame_index in frame_indices:
+                    tracer.frame_end(frame_index)
+                release()
+        
+        return None
+
+def create_model_backend(input_shape, infer_shape, frame_shape):
+    if ENABLE_CPU_BACKEND is True:
+        return CPUBackend(input_shape, infer_shape, CONF_THRESH, IOU_THRESHOLD, ENABLE_TIME_PROFILE, nms_backend=NMS_BACKEND, pre_nms_top_k=PRE_NMS_TOP_K, frame_shape=frame_shape)
+    
+    from InferenceTRT import InferenceTRT
+    
+    if ENABLE_CPU_PRE_PROCESS is True:
+        from CPUPreProcessor import CPUPreProcessor
+        pre_process_wrapper = CPUPreProcessor(frame_shape, infer_shape, ENABLE_TIME_PROFILE, enable_device_copy=True)
     else:
-        img_idx = int(img_idx_2)
+        from PreProcessor import PreProcessor
+        pre_process_wrapper = PreProcessor(frame_shape, infer_shape, ENABLE_TIME_PROFILE)
+    inference_trt_wrapper = InferenceTRT(ENGINE_PATH, infer_shape[0], ENABLE_TIME_PROFILE)
+    post_process_wrapper = PostProcessor(input_shape, infer_shape, CONF_THRESH, IOU_THRESHOLD, ENABLE_TIME_PROFILE, NMS_BACKEND, PRE_NMS_TOP_K)
+    return TRTBackend(pre_process_wrapper, inference_trt_wrapper, post_process_wrapper)
 
-    if x2 < x1:
-        if INPUT_WIDTH - abs(x1) < abs(x2):
-            x1 -= INPUT_WIDTH
-        else:
-            x2 += INPUT_WIDTH
-    if y2 < y1:
-        if INPUT_WIDTH - abs(y1) < abs(y2):
-            y1 -= INPUT_WIDTH
-        else:
-            y2 += INPUT_WIDTH
+def create_backend(frame_shape):
+    """
+    description: Build the configured backend, a worker pool process calls it for its own backend.
+    param:
+        frame_shape:    (batch, height, width, channel) of the frames handed to infer
+    """
+    
+    if ENABLE_MOTION_ROI is True:
+        crop_shape = (BATCH_SIZE * MOTION_ROI_MAX_ROIS, INFER_HEIGHT, INFER_WIDTH, 3)
+        return CropBackend(create_model_backend(crop_shape, crop_shape, crop_shape), ENABLE_TIME_PROFILE)
+    
+    if ENABLE_TILED_INFERENCE is True:
+        tile_offsets = get_tile_offsets(frame_shape[2], frame_shape[1], INFER_WIDTH, INFER_HEIGHT, TILE_OVERLAP)
+        tile_shape = (BATCH_SIZE * len(tile_offsets), INFER_HEIGHT, INFER_WIDTH, 3)
+        return TiledBackend(create_model_backend(tile_shape, tile_shape, tile_shape), frame_shape, tile_offsets, ENABLE_TIME_PROFILE)
+    
+    return create_model_backend((BATCH_SIZE, INPUT_HEIGHT, INPUT_WIDTH, 3), (BATCH_SIZE, INFER_HEIGHT, INFER_WIDTH, 3), frame_shape)
 
-    img = img_arr[img_idx]
+def create_overlay_renderer():
+    if ENABLE_DRAW_BOX is False:
+        return None
+    return OverlayRenderer(categories, text_color, DRAW_SCORE_THRESHOLD, DRAW_PREVIEW_SCALE, ENABLE_TIME_PROFILE)
 
-    c1, c2 = (x1, y1), (x2, y2)
-    if c2[0] < c1[0]:
-        c2 = list(c2)
-        c2[0] += INPUT_WIDTH
-        c2 = tuple(c2)
-    if c2[1] < c1[1]:
-        c2 = list(c2)
-        c2[1] += INPUT_WIDTH
-        c2 = tuple(c2)
+class PoolImageReader(object):
+    """
+    description: Reads the image directory frames in the capture process of the worker pool.
+    """
+    
+    def __init__(self, image_dir, name_format, start_frame, end_frame):
+        # One directory scan instead of a failing imread per missing index
+        file_names = set(os.listdir(image_dir))
+        self.save_names = [name_format % index for index in range(start_frame, end_frame) if name_format % index in file_names]
+        self.image_dir = image_dir
+        self.position = 0
+        self.size_mismatch_count = 0
+    
+    def __call__(self, dst):
+        while self.position < len(self.save_names):
+            save_name = self.save_names[self.position]
+            self.position += 1
+            image = cv2.imread(os.path.join(self.image_dir, save_name))
+            if image is None:
+                continue
+            if image.shape != dst.shape:
+                # Frames of another size are skipped like in FrameSource
+                self.size_mismatch_count += 1
+                print("PoolImageReader skipped %s: %dx%d instead of %dx%d" % (save_name, image.shape[1], image.shape[0], dst.shape[1], dst.shape[0]))
+                continue
+            np.copyto(dst, image)
+            return save_name
+        if self.size_mismatch_count > 0:
+            print("PoolImageReader skipped %d frames of another size" % self.size_mismatch_count)
+        return False
 
-    tl = (
-            line_thickness or round(0.002 * (img.shape[0] + img.shape[1]) / 2) + 1
-    )  # line/font thickness
-    # color = color or [random.randint(0, 255) for _ in range(3)]
-    color = text_color[class_id % len(text_color)]
-
-    cv2.rectangle(img, c1, c2, color, thickness=2, lineType=cv2.LINE_AA)
-    if label:
-        tf = max(tl - 1, 1)  # font thickness
-        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=2)[0]
-        c2 = c1[0] + t_size[0], c1[1] - t_size[1] - 3
-        #cv2.rectangle(img, c1, c2, color, -1, cv2.LINE_AA)  # filled
-        cv2.putText(
-            img,
-            label,
-            (c1[0], c1[1] - 2),
-            0,
-            tl / 3,
-            color,
-            thickness=2,
-            lineType=cv2.LINE_AA,
-        )
-
-def save_ap_json(annots):
-    # Dump Json
-    with open(JSON_PATH, 'w') as json_file:
-        json.dump(annots, json_file, indent=2)
-
-class ThreadTRT(threading.Thread):
-    def __init__(self, pre_proc, infer_proc, post_proc, input_img, batch_size, annots, save_name, enable_draw_box, enable_write_json):
-        threading.Thread.__init__(self)
-        self.pre_proc = pre_proc
-        self.infer_proc = infer_proc
-        self.post_proc = post_proc
-        self.input_img = input_img
-        self.batch_size = batch_size
-        self.annots = annots
-        self.save_name = save_name
-        
-        self.enable_draw_box = enable_draw_box
-        self.enable_write_json = enable_write_json
+class PoolSink(object):
+    """
+    description: Draws and writes the results in the sink process of the worker pool.
+                 The frame is drawn on in place, its slot is reused only after write returns.
+    """
+    
+    def __init__(self):
+        self.result_writer = None
+        if ENABLE_WRITE_JSON is True:
+            self.result_writer = ResultWriter(JSON_PATH, 1000, JSON_FLUSH_INTERVAL)
+        if ENABLE_WRITE_OUTPUT is True and os.path.isdir(OUTPUT_PATH) == False:
+            os.makedirs(OUTPUT_PATH)
+        self.overlay_renderer = create_overlay_renderer()
+    
+    def destroy(self):
+        if self.result_writer is not None:
+            self.result_writer.destroy()
+        if self.overlay_renderer is not None:
+            self.overlay_renderer.destroy()
+    
+    def write(self, save_name, image, boxes, scores, classid):
+        if self.overlay_renderer is not None:
+            image = self.overlay_renderer.render(image, boxes, scores, classid)
+        if self.result_writer is not None:
+            self.result_writer.write(save_name, boxes, scores)
+        if ENABLE_WRITE_OUTPUT is True:
+            cv2.imwrite(os.path.join(OUTPUT_PATH, save_name), image)
+
+def run_worker_pool():
+    frame_shape = (INPUT_HEIGHT, INPUT_WIDTH, 3)
+    worker_pool = WorkerPool(frame_shape, WORKER_POOL_PROCESSES, WORKER_POOL_SLOTS, BATCH_SIZE, WORKER_POOL_MAX_BOXES)
+    
+    start_frame = 0
+    end_frame = 4950
+    wall_time = worker_pool.run(functools.partial(PoolImageReader, IMAGE_DIR, IMAGE_NAME_FORMAT, start_frame, end_frame),
+                                functools.partial(create_backend, (BATCH_SIZE,) + frame_shape),
+                                PoolSink)
+    total_frame = worker_pool.frame_count
+    
+    if ENABLE_TIME_PROFILE is True and total_frame > 0:
+        print("\n")
+        print("Total frame            : ", total_frame)
+        print("Worker processes       : ", WORKER_POOL_PROCESSES)
+        for index, (frame_count, proc_time) in enumerate(zip(worker_pool.worker_frame_counts, worker_pool.worker_proc_times)):
+            if frame_count > 0:
+                print("Worker %-2d frame, time  : " % index, frame_count, proc_time / frame_count, " msec")
+        print("Avg. Frame time        : ", wall_time * 1000 / total_frame, " msec")
+        print("Avg. FPS               : ", total_frame / wall_time, "\n")
+    
+    worker_pool.destroy()
 
-    def run(self):
-        self.pre_proc.preprocess_image(self.input_img, self.infer_proc.get_infer_ptr(), self.batch_size)
-        infer_result = self.infer_proc.inference(self.batch_size)
-        result_boxes, result_scores, result_classid = self.post_proc.post_process(infer_result, self.batch_size)
+def get_camera_dropped_count(camera_wrappers):
+    return sum(camera_wrapper.dropped_count for camera_wrapper in camera_wrappers if camera_wrapper.capture_thread is not None)
 
-        if self.enable_draw_box is True:
-            self.draw_box(result_boxes, result_scores, result_classid)
-        
-        if self.enable_write_json is True:                
-            self.add_img_annot(self.save_name, result_boxes, result_scores)
-    
-    def draw_box(self, result_boxes, result_scores, result_classid):
-        for i in range(len(result_boxes)):
-            box = result_boxes[i]
-            if self.batch_size > 1:
-                plot_one_box_batch(
-                    box,
-                    self.input_img,
-                    class_id = int(result_classid[i]),
-                    label="{}:{:.2f}".format(
-                    categories[int(result_classid[i])], result_scores[i]
-                    ),
-                )
-            else:
-                plot_one_box(
-                    box,
-                    self.input_img[0],
-                    class_id = int(result_classid[i]),
-                    label="{}:{:.2f}".format(
-                    categories[int(result_classid[i])], result_scores[i]
-                    ),
-                )
-    
-    def add_img_annot(self, file_name, boxes, scores):
-        # Store annotation per image
-        annotation = {'file_name': file_name, 'objects': []}
-        for b, p in zip(boxes.tolist(), scores.tolist()):
-            tmp = {'position': b, 'confidence_score': float(p)}
-            annotation['objects'].append(tmp)
-        self.annots['annotations'].append(annotation)
-    
-    def join(self):
-        threading.Thread.join(self)
-        return self.input_img, self.annots
+def create_metrics(backend, pipeline, output_writers, batch_scheduler, camera_wrappers, scene_gate, trackers, motion_roi, overlay_renderer):
+    """
+    description: Register the latency histograms, counters and gauges of a run.
+    return:
+        metrics: a MetricsRegistry
+    """
+    
+    metrics = MetricsRegistry()
+    for name, histogram in backend.get_histograms():
+        metrics.add_histogram(name, histogram)
+    
+    for worker in pipeline.workers:
+        metrics.add_histogram("stage_" + worker.name, worker.latency)
+        metrics.add_gauge(worker.name + "_queue_depth", worker.in_queue.qsize)
+        metrics.add_gauge(worker.name + "_max_queue_depth", functools.partial(getattr, worker, "max_queue_depth"))
+    
+    for source_id, output_writer in output_writers.items():
+        metrics.add_histogram("write" if source_id is None else "write_%s" % source_id, output_writer.latency)
+    if len(output_writers) > 0:
+        writers = list(output_writers.values())
+        metrics.add_counter("written_frames", lambda: sum(writer.frame_count for writer in writers))
+        metrics.add_counter("dropped_frames", lambda: sum(writer.drop_count for writer in writers))
+    
+    if batch_scheduler is not None:
+        metrics.add_histogram("batch_wait", batch_scheduler.wait_latency)
+        metrics.add_counter("full_batches", functools.partial(getattr, batch_scheduler, "full_flush_count"))
+        metrics.add_counter("deadline_batches", functools.partial(getattr, batch_scheduler, "deadline_flush_count"))
+        metrics.add_counter("copied_frames", functools.partial(getattr, batch_scheduler, "copy_count"))
+        for reason in batch_scheduler.shed_counts:
+            metrics.add_counter("shed_frames_" + reason, functools.partial(batch_scheduler.shed_counts.get, reason))
+    
+    if scene_gate is not None:
+        metrics.add_histogram("scene_gate", scene_gate.latency)
+        metrics.add_counter("inferred_frames", functools.partial(getattr, scene_gate, "infer_count"))
+        metrics.add_counter("reused_frames", functools.partial(getattr, scene_gate, "reuse_count"))
+    
+    if overlay_renderer is not None:
+        metrics.add_histogram("draw", overlay_renderer.latency)
+        metrics.add_counter("drawn_boxes", functools.partial(getattr, overlay_renderer, "box_count"))
+    
+    if motion_roi is not None:
+        metrics.add_histogram("motion_roi", motion_roi.latency)
+        metrics.add_counter("roi_pixels", functools.partial(getattr, motion_roi, "roi_pixels"))
+    
+    for source_id, tracker in trackers.items():
+        metrics.add_histogram("tracker" if source_id is None else "tracker_%s" % source_id, tracker.latency)
+    
+    if len(camera_wrappers) > 0:
+        metrics.add_counter("camera_dropped_frames", functools.partial(get_camera_dropped_count, camera_wrappers))
+    
+    return metrics
 
 def main():
+    if ENABLE_TRACE is True:
+        tracer.enable(TRACE_BUFFER_SIZE)
+        tracer.dump_on_signal(TRACE_PATH)
+    
+    if ENABLE_WORKER_POOL is True:
+        run_worker_pool()
+        if ENABLE_TRACE is True:
+            tracer.dump(TRACE_PATH)
+        return
+    
     if ENABLE_CAMERA_LIVE is True:
         if len(sys.argv) == 1 :
-            serial_number = 22246603
+            camera_serials = CAMERA_SERIALS
+        else:
+            camera_serials = [int(arg) for arg in sys.argv[1:]]
+        infer_size = (INFER_WIDTH, INFER_HEIGHT) if ENABLE_FUSED_RECTIFY is True else None
+        if len(CAMERA_REPLAY_PATHS) > 0:
+            camera_wrappers = [CameraReplay(record_path, ENABLE_REPLAY_REALTIME, ENABLE_BACKGROUND_CAPTURE, infer_size=infer_size, pad_value=PAD_VALUE) for record_path in CAMERA_REPLAY_PATHS]
+            camera_serials = [camera_wrapper.serial_number for camera_wrapper in camera_wrappers]
         else:
-            serial_number = int(sys.argv[1])
-        camera_wrapper = CameraZED(serial_number, INPUT_WIDTH, INPUT_HEIGHT, INPUT_FPS)
+            camera_wrappers = [CameraZED(serial_number, INPUT_WIDTH, INPUT_HEIGHT, INPUT_FPS, ENABLE_BACKGROUND_CAPTURE, infer_size=infer_size, pad_value=PAD_VALUE) for serial_number in camera_serials]
     
-    annots = {'param_num': 1000, 'preproc_time': 0, 'inference_time': 0, 'postproc_time': 0, 'annotations': []}
+    # Fused rectify frames come letterboxed at the inference size, the boxes are still scaled to the input size
+    if ENABLE_CAMERA_LIVE is True and ENABLE_FUSED_RECTIFY is True:
+        if ENABLE_TILED_INFERENCE is True or ENABLE_MOTION_ROI is True:
+            raise ValueError("Tiled inference and motion ROIs need the full resolution frames, disable ENABLE_FUSED_RECTIFY")
+        frame_shape = (BATCH_SIZE, INFER_HEIGHT, INFER_WIDTH, 3)
+    else:
+        frame_shape = (BATCH_SIZE, INPUT_HEIGHT, INPUT_WIDTH, 3)
+    
+    result_writer = None
+    if ENABLE_WRITE_JSON is True:
+        result_writer = ResultWriter(JSON_PATH, 1000, JSON_FLUSH_INTERVAL)
     
-    pre_process_wrapper = PreProcessor((BATCH_SIZE, INPUT_HEIGHT, INPUT_WIDTH, 3), (BATCH_SIZE, INFER_HEIGHT, INFER_WIDTH, 3), ENABLE_TIME_PROFILE)
-    inference_trt_wrapper = InferenceTRT(ENGINE_PATH, BATCH_SIZE, ENABLE_TIME_PROFILE)
-    post_process_wrapper = PostProcessor((BATCH_SIZE, INPUT_HEIGHT, INPUT_WIDTH, 3), (BATCH_SIZE, INFER_HEIGHT, INFER_WIDTH, 3), CONF_THRESH, IOU_THRESHOLD, ENABLE_TIME_PROFILE)
+    backend = create_backend(frame_shape)
     
     batch_idx = 0
     batch_img_arr = []
     
     if ENABLE_DUMMY_INPUT == True:
         for index in range(0, 32):
-            if ENABLE_CAMERA_LIVE is True:
-                h_img = camera_wrapper.capture_left()
+            if ENABLE_CAMERA_LIVE is True and ENABLE_FUSED_RECTIFY is True:
+                h_img = camera_wrappers[0].capture_left_infer()[0]
+            elif ENABLE_CAMERA_LIVE is True:
+                h_img = camera_wrappers[0].capture_left()
             else:
-                image_path = "image/test/%04d.jpg" % index
+                image_path = os.path.join(IMAGE_DIR, IMAGE_NAME_FORMAT % index)
                 
                 h_img = cv2.imread(image_path)
-                if h_img is None:
-                    continue
+            # Frames of another size are skipped like in FrameSource, one would break the batch array
+            if h_img is None or h_img.shape != frame_shape[1:]:
+                continue
                 
             batch_idx += 1
             batch_img_arr.append(h_img)
@@ -320,107 +703,186 @@ def main():
                 continue
             
             batch_img = np.array(batch_img_arr)
-            trt_thread = ThreadTRT(pre_process_wrapper, inference_trt_wrapper, post_process_wrapper, batch_img, batch_idx, annots, "", False, False)
-            trt_thread.start()
-            trt_thread.join()
+            output = backend.infer(batch_img, batch_idx)
+            backend.post_process(output, batch_idx)
             
             batch_idx = 0
             batch_img_arr.clear()
     
-    pre_process_wrapper.proc_time = 0
-    inference_trt_wrapper.proc_time = 0
-    post_process_wrapper.proc_time = 0
+    backend.get_proc_times()
+    for name, histogram in backend.get_histograms():
+        histogram.reset()
+    
+    # The measured run replays the recordings from their first frame
+    if ENABLE_CAMERA_LIVE is True and ENABLE_BACKGROUND_CAPTURE is False:
+        for camera_wrapper in camera_wrappers:
+            if isinstance(camera_wrapper, CameraReplay):
+                camera_wrapper.replay_capture.seek(0)
+    
+    source_ids = camera_serials if ENABLE_CAMERA_LIVE is True else [None]
+    output_writers = {}
+    if ENABLE_WRITE_OUTPUT is True:
+        for source_id in source_ids:
+            output_path = get_source_output_path(OUTPUT_PATH, source_id, len(source_ids))
+            output_writers[source_id] = OutputWriter(output_path, OUTPUT_NAME_FORMAT, OUTPUT_WRITER_WORKERS, OUTPUT_WRITER_QUEUE_SIZE, OUTPUT_WRITER_POLICY, INPUT_FPS, ENABLE_TIME_PROFILE)
     
-    pre_process_total_time = 0
-    inference_total_time = 0
-    post_process_total_time = 0
+    scene_gate = None
+    if ENABLE_SCENE_GATE is True:
+        scene_gate = SceneGate(SCENE_GATE_THRESHOLD, SCENE_GATE_MAX_REUSE, SCENE_GATE_SIZE, ENABLE_TIME_PROFILE)
+    
+    motion_roi = None
+    if ENABLE_MOTION_ROI is True:
+        motion_roi = MotionROI(MOTION_ROI_SCALE, MOTION_ROI_THRESHOLD, MOTION_ROI_MIN_AREA, MOTION_ROI_MARGIN, MOTION_ROI_MAX_ROIS,
+                               MOTION_ROI_MAX_COVERAGE, MOTION_ROI_FULL_INTERVAL, MOTION_ROI_LEARNING_RATE, ENABLE_TIME_PROFILE)
+    
+    trackers = {}
+    if KEYFRAME_INTERVAL > 1:
+        for source_id in source_ids:
+            trackers[source_id] = SortTracker(TRACKER_IOU_THRESHOLD, TRACKER_MAX_AGE, ENABLE_TIME_PROFILE)
+    
+    overlay_renderer = create_overlay_renderer()
+    
+    stage_trt = StageTRT(backend, result_writer, output_writers, dict(zip(camera_serials, camera_wrappers)) if ENABLE_CAMERA_LIVE is True else None, scene_gate, trackers, KEYFRAME_INTERVAL, motion_roi, overlay_renderer)
+    pipeline = Pipeline([("inference", stage_trt.infer_stage),
+                         ("post-process", stage_trt.post_process_stage),
+                         ("output", stage_trt.output_stage)],
+                        PIPELINE_QUEUE_DEPTH, ENABLE_TIME_PROFILE)
     
     start_frame = 0
     end_frame = 4950
-    if ENABLE_CAMERA_LIVE is True:
-        end_frame = CAMERA_TOTAL_FRAME
     total_frame = 0
     
-    img_offset = start_frame
+    staging_ring = StagingRing(frame_shape, STAGING_RING_BUFFERS, ENABLE_PAGELOCKED_STAGING and not ENABLE_CPU_BACKEND)
     
-    batch_idx = 0
-    batch_img_arr.clear()
+    batch_scheduler = None
+    if ENABLE_CAMERA_LIVE is True:
+        batch_scheduler = BatchScheduler(staging_ring, BATCH_MAX_DELAY, shed_policy=SHED_POLICY, skip_interval=SHED_SKIP_INTERVAL, max_age=SHED_MAX_AGE)
     
-    for index in range(start_frame, end_frame):
-        if ENABLE_CAMERA_LIVE is True:
-            save_name = ""
-            h_img = camera_wrapper.capture_left()
-        else:
-            save_name = "%04d.jpg" % index
-            image_path = "image/test/%04d.jpg" % index
-            print(image_path)
-            
-            h_img = cv2.imread(image_path)
-            if h_img is None:
-                continue
-            
-        batch_idx += 1
-        batch_img_arr.append(h_img)
-        
-        total_frame += 1
-        
-        if batch_idx < BATCH_SIZE and index + 1 != end_frame:
-            continue
-            
-        batch_img = np.array(batch_img_arr)
-        trt_thread = ThreadTRT(pre_process_wrapper, inference_trt_wrapper, post_process_wrapper, batch_img, batch_idx, annots, save_name, ENABLE_DRAW_BOX, ENABLE_WRITE_JSON)
-        trt_thread.start()
-        out_img, annots = trt_thread.join()
-        
-        batch_idx = 0
-        batch_img_arr.clear()
-        
-        if ENABLE_DRAW_FPS is True:
-            fps = 1000 / (pre_process_wrapper.proc_time + inference_trt_wrapper.proc_time + post_process_wrapper.proc_time)
-            draw_fps(out_img[0], fps)
-        
-        if ENABLE_SHOW_OUTPUT is True:
-            cv2.imshow("result", out_img[0])
-            cv2.waitKey(1)
+    metrics = create_metrics(backend, pipeline, output_writers, batch_scheduler, camera_wrappers if ENABLE_CAMERA_LIVE is True else [], scene_gate, trackers, motion_roi, overlay_renderer)
+    metrics_exporter = None
+    if ENABLE_METRICS_EXPORT is True:
+        metrics_exporter = MetricsExporter(metrics, METRICS_PATH, METRICS_EXPORT_INTERVAL)
+    
+    # The staging buffer goes back to the ring once the output stage is done with it
+    if ENABLE_CAMERA_LIVE is True:
+        capture = capture_camera_infer if ENABLE_FUSED_RECTIFY is True else capture_camera
+        for serial_number, camera_wrapper in zip(camera_serials, camera_wrappers):
+            batch_scheduler.add_source(serial_number, functools.partial(capture, camera_wrapper), CAMERA_TOTAL_FRAME, camera_wrapper.get_capture_time)
         
-        if ENABLE_WRITE_OUTPUT is True:
-            if BATCH_SIZE > 1:
-                for index2 in range(img_offset, index + 1):
-                    save_name = "output/%04d.jpg" % index2
-                    cv2.imwrite(save_name, out_img[index2 - img_offset])
-                img_offset = index + 1
-            else:
-                save_name = "output/%04d.jpg" % index
-                cv2.imwrite(save_name, out_img[0])
+        for batch in batch_scheduler:
+            save_names = ["%s/%s" % (source_id, OUTPUT_NAME_FORMAT % frame_index) for source_id, frame_index in zip(batch.source_ids, batch.frame_indices)]
+            pipeline.submit(BatchJob(batch.images, batch.batch_size, batch.frame_indices, save_names, batch.release, batch.source_ids, batch.frame_data))
+            total_frame += batch.batch_size
+    else:
+        frame_source = FrameSource(IMAGE_DIR, IMAGE_NAME_FORMAT, start_frame, end_frame, staging_ring, FRAME_SOURCE_WORKERS)
         
-        pre_process_total_time += pre_process_wrapper.proc_time
-        inference_total_time += inference_trt_wrapper.proc_time
-        post_process_total_time += post_process_wrapper.proc_time
-
-        pre_process_wrapper.proc_time = 0
-        inference_trt_wrapper.proc_time = 0
-        post_process_wrapper.proc_time = 0
-
+        for batch in frame_source:
+            pipeline.submit(BatchJob(batch.images, batch.batch_size, batch.frame_indices, batch.save_names, batch.release))
+            total_frame += batch.batch_size
+    
+    pipeline.finish()
+    
+    for output_writer in output_writers.values():
+        output_writer.destroy()
+    
+    if metrics_exporter is not None:
+        metrics_exporter.destroy()
+    
+    if ENABLE_CAMERA_LIVE is True:
+        batch_scheduler.destroy()
+    else:
+        frame_source.destroy()
+    staging_ring.destroy()
+    
+    pre_process_total_time, inference_total_time, post_process_total_time = backend.get_proc_times()
+    
     if ENABLE_TIME_PROFILE is True:
         print("\n")
         print("Total frame            : ", total_frame)
+        if ENABLE_CAMERA_LIVE is False:
+            print("Size mismatch frame    : ", frame_source.size_mismatch_count)
         print("Avg. Pre-process time  : ", pre_process_total_time / total_frame, " msec")
         print("Avg. Inference time    : ", inference_total_time / total_frame, " msec")
         print("Avg. Post-process time : ", post_process_total_time / total_frame, " msec", "\n")
+        
+        serial_time = 0
+        max_stage_time = 0
+        for name, stage_time in pipeline.get_stage_times():
+            print("Avg. %-12s stage   : " % name, stage_time, " msec/batch")
+            serial_time += stage_time
+            max_stage_time = max(max_stage_time, stage_time)
+        print("Sum of stage times     : ", serial_time, " msec/batch")
+        print("Max stage time         : ", max_stage_time, " msec/batch")
+        print("Avg. Frame time        : ", pipeline.get_wall_time() / total_frame, " msec", "\n")
+        
+        print("%-24s %8s %10s %10s %10s %10s" % ("Latency (msec)", "count", "p50", "p95", "p99", "max"))
+        for name, summary in metrics.get_snapshot()['latency_ms'].items():
+            print("%-24s %8d %10.3f %10.3f %10.3f %10.3f" % (name, summary['count'], summary['p50'], summary['p95'], summary['p99'], summary['max']))
+        for name, depth, max_depth in pipeline.get_queue_depths():
+            print("Max queue depth %-8s: " % name, max_depth)
+        print("")
+        
+        if batch_scheduler is not None:
+            print("Full batches           : ", batch_scheduler.full_flush_count)
+            print("Deadline batches       : ", batch_scheduler.deadline_flush_count)
+            print("Copied frame           : ", batch_scheduler.copy_count)
+            for reason, shed_count in batch_scheduler.shed_counts.items():
+                print("Shed frame %-12s: " % reason, shed_count)
+            print("Camera dropped frame   : ", get_camera_dropped_count(camera_wrappers), "\n")
+        
+        if scene_gate is not None:
+            print("Inferred frame         : ", scene_gate.infer_count)
+            print("Reused frame           : ", scene_gate.reuse_count)
+            if scene_gate.infer_count + scene_gate.reuse_count > 0:
+                print("Avg. Scene gate time   : ", scene_gate.proc_time / (scene_gate.infer_count + scene_gate.reuse_count), " msec", "\n")
+        
+        if motion_roi is not None and motion_roi.frame_pixels > 0:
+            print("ROI pixel ratio        : ", motion_roi.roi_pixels / motion_roi.frame_pixels)
+            print("Avg. Motion ROI time   : ", motion_roi.proc_time / motion_roi.latency.count, " msec", "\n")
+        
+        if overlay_renderer is not None and overlay_renderer.latency.count > 0:
+            print("Drawn box              : ", overlay_renderer.box_count)
+            print("Skipped box            : ", overlay_renderer.skip_count)
+            print("Avg. Draw time         : ", overlay_renderer.proc_time / total_frame, " msec", "\n")
+        
+        for source_id, tracker in trackers.items():
+            if tracker.latency.count > 0:
+                name = "Avg. Tracker time" if source_id is None else "Avg. Tracker time %s" % source_id
+                print("%-23s: " % name, tracker.proc_time / tracker.latency.count, " msec")
+        
+        for source_id, output_writer in output_writers.items():
+            if source_id is not None:
+                print("Source                 : ", source_id)
+            print("Written frame          : ", output_writer.frame_count)
+            print("Dropped frame          : ", output_writer.drop_count)
+            if output_writer.frame_count > 0:
+                print("Avg. Write time        : ", output_writer.proc_time / output_writer.frame_count, " msec", "\n")
     
     # Sum inference time
-    if ENABLE_WRITE_JSON is True:
-        annots['preproc_time'] = annots['preproc_time'] + pre_process_total_time / total_frame
-        annots['inference_time'] = annots['inference_time'] + inference_total_time / total_frame
-        annots['postproc_time'] = annots['postproc_time'] + post_process_total_time / total_frame
-        save_ap_json(annots)
+    if result_writer is not None:
+        result_writer.write_summary({'preproc_time': pre_process_total_time / total_frame,
+                                     'inference_time': inference_total_time / total_frame,
+                                     'postproc_time': post_process_total_time / total_frame})
+        result_writer.destroy()
     
     if ENABLE_CAMERA_LIVE is True:
-        camera_wrapper.destroy()
+        for camera_wrapper in camera_wrappers:
+            camera_wrapper.destroy()
+    
+    if scene_gate is not None:
+        scene_gate.destroy()
+    
+    if motion_roi is not None:
+        motion_roi.destroy()
+    
+    if overlay_renderer is not None:
+        overlay_renderer.destroy()
+    
+    pipeline.destroy()
+    backend.destroy()
     
-    pre_process_wrapper.destroy()
-    inference_trt_wrapper.destroy()
-    post_process_wrapper.destroy()
+    if ENABLE_TRACE is True:
+        tracer.dump(TRACE_PATH)
 
 if __name__ == "__main__":
     main()
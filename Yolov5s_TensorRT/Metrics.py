@@ -0,0 +1,223 @@
+"""
+File: Metrics.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import time
+import json
+import threading
+import numpy as np
+
+if hasattr(time, "perf_counter_ns"):
+    now_ns = time.perf_counter_ns
+else:
+    # Python 3.6 has no *_ns timers, perf_counter is monotonic as well
+    def now_ns():
+        return int(time.perf_counter() * 1e9)
+
+# Values below 2^SUB_BUCKET_BITS are counted exactly, larger values in 2^(SUB_BUCKET_BITS - 1)
+# linear sub-buckets per power of two, a relative error below 1/64
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+MAX_VALUE_BITS = 44
+
+PERCENTILES = (50, 95, 99)
+
+def get_metric_name(name):
+    # Prometheus names only allow [a-zA-Z0-9_]
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+class LatencyHistogram(object):
+    """
+    description: A LatencyHistogram class that counts nanosecond latencies in log-linear buckets,
+                 the layout of an HDR histogram. Recording is O(1) and the memory is fixed,
+                 so it can run on every frame for the whole run.
+    """
+
+    def __init__(self):
+        num_buckets = (MAX_VALUE_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKET_HALF + SUB_BUCKET_HALF
+        self.counts = np.zeros(num_buckets, dtype=np.int64)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts[:] = 0
+            self.count = 0
+            self.total = 0
+            self.min_value = None
+            self.max_value = 0
+
+    def get_index(self, value):
+        shift = max(value.bit_length() - SUB_BUCKET_BITS, 0)
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    def get_value(self, index):
+        """
+        description: Highest value counted in a bucket.
+        """
+
+        shift = max(index // SUB_BUCKET_HALF - 1, 0)
+        return ((index - shift * SUB_BUCKET_HALF) << shift) + (1 << shift) - 1
+
+    def record(self, value):
+        """
+        description: Count one latency.
+        param:
+            value:  latency in nsec
+        return:
+            no return
+        """
+
+        value = min(max(int(value), 0), (1 << MAX_VALUE_BITS) - 1)
+        index = self.get_index(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min_value is None or value < self.min_value:
+                self.min_value = value
+            if value > self.max_value:
+                self.max_value = value
+
+    def get_percentile(self, percentile):
+        """
+        description: Get a latency percentile.
+        param:
+            percentile: 0 to 100
+        return:
+            value: latency in nsec, within the bucket precision
+        """
+
+        with self.lock:
+            if self.count == 0:
+                return 0
+            rank = max(int(np.ceil(self.count * percentile / 100.0)), 1)
+            index = int(np.searchsorted(np.cumsum(self.counts), rank))
+            return min(self.get_value(index), self.max_value)
+
+    def get_summary(self):
+        """
+        description: Get the count, mean, percentiles and max.
+        return:
+            summary: a dict of values in msec, e.g. {'count': 10, 'mean': 1.2, 'p50': 1.1, ..., 'max': 3.4}
+        """
+
+        summary = {'count': self.count}
+        summary['mean'] = self.total / self.count / 1e6 if self.count > 0 else 0
+        for percentile in PERCENTILES:
+            summary['p%d' % percentile] = self.get_percentile(percentile) / 1e6
+        summary['max'] = self.max_value / 1e6
+        return summary
+
+class MetricsRegistry(object):
+    """
+    description: A MetricsRegistry class that collects the latency histograms, counters and gauges
+                 of the pipeline and exports them as a Prometheus text file or as JSON.
+                 Counters and gauges are functions, they are read at export time.
+    """
+
+    def __init__(self, prefix="yolov5"):
+        self.prefix = prefix
+        self.histograms = []
+        self.counters = []
+        self.gauges = []
+
+    def add_histogram(self, name, histogram):
+        self.histograms.append((get_metric_name(name), histogram))
+
+    def add_counter(self, name, func):
+        self.counters.append((get_metric_name(name), func))
+
+    def add_gauge(self, name, func):
+        self.gauges.append((get_metric_name(name), func))
+
+    def get_snapshot(self):
+        """
+        description: Read every metric.
+        return:
+            snapshot: {'latency_ms': {name: summary}, 'counters': {name: value}, 'gauges': {name: value}}
+        """
+
+        return {'timestamp': time.time(),
+                'latency_ms': dict((name, histogram.get_summary()) for name, histogram in self.histograms),
+                'counters': dict((name, func()) for name, func in self.counters),
+                'gauges': dict((name, func()) for name, func in self.gauges)}
+
+    def to_prometheus(self, snapshot):
+        prefix = self.prefix
+        lines = ["# TYPE %s_latency_seconds summary" % prefix]
+        for name, summary in snapshot['latency_ms'].items():
+            for percentile in PERCENTILES:
+                lines.append('%s_latency_seconds{stage="%s",quantile="%s"} %.9f'
+                             % (prefix, name, percentile / 100.0, summary['p%d' % percentile] / 1000))
+            lines.append('%s_latency_seconds_sum{stage="%s"} %.9f' % (prefix, name, summary['mean'] * summary['count'] / 1000))
+            lines.append('%s_latency_seconds_count{stage="%s"} %d' % (prefix, name, summary['count']))
+
+        lines.append("# TYPE %s_latency_max_seconds gauge" % prefix)
+        for name, summary in snapshot['latency_ms'].items():
+            lines.append('%s_latency_max_seconds{stage="%s"} %.9f' % (prefix, name, summary['max'] / 1000))
+
+        for name, value in snapshot['counters'].items():
+            lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+            lines.append("%s_%s_total %d" % (prefix, name, value))
+
+        for name, value in snapshot['gauges'].items():
+            lines.append("# TYPE %s_%s gauge" % (prefix, name))
+            lines.append("%s_%s %s" % (prefix, name, value))
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """
+        description: Write every metric to path, Prometheus text format unless path ends with .json.
+                     The file is replaced atomically, so a scraper never reads half a file.
+        """
+
+        snapshot = self.get_snapshot()
+        if path.endswith(".json"):
+            text = json.dumps(snapshot, indent=2)
+        else:
+            text = self.to_prometheus(snapshot)
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(text)
+        os.replace(temp_path, path)
+
+class MetricsExporter(threading.Thread):
+    """
+    description: Export a MetricsRegistry every interval seconds, and once more on destroy.
+    """
+
+    def __init__(self, registry, path, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        print("MetricsExporter init")
+
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.start()
+
+    def destroy(self):
+        print("MetricsExporter destroy")
+
+        self.stop_event.set()
+        self.join()
+        self.registry.export(self.path)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.registry.export(self.path)
+            except (IOError, OSError) as e:
+                print("Metrics export failed: %s" % e)
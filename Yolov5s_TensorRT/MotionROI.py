@@ -0,0 +1,206 @@
+"""
+File: MotionROI.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import sys
+import numpy as np
+import cv2
+
+from Metrics import now_ns, LatencyHistogram
+
+def merge_rois(rois):
+    """
+    description: Merge overlapping regions until none of them overlap.
+    param:
+        rois:   a (N, 4) array of [x1, y1, x2, y2]
+    return:
+        rois: the merged (M, 4) array
+    """
+
+    rois = [list(roi) for roi in rois]
+    merged = True
+    while merged is True:
+        merged = False
+        for i in range(len(rois)):
+            for j in range(i + 1, len(rois)):
+                a = rois[i]
+                b = rois[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rois[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rois[j]
+                    merged = True
+                    break
+            if merged is True:
+                break
+    return np.array(rois, dtype=np.int64).reshape(-1, 4)
+
+class MotionROI(object):
+    """
+    description: A MotionROI class that finds the regions of a frame that changed, so the detector only runs on them.
+                 Every source has a running average background of a downscaled grayscale frame,
+                 the pixels that differ from it are grouped into regions and scaled back to the frame.
+    """
+
+    def __init__(self, scale, threshold, min_area, margin, max_rois, max_coverage, full_interval, learning_rate, enable_profiling):
+        """
+        param:
+            scale:          downscale factor of the background model
+            threshold:      gray level difference from the background above which a pixel moved
+            min_area:       minimum region area in background model pixels, smaller regions are noise
+            margin:         pixels added around every region in the frame, the context the detector needs
+            max_rois:       maximum number of regions per frame, more are merged into their bounding region
+            max_coverage:   fraction of the frame above which the whole frame is returned
+            full_interval:  every full_interval-th frame of a source is returned whole, so static objects are detected too
+            learning_rate:  weight of a new frame in the running average background
+        """
+        print("MotionROI init")
+
+        self.scale = scale
+        self.threshold = threshold
+        self.min_area = min_area
+        self.margin = margin
+        self.max_rois = max_rois
+        self.max_coverage = max_coverage
+        self.full_interval = full_interval
+        self.learning_rate = learning_rate
+
+        # Per source: the background model and the number of frames seen
+        self.backgrounds = {}
+        self.frame_counts = {}
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+
+        self.frame_pixels = 0
+        self.roi_pixels = 0
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("MotionROI destroy")
+
+    def get_gray(self, image):
+        height, width = image.shape[:2]
+        # INTER_AREA averages the pixels, so sensor noise hardly reaches the difference
+        small = cv2.resize(image, (max(1, width // self.scale), max(1, height // self.scale)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def get_rois(self, source_id, image):
+        """
+        description: Find the moving regions of a frame, frames of a source must be given in order.
+        param:
+            source_id:  the source of the frame, every source has its own background
+            image:      a (height, width, 3) uint8 BGR frame
+        return:
+            rois: a (N, 4) int64 array of [x, y, w, h] regions in the frame, empty when nothing moved
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        height, width = image.shape[:2]
+        gray = self.get_gray(image)
+        background = self.backgrounds.get(source_id)
+        frame_count = self.frame_counts.get(source_id, 0)
+        self.frame_counts[source_id] = frame_count + 1
+
+        if background is None:
+            self.backgrounds[source_id] = gray
+            rois = None
+        else:
+            moved = cv2.compare(cv2.absdiff(gray, background), self.threshold, cv2.CMP_GT)
+            moved = cv2.dilate(moved, self.kernel, iterations=2)
+            cv2.accumulateWeighted(gray, background, self.learning_rate)
+
+            num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(moved, connectivity=8)
+            stats = stats[1:]
+            stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area]
+
+            # Back to frame pixels with the margin, overlapping regions become one crop
+            scale_x = width / gray.shape[1]
+            scale_y = height / gray.shape[0]
+            rois = np.empty((len(stats), 4), dtype=np.int64)
+            rois[:, 0] = np.floor(stats[:, cv2.CC_STAT_LEFT] * scale_x) - self.margin
+            rois[:, 1] = np.floor(stats[:, cv2.CC_STAT_TOP] * scale_y) - self.margin
+            rois[:, 2] = np.ceil((stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]) * scale_x) + self.margin
+            rois[:, 3] = np.ceil((stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]) * scale_y) + self.margin
+            rois = np.clip(rois, 0, [width, height, width, height])
+            rois = merge_rois(rois)
+
+            if len(rois) > self.max_rois:
+                rois = np.concatenate([rois[:, :2].min(axis=0), rois[:, 2:].max(axis=0)])[None]
+            if ((rois[:, 2] - rois[:, 0]) * (rois[:, 3] - rois[:, 1])).sum() > self.max_coverage * width * height:
+                rois = None
+
+        if rois is None or (self.full_interval > 0 and frame_count % self.full_interval == 0):
+            rois = np.array([[0, 0, width, height]], dtype=np.int64)
+        else:
+            rois[:, 2:] -= rois[:, :2]
+
+        self.frame_pixels += width * height
+        self.roi_pixels += int((rois[:, 2] * rois[:, 3]).sum())
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return rois
+
+def check_motion(num_frames=30, size=(1920, 1080), seed=0):
+    """
+    description: Move a textured square over a static noisy background.
+    return:
+        missed, roi_ratio: frames whose regions do not cover the square and the fraction of the frame pixels in regions
+    """
+
+    width, height = size
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 256, (height // 8, width // 8, 3)).astype(np.uint8)
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_NEAREST)
+    square = rng.randint(0, 256, (120, 120, 3)).astype(np.uint8)
+
+    motion_roi = MotionROI(8, 15, 4, 32, 4, 0.5, 0, 0.05, False)
+    missed = 0
+    for frame in range(num_frames):
+        image = background.copy()
+        x = 100 + frame * 40
+        y = 400 + frame * 10
+        image[y:y + 120, x:x + 120] = square
+        image = cv2.add(image, rng.randint(0, 3, image.shape).astype(np.uint8))
+
+        rois = motion_roi.get_rois(None, image)
+        covered = ((rois[:, 0] <= x) & (rois[:, 1] <= y) & (rois[:, 0] + rois[:, 2] >= x + 120) & (rois[:, 1] + rois[:, 3] >= y + 120)).any()
+        if covered == False:
+            missed += 1
+    motion_roi.destroy()
+
+    return missed, motion_roi.roi_pixels / motion_roi.frame_pixels
+
+def benchmark(size=(1920, 1080), repeat=100):
+    """
+    description: Print the time to find the regions of a frame.
+    """
+
+    width, height = size
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, (height, width, 3)).astype(np.uint8) for _ in range(2)]
+    motion_roi = MotionROI(8, 15, 4, 32, 4, 0.5, 0, 0.05, True)
+    for index in range(repeat):
+        motion_roi.get_rois(None, images[index % 2])
+    motion_roi.destroy()
+    print("Avg. Motion ROI time   : ", motion_roi.proc_time / repeat, " msec")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        missed, roi_ratio = check_motion()
+        print('Missed frames : {}, ROI pixels : {:.1f} % of the frames'.format(missed, roi_ratio * 100))
+        sys.exit(1 if missed > 0 else 0)
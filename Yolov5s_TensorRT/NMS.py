@@ -0,0 +1,291 @@
+"""
+File: NMS.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import sys
+import numpy as np
+
+def box_area(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+def nms(boxes, scores, iou_threshold, top_k=-1):
+    """
+    description: Greedy non-maximum suppression, same semantics as torchvision.ops.nms.
+    param:
+        boxes:          a (N, 4) array, each row is a box [x1, y1, x2, y2]
+        scores:         a (N,) array, each element is the score of the box
+        iou_threshold:  boxes with IoU > iou_threshold against a kept box are discarded
+        top_k:          stop after top_k boxes are kept, -1 keeps all
+    return:
+        keep: int64 indices of the kept boxes, sorted by decreasing score
+    """
+
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    areas = box_area(boxes)
+
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while order.size > 0:
+            i = order[0]
+            keep.append(i)
+            if len(keep) == top_k:
+                break
+
+            rest = order[1:]
+            inter_w = np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])
+            inter_h = np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])
+            inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+            iou = inter / (areas[i] + areas[rest] - inter)
+
+            order = rest[~(iou > iou_threshold)]
+
+    return np.array(keep, dtype=np.int64)
+
+def overlap_pairs(boxes, iou_threshold):
+    """
+    description: Find the pairs of boxes whose IoU is above iou_threshold without comparing all pairs.
+                 IoU > t needs an x overlap of more than t * max(w_a, w_b), so once the boxes are
+                 sorted by x1 a box only has to be compared with the boxes starting within
+                 (1 - t) * w of its own x1. The same bound on y1 prunes the pairs before the IoU.
+    param:
+        boxes:          a (N, 4) array, each row is a box [x1, y1, x2, y2]
+        iou_threshold:  IoU threshold of a pair
+    return:
+        first, second: int64 index arrays, box first[i] and box second[i] overlap by more than iou_threshold
+    """
+
+    t = max(iou_threshold, 0)
+    order = np.argsort(boxes[:, 0], kind='stable')
+    x1 = boxes[order, 0]
+    y1 = boxes[order, 1]
+    x2 = boxes[order, 2]
+    y2 = boxes[order, 3]
+    w = x2 - x1
+    h = y2 - y1
+
+    # The small margin keeps pairs that sit exactly on the bound after rounding
+    ends = np.searchsorted(x1, x1 + (1 - t) * w + 1e-6, side='right')
+    counts = np.maximum(ends - np.arange(1, order.size + 1), 0)
+
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Expand the sweep windows into (i, j) pairs of sorted positions, j runs over i+1 .. ends[i]-1
+    first = np.repeat(np.arange(order.size), counts)
+    second = np.arange(total) - np.repeat(np.cumsum(counts) - counts - 1, counts) + first
+
+    dy = y1[second] - y1[first]
+    candidate = np.where(dy >= 0, dy < (1 - t) * h[first] + 1e-6, -dy < (1 - t) * h[second] + 1e-6)
+    first = first[candidate]
+    second = second[candidate]
+
+    inter_w = np.minimum(x2[first], x2[second]) - x1[second]
+    inter_h = np.minimum(y2[first], y2[second]) - np.maximum(y1[first], y1[second])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    areas = w * h
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (areas[first] + areas[second] - inter)
+    overlap = iou > iou_threshold
+
+    return order[first[overlap]], order[second[overlap]]
+
+def sweep_nms(boxes, scores, iou_threshold, top_k=-1):
+    """
+    description: Non-maximum suppression with the same result as nms, but only the pairs found by
+                 overlap_pairs are compared. The greedy order is resolved on that sparse graph:
+                 a box is kept when none of the higher scored boxes suppressing it is kept.
+    param:
+        boxes:          a (N, 4) array, each row is a box [x1, y1, x2, y2]
+        scores:         a (N,) array, each element is the score of the box
+        iou_threshold:  boxes with IoU > iou_threshold against a kept box are discarded
+        top_k:          keep at most top_k boxes, -1 keeps all
+    return:
+        keep: int64 indices of the kept boxes, sorted by decreasing score
+    """
+
+    num = boxes.shape[0]
+    order = np.argsort(-scores, kind='stable')
+    rank = np.empty(num, dtype=np.int64)
+    rank[order] = np.arange(num)
+
+    first, second = overlap_pairs(boxes, iou_threshold)
+    swap = rank[first] > rank[second]
+    suppressor = np.where(swap, second, first)
+    target = np.where(swap, first, second)
+
+    # 1: kept, -1: suppressed, 0: undecided
+    state = np.zeros(num, dtype=np.int8)
+    pending = np.bincount(target, minlength=num)
+    state[pending == 0] = 1
+    while True:
+        undecided = state[target] == 0
+        if not undecided.any():
+            break
+        suppressor = suppressor[undecided]
+        target = target[undecided]
+
+        state[target[state[suppressor] == 1]] = -1
+        resolved = state[suppressor] == -1
+        pending -= np.bincount(target[resolved], minlength=num)
+        state[(pending == 0) & (state == 0)] = 1
+
+        keep_edge = ~resolved
+        suppressor = suppressor[keep_edge]
+        target = target[keep_edge]
+
+    keep = order[state[order] == 1]
+    if top_k >= 0:
+        keep = keep[:top_k]
+    return keep
+
+def select_top_k(scores, k):
+    """
+    description: Indices of the k highest scores, found with argpartition instead of a full sort.
+    """
+
+    if k < 0 or scores.shape[0] <= k:
+        return np.arange(scores.shape[0])
+    return np.argpartition(-scores, k - 1)[:k]
+
+def batched_nms(boxes, scores, idxs, iou_threshold, top_k=-1, pre_nms_top_k=-1, method="sweep"):
+    """
+    description: Non-maximum suppression done independently per key, e.g. per class or per image.
+                 Boxes of different keys are shifted apart so that they are never compared.
+    param:
+        boxes:          a (N, 4) array, each row is a box [x1, y1, x2, y2]
+        scores:         a (N,) array, each element is the score of the box
+        idxs:           a (N,) integer array, the key of each box
+        iou_threshold:  boxes with IoU > iou_threshold against a kept box of the same key are discarded
+        top_k:          stop after top_k boxes are kept over all keys, -1 keeps all
+        pre_nms_top_k:  only the pre_nms_top_k highest scored boxes enter NMS, -1 keeps all
+        method:         "sweep" for sweep_nms, "greedy" for nms
+    return:
+        keep: int64 indices of the kept boxes, sorted by decreasing score
+    """
+
+    if boxes.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    candidate = select_top_k(scores, pre_nms_top_k)
+    boxes = boxes[candidate]
+    scores = scores[candidate]
+    idxs = idxs[candidate]
+
+    # Shift in float64, float32 loses the sub-pixel precision of the IoU at large offsets
+    boxes = boxes.astype(np.float64)
+    span = boxes.max() - boxes.min() + 1
+    offsets = idxs * span
+
+    boxes = boxes + offsets[:, None]
+
+    if method == "sweep":
+        keep = sweep_nms(boxes, scores, iou_threshold, top_k)
+    elif method == "greedy":
+        keep = nms(boxes, scores, iou_threshold, top_k)
+    else:
+        raise ValueError("Unknown NMS method: %s" % method)
+    return candidate[keep]
+
+def multiclass_nms(boxes, scores, classid, iou_threshold, top_k=-1):
+    """
+    description: Class-aware non-maximum suppression, boxes only suppress boxes of the same class.
+    """
+
+    return batched_nms(boxes, scores, classid.astype(np.int64), iou_threshold, top_k)
+
+def random_boxes(rng, num, width=640, height=640, num_objects=0):
+    """
+    description: Random boxes for the parity check and the benchmark. With num_objects > 0 the boxes
+                 are jittered copies of a few objects, as the engine outputs at a low confidence threshold.
+    """
+
+    if num_objects > 0:
+        centers = rng.uniform(0, (width, height), (num_objects, 2))
+        sizes = rng.uniform(16, width / 4, (num_objects, 2))
+        owner = rng.randint(0, num_objects, num)
+        wh = sizes[owner] * rng.uniform(0.7, 1.3, (num, 2))
+        xy = centers[owner] + rng.normal(0, 0.1, (num, 2)) * wh - wh / 2
+    else:
+        wh = rng.uniform(1, width / 3, (num, 2))
+        xy = rng.uniform(-50, width, (num, 2))
+    boxes = np.concatenate((xy, xy + wh), axis=1).astype(np.float32)
+    scores = rng.uniform(0, 1, num).astype(np.float32)
+    return boxes, scores
+
+def check_parity(num_trials=100, seed=0):
+    """
+    description: Compare nms, sweep_nms and batched_nms against torchvision on randomized boxes.
+    return:
+        num_mismatch: number of trials whose kept indices differ
+    """
+
+    import torch
+    import torchvision
+
+    rng = np.random.RandomState(seed)
+    num_mismatch = 0
+    for trial in range(num_trials):
+        num = rng.randint(0, 2000)
+        boxes, scores = random_boxes(rng, num, num_objects=rng.randint(0, 20))
+        idxs = rng.randint(0, 80, num)
+        iou_threshold = rng.uniform(0.1, 0.9)
+
+        keep_ref = torchvision.ops.nms(torch.from_numpy(boxes), torch.from_numpy(scores), iou_threshold).numpy()
+        batched_keep_ref = torchvision.ops.batched_nms(torch.from_numpy(boxes), torch.from_numpy(scores),
+            torch.from_numpy(idxs), iou_threshold).numpy()
+
+        results = [np.array_equal(nms(boxes, scores, iou_threshold), keep_ref),
+                   np.array_equal(sweep_nms(boxes, scores, iou_threshold), keep_ref)]
+        for method in ["greedy", "sweep"]:
+            batched_keep = batched_nms(boxes, scores, idxs, iou_threshold, method=method)
+            results.append(np.array_equal(np.sort(batched_keep), np.sort(batched_keep_ref)))
+
+        if not all(results):
+            print("Mismatch in trial %d (num: %d, iou: %0.3f)" % (trial, num, iou_threshold))
+            num_mismatch += 1
+
+    return num_mismatch
+
+def benchmark(nums=(250, 500, 1000, 2000, 4000, 8000), iou_threshold=0.6, pre_nms_top_k=-1, repeat=10, seed=0):
+    """
+    description: Print the average NMS time of every method over a growing number of candidates.
+    """
+
+    import time
+
+    rng = np.random.RandomState(seed)
+    print("%8s %12s %12s %12s" % ("boxes", "greedy(ms)", "sweep(ms)", "pairs"))
+    for num in nums:
+        boxes, scores = random_boxes(rng, num, num_objects=max(num // 100, 1))
+        idxs = rng.randint(0, 4, num)
+
+        times = []
+        for method in ["greedy", "sweep"]:
+            start = time.time()
+            for _ in range(repeat):
+                batched_nms(boxes, scores, idxs, iou_threshold, pre_nms_top_k=pre_nms_top_k, method=method)
+            times.append((time.time() - start) * 1000 / repeat)
+
+        num_pairs = overlap_pairs(boxes, iou_threshold)[0].size
+        print("%8d %12.3f %12.3f %12d" % (num, times[0], times[1], num_pairs))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        pre_nms_top_k = int(sys.argv[2]) if len(sys.argv) > 2 else -1
+        benchmark(pre_nms_top_k=pre_nms_top_k)
+    else:
+        num_mismatch = check_parity()
+        print('NMS parity mismatch : {}'.format(num_mismatch))
+        sys.exit(1 if num_mismatch > 0 else 0)
@@ -0,0 +1,181 @@
+"""
+File: OutputWriter.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import os
+import threading
+import collections
+import cv2
+
+from Metrics import now_ns, LatencyHistogram
+from Tracer import tracer
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv")
+
+class OutputWriter(object):
+    """
+    description: An OutputWriter class that encodes and writes annotated frames on worker threads
+                 behind a bounded queue, either as one JPEG per frame or into a single video file.
+                 The first write error stops the writing, the queued frames are released unwritten
+                 and the error is raised from the next write() or from destroy().
+    """
+
+    def __init__(self, output_path, name_format, num_workers, queue_size, policy, video_fps, enable_profiling):
+        """
+        param:
+            output_path:        a directory for per-frame JPEGs, or a video file path (.mp4, .avi, .mkv)
+            name_format:        file name of a frame index in the directory mode, e.g. "%04d.jpg"
+            num_workers:        number of encode threads, the video mode always uses one to keep frame order
+            queue_size:         maximum number of queued batches
+            policy:             "block" waits for room in the queue, "drop_oldest" drops the oldest queued batch
+            video_fps:          frame rate of the video file
+        """
+        print("OutputWriter init")
+
+        if policy not in ("block", "drop_oldest"):
+            raise ValueError("Unknown output writer policy: %s" % policy)
+
+        enable_video = output_path.lower().endswith(VIDEO_EXTENSIONS)
+        if enable_video is True:
+            num_workers = 1
+        elif os.path.isdir(output_path) is False:
+            os.makedirs(output_path)
+
+        self.output_path = output_path
+        self.name_format = name_format
+        self.queue_size = queue_size
+        self.policy = policy
+        self.video_fps = video_fps
+        self.enable_video = enable_video
+        self.video_writer = None
+
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.error = None
+
+        self.frame_count = 0
+        self.drop_count = 0
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+        self.workers = []
+        for _ in range(num_workers):
+            worker = threading.Thread(target=self.run)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def destroy(self):
+        print("OutputWriter destroy")
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+        if self.video_writer is not None:
+            self.video_writer.release()
+
+        self.check_error()
+
+    def check_error(self):
+        if self.error is not None:
+            raise RuntimeError("Output writer of '%s' failed" % self.output_path) from self.error
+
+    def write(self, frame_indices, images, batch_size, release=None):
+        """
+        description: Queue a batch of frames to be written.
+        param:
+            frame_indices:  frame index of every image, used for the JPEG file names
+            images:         a (batch, height, width, 3) array, must stay valid until release is called
+            batch_size:     number of valid images
+            release:        called once the images are written or dropped
+        return:
+            no return
+        """
+
+        dropped = None
+        with self.condition:
+            if self.policy == "block":
+                # A failed writer takes no more frames, so it is not waited for
+                while len(self.pending) >= self.queue_size and self.closed is False and self.error is None:
+                    self.condition.wait()
+            # Raised before the batch is queued, so the caller still owns its release
+            self.check_error()
+
+            if self.policy == "drop_oldest" and len(self.pending) >= self.queue_size:
+                dropped = self.pending.popleft()
+                self.drop_count += dropped[2]
+
+            self.pending.append((frame_indices, images, batch_size, release))
+            self.condition.notify_all()
+
+        if dropped is not None:
+            for frame_index in dropped[0][:dropped[2]]:
+                tracer.frame_end(frame_index)
+            if dropped[3] is not None:
+                dropped[3]()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and self.closed is False:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                frame_indices, images, batch_size, release = self.pending.popleft()
+                self.condition.notify_all()
+
+            if self.enable_profiling == True:
+                start = now_ns()
+
+            written = 0
+            if self.error is None:
+                try:
+                    with tracer.span("write", {'frames': frame_indices[:batch_size]}):
+                        for index in range(0, batch_size):
+                            if self.enable_video is True:
+                                self.write_video(images[index])
+                            elif cv2.imwrite(os.path.join(self.output_path, self.name_format % frame_indices[index]), images[index]) is False:
+                                raise IOError("Failed to write frame %d to %s" % (frame_indices[index], self.output_path))
+                            written += 1
+                except Exception as e:
+                    print("Output writer of '%s' failed: %s" % (self.output_path, e))
+                    with self.condition:
+                        self.error = e
+                        self.condition.notify_all()
+
+            for frame_index in frame_indices[:batch_size]:
+                tracer.frame_end(frame_index)
+
+            with self.condition:
+                if self.enable_profiling == True:
+                    elapsed = now_ns() - start
+                    self.latency.record(elapsed)
+                    self.proc_time += elapsed / 1e6
+                self.frame_count += written
+                self.drop_count += batch_size - written
+
+            # The frames go back to their producer even when they could not be written
+            if release is not None:
+                release()
+
+    def write_video(self, image):
+        if self.video_writer is None:
+            height, width = image.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            self.video_writer = cv2.VideoWriter(self.output_path, fourcc, self.video_fps, (width, height))
+            # VideoWriter does not raise, a writer that failed to open drops every frame silently
+            if self.video_writer.isOpened() is False:
+                raise IOError("Failed to open video %s" % self.output_path)
+        self.video_writer.write(image)
@@ -0,0 +1,193 @@
+"""
+File: OverlayRenderer.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import time
+import numpy as np
+import cv2
+
+from Metrics import now_ns, LatencyHistogram
+
+class OverlayRenderer(object):
+    """
+    description: An OverlayRenderer class that draws the detections on the output frames, like plot_one_box of YoLov5.
+                 Boxes below the render threshold are not drawn, the boxes of a class are drawn with one polylines call
+                 and the labels and their text sizes are cached per class, score and font scale.
+                 With a preview scale below 1 the overlay is drawn on a downscaled copy of the frame.
+    """
+
+    def __init__(self, categories, colors, render_threshold, preview_scale, enable_profiling):
+        """
+        param:
+            categories:         class names by class id
+            colors:             BGR colors, a class uses colors[class_id % len(colors)]
+            render_threshold:   boxes with a lower score are not drawn, the results are not changed
+            preview_scale:      size of the drawn frame relative to the input frame, 1 draws on the frame itself
+        """
+        print("OverlayRenderer init")
+
+        self.categories = categories
+        self.colors = [tuple(int(c) for c in color) for color in colors]
+        self.render_threshold = render_threshold
+        self.preview_scale = preview_scale
+
+        # (class_id, score in hundredths, font scale) to (label, text size)
+        self.labels = {}
+
+        self.box_count = 0
+        self.skip_count = 0
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("OverlayRenderer destroy")
+
+    def get_label(self, class_id, score_centi, font_scale):
+        key = (class_id, score_centi, font_scale)
+        label = self.labels.get(key)
+        if label is None:
+            text = "{}:{}.{:02d}".format(self.categories[class_id], score_centi // 100, score_centi % 100)
+            label = (text, cv2.getTextSize(text, 0, fontScale=font_scale, thickness=2)[0])
+            self.labels[key] = label
+        return label
+
+    def render(self, image, boxes, scores, classid, track_ids=None):
+        """
+        description: Draw the detections of one frame.
+        param:
+            image:      a (height, width, 3) uint8 BGR frame, drawn on in place when the preview scale is 1
+            boxes:      a (N, 4) array of [x1, y1, x2, y2] in the frame
+            scores:     a (N,) array of scores
+            classid:    a (N,) array of class ids
+            track_ids:  a (N,) array of track IDs shown before the labels, or None
+        return:
+            image: the drawn frame or preview
+        """
+
+        if self.preview_scale != 1:
+            height, width = image.shape[:2]
+            image = cv2.resize(image, (int(width * self.preview_scale), int(height * self.preview_scale)), interpolation=cv2.INTER_LINEAR)
+
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32)
+        classid = np.asarray(classid).astype(np.int64)
+
+        keep = scores >= self.render_threshold
+        self.box_count += int(keep.sum())
+        self.skip_count += int(len(keep) - keep.sum())
+        if keep.any() == False:
+            return image
+
+        boxes = boxes[keep] * self.preview_scale
+        scores = scores[keep]
+        classid = classid[keep]
+        if track_ids is not None:
+            track_ids = np.asarray(track_ids)[keep]
+
+        height, width = image.shape[:2]
+        # Line and font thickness of plot_one_box
+        tl = round(0.002 * (height + width) / 2) + 1
+        font_scale = tl / 3
+        corners = np.clip(boxes, -32768, 32767).astype(np.int32)
+        score_centis = np.floor(scores * 100 + 0.5).astype(np.int64).tolist()
+
+        # One polylines call draws all boxes of a class
+        for class_id in np.unique(classid).tolist():
+            class_corners = corners[classid == class_id]
+            rects = np.stack([class_corners[:, [0, 1]], class_corners[:, [2, 1]], class_corners[:, [2, 3]], class_corners[:, [0, 3]]], axis=1)
+            cv2.polylines(image, list(rects), True, self.colors[class_id % len(self.colors)], thickness=2, lineType=cv2.LINE_AA)
+
+        for index, (x1, y1) in enumerate(corners[:, :2].tolist()):
+            class_id = int(classid[index])
+            text, (text_width, text_height) = self.get_label(class_id, score_centis[index], font_scale)
+            # The label sits above the box, skip it when it is outside the frame
+            if y1 - 2 <= 0 or x1 >= width or x1 + text_width <= 0:
+                continue
+            if track_ids is not None:
+                text = "#{} {}".format(track_ids[index], text)
+            cv2.putText(image, text, (x1, y1 - 2), 0, font_scale, self.colors[class_id % len(self.colors)], thickness=2, lineType=cv2.LINE_AA)
+
+        return image
+
+    def render_batch(self, images, batch_size, result_boxes, result_scores, result_classid, result_track_ids=None):
+        """
+        description: Draw the detections of every frame of a batch.
+        return:
+            images: a list of the drawn frames or previews
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        output_images = []
+        for index in range(0, batch_size):
+            track_ids = result_track_ids[index] if result_track_ids is not None else None
+            output_images.append(self.render(images[index], result_boxes[index], result_scores[index], result_classid[index], track_ids))
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return output_images
+
+def plot_boxes_reference(image, boxes, scores, classid, categories, colors):
+    # The per box drawing the renderer replaces, for the benchmark
+    tl = round(0.002 * (image.shape[0] + image.shape[1]) / 2) + 1
+    for box, score, class_id in zip(boxes, scores, classid):
+        class_id = int(class_id)
+        color = colors[class_id % len(colors)]
+        label = "{}:{:.2f}".format(categories[class_id], score)
+        c1 = (int(box[0]), int(box[1]))
+        cv2.rectangle(image, c1, (int(box[2]), int(box[3])), color, thickness=2, lineType=cv2.LINE_AA)
+        cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=2)
+        cv2.putText(image, label, (c1[0], c1[1] - 2), 0, tl / 3, color, thickness=2, lineType=cv2.LINE_AA)
+
+def benchmark(nums=(10, 100, 1000), size=(1920, 1080), render_threshold=0.25, preview_scale=0.5, repeat=10, seed=0):
+    """
+    description: Print the drawing time per frame of the per box drawing and of the renderer on random detections.
+    """
+
+    width, height = size
+    rng = np.random.RandomState(seed)
+    categories = ["class%d" % index for index in range(80)]
+    colors = [tuple(int(c) for c in rng.randint(0, 256, 3)) for _ in range(80)]
+    image = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+
+    renderers = [("render all", OverlayRenderer(categories, colors, 0, 1, False)),
+                 ("threshold %.2f" % render_threshold, OverlayRenderer(categories, colors, render_threshold, 1, False)),
+                 ("preview x%.2f" % preview_scale, OverlayRenderer(categories, colors, render_threshold, preview_scale, False))]
+
+    print("%8s %14s" % ("boxes", "per box(ms)") + "".join(" %16s" % name for name, renderer in renderers))
+    for num in nums:
+        xy = rng.uniform(0, 1, (num, 2)) * [width - 100, height - 100]
+        boxes = np.concatenate([xy, xy + rng.uniform(10, 100, (num, 2))], axis=1).astype(np.float32)
+        # Mostly weak boxes, like CONF_THRESH = 0.01
+        scores = rng.uniform(0, 1, num).astype(np.float32) ** 3
+        classid = rng.randint(0, 80, num).astype(np.float32)
+
+        times = []
+        start = time.time()
+        for _ in range(repeat):
+            plot_boxes_reference(image.copy(), boxes, scores, classid, categories, colors)
+        times.append((time.time() - start) * 1000 / repeat)
+        for name, renderer in renderers:
+            start = time.time()
+            for _ in range(repeat):
+                renderer.render(image.copy(), boxes, scores, classid)
+            times.append((time.time() - start) * 1000 / repeat)
+        print("%8d %14.3f" % (num, times[0]) + "".join(" %16.3f" % t for t in times[1:]))
+
+    for name, renderer in renderers:
+        renderer.destroy()
+
+if __name__ == '__main__':
+    benchmark()
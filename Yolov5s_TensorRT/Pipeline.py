@@ -0,0 +1,188 @@
+"""
+File: Pipeline.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import time
+import queue
+import threading
+
+from Metrics import now_ns, LatencyHistogram
+
+class PipelineStage(threading.Thread):
+    """
+    description: A long-lived stage worker. It takes items from its input queue,
+                 applies the stage function and hands the result to the next queue.
+                 An item with a release() method is released when the stage fails on it or drops it,
+                 so the buffers it holds go back to their producer and the producer never blocks on a dead pipeline.
+    """
+
+    def __init__(self, name, func, in_queue, out_queue, enable_profiling):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+
+        self.error = None
+        self.frame_count = 0
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.max_queue_depth = 0
+        self.enable_profiling = enable_profiling
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is None:
+                break
+
+            # Items still waiting behind this one, a stage that keeps its queue full is the bottleneck
+            self.max_queue_depth = max(self.max_queue_depth, self.in_queue.qsize())
+
+            if self.error is not None:
+                # Drain the queue so that upstream stages never block on a dead stage
+                self.release_item(item)
+                continue
+
+            if self.enable_profiling == True:
+                start = now_ns()
+
+            try:
+                item = self.func(item)
+            except Exception as e:
+                print("Pipeline stage '%s' failed: %s" % (self.name, e))
+                self.error = e
+                self.release_item(item)
+                continue
+
+            if self.enable_profiling == True:
+                elapsed = now_ns() - start
+                self.latency.record(elapsed)
+                self.proc_time += elapsed / 1e6
+            self.frame_count += 1
+
+            if self.out_queue is not None and item is not None:
+                self.out_queue.put(item)
+
+        if self.out_queue is not None:
+            self.out_queue.put(None)
+
+    def release_item(self, item):
+        release = getattr(item, "release", None)
+        if release is not None:
+            release()
+
+class Pipeline(object):
+    """
+    description: A Pipeline class that chains stage workers with bounded queues,
+                 so that the stages of different batches overlap in time.
+    """
+
+    def __init__(self, stages, queue_depth, enable_profiling):
+        """
+        param:
+            stages:             a list of (name, func) tuples, func takes and returns one item
+            queue_depth:        the maximum number of items waiting in front of each stage
+            enable_profiling:   accumulate per-stage processing time
+        """
+        print("Pipeline init")
+
+        queues = [queue.Queue(maxsize=queue_depth) for _ in stages]
+        workers = []
+        for index, (name, func) in enumerate(stages):
+            out_queue = queues[index + 1] if index + 1 < len(stages) else None
+            workers.append(PipelineStage(name, func, queues[index], out_queue, enable_profiling))
+
+        for worker in workers:
+            worker.start()
+
+        self.queues = queues
+        self.workers = workers
+        self.closed = False
+
+        self.start_time = None
+        self.end_time = None
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("Pipeline destroy")
+
+        self.finish()
+
+    def submit(self, item):
+        """
+        description: Hand an item to the first stage. Blocks while the first queue is full.
+        param:
+            item:   an object passed to the first stage function
+        return:
+            no return
+        """
+
+        self.check_error()
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.queues[0].put(item)
+
+    def finish(self):
+        """
+        description: Flush every queued item through the pipeline and stop the workers.
+        """
+
+        if self.closed is True:
+            return
+        self.closed = True
+
+        self.queues[0].put(None)
+        for worker in self.workers:
+            worker.join()
+        self.end_time = time.time()
+
+        self.check_error()
+
+    def check_error(self):
+        for worker in self.workers:
+            if worker.error is not None:
+                raise RuntimeError("Pipeline stage '%s' failed" % worker.name) from worker.error
+
+    def get_stage_times(self):
+        """
+        description: Get the average processing time of every stage.
+        return:
+            stage_times: a list of (name, avg. msec per item) tuples
+        """
+
+        stage_times = []
+        for worker in self.workers:
+            avg_time = worker.proc_time / worker.frame_count if worker.frame_count > 0 else 0
+            stage_times.append((worker.name, avg_time))
+        return stage_times
+
+    def get_queue_depths(self):
+        """
+        description: Get the current and the maximum number of items waiting in front of every stage.
+        return:
+            queue_depths: a list of (name, depth, max. depth) tuples
+        """
+
+        return [(worker.name, worker.in_queue.qsize(), worker.max_queue_depth) for worker in self.workers]
+
+    def get_wall_time(self):
+        """
+        description: Get the wall-clock time between the first submit and the end of finish.
+        return:
+            wall_time: elapsed msec
+        """
+
+        if self.start_time is None:
+            return 0
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return (end_time - self.start_time) * 1000
@@ -9,21 +9,36 @@ The property of program is under Korea Electronics Technology Institute.
 For more information, contact us at <jw.jeong@keti.re.kr>.
 """
 
-import time
+import sys
 import numpy as np
-import pycuda.autoinit
-import pycuda.driver as cuda
-import torch
-import torchvision
+
+import NMS
+from Metrics import now_ns, LatencyHistogram
+
+# A box ending within this many pixels of a tile edge inside the frame is cut by the tile
+TILE_BORDER_MARGIN = 4
 
 class PostProcessor(object):
     """
     description: A PostProcessor class that warps postprocess ops.
     """
     
-    def __init__(self, input_shape, infer_shape, conf_threshold, iou_threshold, enable_profiling):
+    def __init__(self, input_shape, infer_shape, conf_threshold, iou_threshold, enable_profiling, nms_backend="numpy", pre_nms_top_k=-1):
         print("PostProcessor init")
         
+        if nms_backend == "torch":
+            # torch is only imported on request, it costs seconds of startup on the target
+            import torch
+            import torchvision
+            
+            def batched_nms(boxes, scores, idxs, iou_threshold):
+                return torchvision.ops.batched_nms(torch.from_numpy(boxes), torch.from_numpy(scores),
+                    torch.from_numpy(idxs), iou_threshold=iou_threshold).numpy()
+        elif nms_backend == "numpy":
+            batched_nms = NMS.batched_nms
+        else:
+            raise ValueError("Unknown NMS backend: %s" % nms_backend)
+        
         max_batch_size, input_height, input_width, input_channel = input_shape
         max_batch_size, infer_height, infer_width, infer_channel = infer_shape
         
@@ -40,7 +55,11 @@ class PostProcessor(object):
         self.conf_threshold = conf_threshold
         self.iou_threshold = iou_threshold
         
+        self.batched_nms = batched_nms
+        self.pre_nms_top_k = pre_nms_top_k
+        
         self.proc_time = 0
+        self.latency = LatencyHistogram()
         self.enable_profiling = enable_profiling
     
     def destroy(self):
@@ -54,12 +73,12 @@ class PostProcessor(object):
             infer_w:    width of inference image
             origin_h:   height of original image
             origin_w:   width of original image
-            x:          A boxes tensor, each row is a box [center_x, center_y, w, h]
+            x:          A boxes numpy, each row is a box [center_x, center_y, w, h]
         return:
-            y:          A boxes tensor, each row is a box [x1, y1, x2, y2]
+            y:          A boxes numpy, each row is a box [x1, y1, x2, y2]
         """
         
-        y = torch.zeros_like(x) if isinstance(x, torch.Tensor) else np.zeros_like(x)
+        y = np.zeros_like(x)
         r_w = infer_w / origin_w
         r_h = infer_h / origin_h
         if r_h > r_w:
@@ -77,91 +96,268 @@ class PostProcessor(object):
 
         return y
     
+    def xywh2xyxy_crops(self, infer_h, infer_w, crops, x):
+        """
+        description:    Convert nx4 boxes of letterboxed crops from [x, y, w, h] to [x1, y1, x2, y2] in the frame
+        param:
+            infer_h:    height of inference image
+            infer_w:    width of inference image
+            crops:      a nx4 numpy, the crop [x, y, w, h] in the frame of every box
+            x:          A boxes numpy, each row is a box [center_x, center_y, w, h]
+        return:
+            y:          A boxes numpy, each row is a box [x1, y1, x2, y2]
+        """
+        
+        # xywh2xyxy with a ratio and a padding per box
+        crop_w = crops[:, 2].astype(np.float32)
+        crop_h = crops[:, 3].astype(np.float32)
+        r = np.minimum(infer_w / crop_w, infer_h / crop_h)
+        pad_x = (infer_w - r * crop_w) / 2
+        pad_y = (infer_h - r * crop_h) / 2
+        
+        y = np.empty_like(x)
+        y[:, 0] = (x[:, 0] - x[:, 2] / 2 - pad_x) / r + crops[:, 0]
+        y[:, 2] = (x[:, 0] + x[:, 2] / 2 - pad_x) / r + crops[:, 0]
+        y[:, 1] = (x[:, 1] - x[:, 3] / 2 - pad_y) / r + crops[:, 1]
+        y[:, 3] = (x[:, 1] + x[:, 3] / 2 - pad_y) / r + crops[:, 1]
+        return y
+    
+    def decode_predictions(self, output, num_images):
+        """
+        description: Select the predictions above the confidence threshold of every image in the output.
+        return:
+            image_index: a (N,) array, the image of each prediction
+            pred: a (N, 6) array of [cx, cy, w, h, conf, cls_id] in inference coordinates
+        """
+        
+        # Decode the [num, cx,cy,w,h,conf,cls] blocks of all images with one reshape
+        tensor = np.reshape(output, (self.max_batch_size, -1))[:num_images]
+        nums = tensor[:, 0].astype(np.int64)
+        pred = np.reshape(tensor[:, 1:], (num_images, -1, 6))
+        
+        valid = np.arange(pred.shape[1])[None, :] < nums[:, None]
+        valid &= pred[:, :, 4] > self.conf_threshold
+        
+        # Keep the pre_nms_top_k best boxes of every image, argpartition avoids a full sort.
+        # An image holds at most pred.shape[1] boxes, a larger pre_nms_top_k keeps them all
+        pre_nms_top_k = self.pre_nms_top_k
+        if pre_nms_top_k > 0 and pre_nms_top_k < pred.shape[1]:
+            masked_scores = np.where(valid, pred[:, :, 4], -np.inf)
+            top = np.argpartition(-masked_scores, pre_nms_top_k - 1, axis=1)[:, :pre_nms_top_k]
+            top_mask = np.zeros_like(valid)
+            np.put_along_axis(top_mask, top, True, axis=1)
+            valid &= top_mask
+        image_index, _ = np.nonzero(valid)
+        return image_index, pred[valid]
+    
+    def decode(self, output, num_images):
+        """
+        description: Decode the boxes above the confidence threshold of every image in the output.
+        return:
+            image_index: a (N,) array, the image of each box
+            boxes, scores, classid: the decoded boxes [x1, y1, x2, y2] in input coordinates, their scores and class ids
+        """
+        
+        image_index, pred = self.decode_predictions(output, num_images)
+        boxes = self.xywh2xyxy(self.infer_height, self.infer_width, self.input_height, self.input_width, pred[:, :4])
+        scores = np.ascontiguousarray(pred[:, 4])
+        classid = pred[:, 5]
+        return image_index, boxes, scores, classid
+    
+    def split_results(self, indices, image_index, boxes, scores, classid, batch_size):
+        indices = indices[np.argsort(image_index[indices], kind='stable')]
+        splits = np.cumsum(np.bincount(image_index[indices], minlength=batch_size))[:-1]
+        return np.split(boxes[indices], splits), np.split(scores[indices], splits), np.split(classid[indices], splits)
+    
     def post_process(self, output, batch_size):
         """
-        description: postprocess the prediction
+        description: postprocess the prediction of every image in the batch at once
         param:
-            output:     A tensor likes [num_boxes,cx,cy,w,h,conf,cls_id, cx,cy,w,h,conf,cls_id, ...] 
+            output:     A tensor likes [num_boxes,cx,cy,w,h,conf,cls_id, cx,cy,w,h,conf,cls_id, ...] per image
+            batch_size: number of valid images in output
         return:
-            result_boxes: finally boxes, a boxes tensor, each row is a box [x1, y1, x2, y2]
-            result_scores: finally scores, a tensor, each element is the score correspoing to box
-            result_classid: finally classid, a tensor, each element is the classid correspoing to box
+            result_boxes: a list of per-image boxes arrays, each row is a box [x1, y1, x2, y2]
+            result_scores: a list of per-image scores arrays, each element is the score correspoing to box
+            result_classid: a list of per-image classid arrays, each element is the classid correspoing to box
         """
         
         if self.enable_profiling == True:
-            start = time.time()
+            start = now_ns()
         
-        input_width = self.input_width
-        input_height = self.input_height
+        image_index, boxes, scores, classid = self.decode(output, batch_size)
         
-        infer_width = self.infer_width
-        infer_height = self.infer_height
+        # NMS is done per image by keying the boxes with their image index
+        indices = self.batched_nms(boxes, scores, image_index, self.iou_threshold)
+        result_boxes, result_scores, result_classid = self.split_results(indices, image_index, boxes, scores, classid, batch_size)
         
-        max_batch_size = self.max_batch_size
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
         
-        conf_threshold = self.conf_threshold
-        iou_threshold = self.iou_threshold
+        return result_boxes, result_scores, result_classid
+    
+    def post_process_crops(self, output, batch_size, crops, crop_image_index):
+        """
+        description: postprocess the prediction of letterboxed crops of the images, the input shape of the PostProcessor
+                     is the inference shape. The boxes of all crops of an image go through one NMS, so the crops may overlap.
+        param:
+            output:             the prediction of len(crops) crops
+            batch_size:         number of valid images
+            crops:              a (num_crops, 4) array of the [x, y, w, h] of every crop in its image
+            crop_image_index:   a (num_crops,) array, the image of every crop
+        return:
+            result_boxes, result_scores, result_classid: per image, like post_process
+        """
         
-        result_boxes = None
-        result_scores = None
-        result_classid = None
+        if self.enable_profiling == True:
+            start = now_ns()
         
-        if batch_size > 1:
-            tensor = np.reshape(output, (max_batch_size, int(output.size / max_batch_size)))
-            pred_arr = None
-            
-            for index in range(0, batch_size):
-                num = int(tensor[index][0])
-                pred = np.reshape(tensor[index][1:], (-1, 6))[:num, :]
-                
-                scores = pred[:, 4]
-                si = scores > self.conf_threshold
-                pred = pred[si, :]
-                
-                pred[:, 0] += float(infer_width * 2 * index)
-                pred[:, 1] += float(infer_height * 2 * index)
-                
-                if index == 0:
-                    pred_arr = pred
-                else:
-                    pred_arr = np.concatenate((pred_arr, pred), axis=0)
-            
-            pred_arr = torch.Tensor(pred_arr).cpu()
-            boxes_arr = pred_arr[:, :4]
-            scores_arr = pred_arr[:, 4]
-            classid_arr = pred_arr[:, 5]
-            
-            boxes_arr = self.xywh2xyxy(self.infer_height, self.infer_width, self.input_height, self.input_width, boxes_arr)
-            
-            indices = torchvision.ops.nms(boxes_arr, scores_arr, iou_threshold=self.iou_threshold).cpu()
-            result_boxes = boxes_arr[indices, :].cpu()
-            result_scores = scores_arr[indices].cpu()
-            result_classid = classid_arr[indices].cpu()
-        else:
-            num = int(output[0])
-            pred = np.reshape(output[1:], (-1, 6))[:num, :]
-            scores = pred[:, 4]
-            si = scores > conf_threshold
-            pred = pred[si, :]
-            
-            pred = torch.Tensor(pred).cpu()
-            boxes = pred[:, :4]
-            scores = pred[:, 4]
-            classid = pred[:, 5]
-            
-            #boxes = boxes[si, :]
-            #scores = scores[si]
-            #classid = classid[si]
-            
-            boxes = self.xywh2xyxy(infer_height, infer_width, input_height, input_width, boxes)
-            
-            indices = torchvision.ops.nms(boxes, scores, iou_threshold=iou_threshold).cpu()
-            result_boxes = boxes[indices, :].cpu()
-            result_scores = scores[indices].cpu()
-            result_classid = classid[indices].cpu()
+        crops = np.asarray(crops).reshape(-1, 4)
+        crop_index, pred = self.decode_predictions(output, len(crops))
+        image_index = np.asarray(crop_image_index, dtype=np.int64)[crop_index]
+        
+        boxes = self.xywh2xyxy_crops(self.infer_height, self.infer_width, crops[crop_index], pred[:, :4])
+        scores = np.ascontiguousarray(pred[:, 4])
+        classid = pred[:, 5]
+        
+        indices = self.batched_nms(boxes, scores, image_index, self.iou_threshold)
+        result_boxes, result_scores, result_classid = self.split_results(indices, image_index, boxes, scores, classid, batch_size)
+        
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+        
+        return result_boxes, result_scores, result_classid
+    
+    def post_process_tiles(self, output, batch_size, tile_offsets, border_margin=TILE_BORDER_MARGIN):
+        """
+        description: postprocess the prediction of tiled images, the input shape of the PostProcessor is the tile shape.
+                     The boxes of all tiles of an image are moved into the image and merged by NMS.
+                     A box cut by a tile edge inside the image is dropped when it lies mostly inside
+                     a whole box of another tile, the whole object is seen there thanks to the tile overlap.
+        param:
+            output:         the prediction of batch_size * len(tile_offsets) tiles, the tiles of an image in a row
+            batch_size:     number of valid images in output
+            tile_offsets:   a (num_tiles, 2) array of the [x, y] of every tile in its image
+            border_margin:  pixels from a tile edge within which a box counts as cut
+        return:
+            result_boxes, result_scores, result_classid: per image, like post_process
+        """
+        
+        if self.enable_profiling == True:
+            start = now_ns()
+        
+        tile_offsets = np.asarray(tile_offsets)
+        num_tiles = len(tile_offsets)
+        tile_index, boxes, scores, classid = self.decode(output, batch_size * num_tiles)
+        image_index = tile_index // num_tiles
+        tile_index = tile_index % num_tiles
+        
+        tile_x = tile_offsets[tile_index, 0]
+        tile_y = tile_offsets[tile_index, 1]
+        boxes[:, [0, 2]] += tile_x[:, None]
+        boxes[:, [1, 3]] += tile_y[:, None]
+        
+        # The last tiles end at the image edges, the tile edges before them are inside the image
+        image_width = tile_offsets[:, 0].max() + self.input_width
+        image_height = tile_offsets[:, 1].max() + self.input_height
+        cut = (tile_x > 0) & (boxes[:, 0] < tile_x + border_margin)
+        cut |= (tile_y > 0) & (boxes[:, 1] < tile_y + border_margin)
+        cut |= (tile_x + self.input_width < image_width) & (boxes[:, 2] > tile_x + self.input_width - border_margin)
+        cut |= (tile_y + self.input_height < image_height) & (boxes[:, 3] > tile_y + self.input_height - border_margin)
+        
+        # Cut boxes must not suppress whole boxes, so each kind goes through NMS on its own first
+        cut_indices = np.nonzero(cut)[0]
+        cut_indices = cut_indices[self.batched_nms(boxes[cut_indices], scores[cut_indices], image_index[cut_indices], self.iou_threshold)]
+        whole_indices = np.nonzero(~cut)[0]
+        whole_indices = whole_indices[self.batched_nms(boxes[whole_indices], scores[whole_indices], image_index[whole_indices], self.iou_threshold)]
+        
+        if len(cut_indices) > 0 and len(whole_indices) > 0:
+            cut_boxes = boxes[cut_indices]
+            whole_boxes = boxes[whole_indices]
+            inter_w = np.minimum(cut_boxes[:, None, 2], whole_boxes[None, :, 2]) - np.maximum(cut_boxes[:, None, 0], whole_boxes[None, :, 0])
+            inter_h = np.minimum(cut_boxes[:, None, 3], whole_boxes[None, :, 3]) - np.maximum(cut_boxes[:, None, 1], whole_boxes[None, :, 1])
+            inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inside = inter / NMS.box_area(cut_boxes)[:, None] > self.iou_threshold
+            inside &= image_index[cut_indices][:, None] == image_index[whole_indices][None, :]
+            inside &= tile_index[cut_indices][:, None] != tile_index[whole_indices][None, :]
+            cut_indices = cut_indices[~inside.any(axis=1)]
+        
+        # A kept cut box overlaps the whole boxes of other tiles by at most the IoU threshold, so it cannot suppress them
+        indices = np.concatenate([whole_indices, cut_indices])
+        indices = indices[self.batched_nms(boxes[indices], scores[indices], image_index[indices], self.iou_threshold)]
+        
+        result_boxes, result_scores, result_classid = self.split_results(indices, image_index, boxes, scores, classid, batch_size)
         
         if self.enable_profiling == True:
-            end = time.time()
-            self.proc_time += (end - start) * 1000
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
         
         return result_boxes, result_scores, result_classid
+
+def check_tiling(num_objects=40, image_size=(1920, 1080), tile_size=(640, 640), overlap=128, cut_first=False, seed=0):
+    """
+    description: Detect synthetic objects with a perfect detector on every tile that sees them, the parts cut by
+                 a tile edge included, and merge the tiles with post_process_tiles.
+                 The more of an object a tile sees the higher its score, or the lower with cut_first.
+    return:
+        missed, duplicated, max_error: objects without a box, extra boxes and the largest corner error in pixels
+    """
+
+    from Backend import MAX_OUTPUT_BBOX_COUNT, get_tile_offsets
+
+    image_width, image_height = image_size
+    tile_width, tile_height = tile_size
+    tile_offsets = get_tile_offsets(image_width, image_height, tile_width, tile_height, overlap)
+    num_tiles = len(tile_offsets)
+
+    # Objects smaller than the overlap, so each of them is whole in some tile
+    rng = np.random.RandomState(seed)
+    wh = rng.uniform(16, overlap - 8, (num_objects, 2))
+    xy = rng.uniform(0, 1, (num_objects, 2)) * (np.array(image_size) - wh)
+    objects = np.concatenate([xy, xy + wh], axis=1)
+
+    output = np.zeros((num_tiles, 1 + MAX_OUTPUT_BBOX_COUNT * 6), dtype=np.float32)
+    for tile_index, (x, y) in enumerate(tile_offsets):
+        visible = np.clip(objects - [x, y, x, y], 0, [tile_width, tile_height, tile_width, tile_height])
+        seen = (visible[:, 2] > visible[:, 0] + 1) & (visible[:, 3] > visible[:, 1] + 1)
+        visible = visible[seen]
+        visible_fraction = NMS.box_area(visible) / NMS.box_area(objects[seen])
+        pred = np.zeros((len(visible), 6), dtype=np.float32)
+        pred[:, 0] = (visible[:, 0] + visible[:, 2]) / 2
+        pred[:, 1] = (visible[:, 1] + visible[:, 3]) / 2
+        pred[:, 2] = visible[:, 2] - visible[:, 0]
+        pred[:, 3] = visible[:, 3] - visible[:, 1]
+        pred[:, 4] = 0.9 - 0.4 * visible_fraction if cut_first is True else 0.5 + 0.4 * visible_fraction
+        output[tile_index, 0] = len(pred)
+        output[tile_index, 1:1 + pred.size] = pred.ravel()
+
+    tile_shape = (num_tiles, tile_height, tile_width, 3)
+    post_proc = PostProcessor(tile_shape, tile_shape, 0.01, 0.6, False)
+    result_boxes, result_scores, result_classid = post_proc.post_process_tiles(output, 1, tile_offsets)
+    post_proc.destroy()
+
+    boxes = result_boxes[0]
+    inter_w = np.minimum(objects[:, None, 2], boxes[None, :, 2]) - np.maximum(objects[:, None, 0], boxes[None, :, 0])
+    inter_h = np.minimum(objects[:, None, 3], boxes[None, :, 3]) - np.maximum(objects[:, None, 1], boxes[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    iou = inter / (NMS.box_area(objects)[:, None] + NMS.box_area(boxes)[None, :] - inter)
+
+    matched = iou.argmax(axis=1)
+    missed = int((iou.max(axis=1) < 0.9).sum())
+    duplicated = len(boxes) - len(np.unique(matched))
+    max_error = float(np.abs(boxes[matched] - objects).max()) if len(boxes) > 0 else 0
+    return missed, duplicated, max_error
+
+if __name__ == '__main__':
+    failed = False
+    for cut_first in (False, True):
+        for seed in range(5):
+            missed, duplicated, max_error = check_tiling(cut_first=cut_first, seed=seed)
+            print('Tile merge cut first : {}, seed : {}, missed : {}, duplicated : {}, max box error : {:.3f} px'.format(cut_first, seed, missed, duplicated, max_error))
+            failed |= missed > 0 or duplicated > 0 or max_error > 0.01
+    sys.exit(1 if failed else 0)
@@ -9,13 +9,14 @@ The property of program is under Korea Electronics Technology Institute.
 For more information, contact us at <jw.jeong@keti.re.kr>.
 """
 
-import time
 import ctypes
 import numpy
 import pycuda.autoinit
 import pycuda.driver as cuda
 import pycuda.gpuarray as gpuarray
 
+from Metrics import now_ns, LatencyHistogram
+
 class PreProcessor(object):
     """
     description: A PreProcessor class that warps preprocess ops.
@@ -60,6 +61,7 @@ class PreProcessor(object):
         self.pre_process_lib = pre_process_lib
         
         self.proc_time = 0
+        self.latency = LatencyHistogram()
         self.enable_profiling = enable_profiling
         
     def destroy(self):
@@ -80,7 +82,7 @@ class PreProcessor(object):
         """
         
         if self.enable_profiling == True:
-            start = time.time()
+            start = now_ns()
         
         input_width = self.input_width
         input_height = self.input_height
@@ -98,8 +100,11 @@ class PreProcessor(object):
         FLOATP = ctypes.POINTER(ctypes.c_float)
         VOIDP = ctypes.POINTER(ctypes.c_void_p)
         
+        # Only the valid images are copied, a staging buffer is already contiguous so this is no host copy
+        input_image = numpy.ascontiguousarray(input_image[:batch_size])
+        
         self.cfx.push()
-        cuda.memcpy_htod(d_img.ptr, input_image.ravel())
+        cuda.memcpy_htod(d_img.ptr, input_image)
         self.pre_process_lib.ImagePreProcessing(input_width, input_height,
             infer_width, infer_height, batch_size,
             ctypes.cast(d_img.ptr, UCHARP),
@@ -110,7 +115,8 @@ class PreProcessor(object):
         self.cfx.pop()
         
         if self.enable_profiling == True:
-            end = time.time()
-            self.proc_time += (end - start) * 1000
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
         
         return d_img_resize.ptr
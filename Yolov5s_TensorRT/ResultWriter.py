@@ -0,0 +1,108 @@
+"""
+File: ResultWriter.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import json
+import time
+
+class ResultWriter(object):
+    """
+    description: A ResultWriter class that streams detection results as JSON Lines.
+                 Every line is one record: an annotation record has a 'file_name' and its 'objects',
+                 any other record carries run information such as 'param_num' or the processing times.
+    """
+
+    def __init__(self, json_path, param_num, flush_interval):
+        """
+        param:
+            json_path:      path of the JSON Lines file
+            param_num:      number of model parameters written to the header record
+            flush_interval: seconds between two flushes of the file
+        """
+        print("ResultWriter init")
+
+        self.json_file = open(json_path, 'w')
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.record_count = 0
+
+        self.write_record({'param_num': param_num, 'preproc_time': 0, 'inference_time': 0, 'postproc_time': 0})
+
+    def destroy(self):
+        print("ResultWriter destroy")
+
+        self.json_file.flush()
+        self.json_file.close()
+
+    def write(self, file_name, boxes, scores, track_ids=None):
+        """
+        description: Write the detections of one image.
+        param:
+            file_name:  file name of the image
+            boxes:      a boxes numpy, each row is a box [x1, y1, x2, y2]
+            scores:     a scores numpy, each element is the score correspoing to box
+            track_ids:  an optional track ids numpy, each element is the track id of the box
+        return:
+            no return
+        """
+
+        annotation = {'file_name': file_name, 'objects': []}
+        for b, p in zip(boxes.tolist(), scores.tolist()):
+            tmp = {'position': b, 'confidence_score': float(p)}
+            annotation['objects'].append(tmp)
+        if track_ids is not None:
+            for tmp, track_id in zip(annotation['objects'], track_ids.tolist()):
+                tmp['track_id'] = track_id
+        self.write_record(annotation)
+
+    def write_summary(self, summary):
+        """
+        description: Write a run information record, later records override the earlier ones.
+        """
+
+        self.write_record(summary)
+
+    def write_record(self, record):
+        self.json_file.write(json.dumps(record))
+        self.json_file.write('\n')
+        self.record_count += 1
+
+        now = time.time()
+        if now - self.last_flush >= self.flush_interval:
+            self.json_file.flush()
+            self.last_flush = now
+
+def load_json_lines(json_path):
+    """
+    description: Read a JSON Lines result file back into the layout of the old result.json.
+                 A truncated last line, e.g. after a crash, is skipped.
+    return:
+        pred_data: {'param_num': ..., 'inference_time': ..., 'annotations': [...]}
+    """
+
+    pred_data = {'annotations': []}
+    with open(json_path, 'r') as json_file:
+        for line_num, line in enumerate(json_file):
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print('Skip broken record at line {}'.format(line_num + 1))
+                continue
+
+            if 'file_name' in record:
+                pred_data['annotations'].append(record)
+            else:
+                pred_data.update(record)
+
+    return pred_data
@@ -0,0 +1,88 @@
+"""
+File: SceneGate.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import numpy as np
+import cv2
+
+from Metrics import now_ns, LatencyHistogram
+
+class SceneGate(object):
+    """
+    description: A SceneGate class that decides per frame whether the detector has to run.
+                 A frame is compared with the last inferred frame of its source on a small grayscale thumbnail,
+                 a frame that barely changed reuses the detections of that frame.
+    """
+
+    def __init__(self, threshold, max_reuse, thumbnail_size, enable_profiling):
+        """
+        param:
+            threshold:      mean absolute thumbnail difference in gray levels below which a frame is static
+            max_reuse:      maximum number of frames in a row that reuse the detections of a source
+            thumbnail_size: (width, height) of the thumbnail the frames are compared on
+        """
+        print("SceneGate init")
+
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.thumbnail_size = thumbnail_size
+
+        # Per source: the thumbnail of the last inferred frame and the number of frames that reused it
+        self.references = {}
+        self.reuse_runs = {}
+
+        self.infer_count = 0
+        self.reuse_count = 0
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def destroy(self):
+        print("SceneGate destroy")
+
+    def get_thumbnail(self, image):
+        # INTER_AREA averages the pixels, so sensor noise hardly reaches the difference
+        thumbnail = cv2.resize(image, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def check(self, source_id, image):
+        """
+        description: Decide whether a frame needs the detector, frames of a source must be checked in order.
+        param:
+            source_id:  the source of the frame, the frames of a source are compared with each other only
+            image:      a (height, width, 3) uint8 BGR frame
+        return:
+            reuse: True if the frame can reuse the detections of the last inferred frame of its source
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        thumbnail = self.get_thumbnail(image)
+        reference = self.references.get(source_id)
+
+        reuse = False
+        if reference is not None and self.reuse_runs[source_id] < self.max_reuse:
+            reuse = float(np.abs(thumbnail - reference).mean()) < self.threshold
+
+        if reuse is True:
+            self.reuse_runs[source_id] += 1
+            self.reuse_count += 1
+        else:
+            self.references[source_id] = thumbnail
+            self.reuse_runs[source_id] = 0
+            self.infer_count += 1
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return reuse
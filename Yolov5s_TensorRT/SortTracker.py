@@ -0,0 +1,284 @@
+"""
+File: SortTracker.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import sys
+import time
+import numpy as np
+
+from NMS import box_area
+from Metrics import now_ns, LatencyHistogram
+
+# Constant velocity model of SORT on [cx, cy, area, aspect, vx, vy, varea], the aspect ratio has no velocity
+STATE_TRANSITION = np.eye(7)
+STATE_TRANSITION[0, 4] = STATE_TRANSITION[1, 5] = STATE_TRANSITION[2, 6] = 1
+MEASUREMENT = np.eye(4, 7)
+
+MEASUREMENT_NOISE = np.diag([1.0, 1.0, 10.0, 10.0])
+PROCESS_NOISE = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+INITIAL_COVARIANCE = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+def box_iou(boxes_a, boxes_b):
+    """
+    description: IoU of every pair of two box sets.
+    return:
+        iou: a (len(boxes_a), len(boxes_b)) array
+    """
+
+    inter_w = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2]) - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    inter_h = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3]) - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    union = box_area(boxes_a)[:, None] + box_area(boxes_b)[None, :] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, inter / union, 0)
+
+def boxes_to_measurements(boxes):
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / np.maximum(h, 1e-6)], axis=1)
+
+def states_to_boxes(states):
+    w = np.sqrt(np.clip(states[:, 2] * states[:, 3], 0, None))
+    h = states[:, 2] / np.maximum(w, 1e-6)
+    return np.stack([states[:, 0] - w / 2, states[:, 1] - h / 2, states[:, 0] + w / 2, states[:, 1] + h / 2], axis=1)
+
+def greedy_match(iou, iou_threshold):
+    """
+    description: Match the pairs of highest IoU first, every row and column is matched at most once.
+    return:
+        rows, cols: int64 arrays of the matched pairs
+    """
+
+    rows = []
+    cols = []
+    if iou.size == 0:
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+    # Candidate pairs sorted by IoU, a pair is taken unless its row or column is already used
+    candidate_rows, candidate_cols = np.nonzero(iou >= iou_threshold)
+    order = np.argsort(-iou[candidate_rows, candidate_cols], kind='stable')
+    used_rows = np.zeros(iou.shape[0], dtype=bool)
+    used_cols = np.zeros(iou.shape[1], dtype=bool)
+    for row, col in zip(candidate_rows[order].tolist(), candidate_cols[order].tolist()):
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        rows.append(row)
+        cols.append(col)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+class SortTracker(object):
+    """
+    description: A SortTracker class that follows the detections of one source with the SORT algorithm.
+                 The Kalman filters of all tracks are one array, so predicting and updating them is a few
+                 batched matrix products instead of one filter object per track.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=3, enable_profiling=False):
+        """
+        param:
+            iou_threshold:  minimum IoU of a detection and a predicted track to be matched, boxes of other classes never match
+            max_age:        updates a track may miss before it is deleted
+        """
+
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+
+        self.states = np.zeros((0, 7))
+        self.covariances = np.zeros((0, 7, 7))
+        self.track_ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.classid = np.zeros(0, dtype=np.float32)
+        self.misses = np.zeros(0, dtype=np.int64)
+        self.next_track_id = 0
+
+        self.proc_time = 0
+        self.latency = LatencyHistogram()
+        self.enable_profiling = enable_profiling
+
+    def predict(self):
+        """
+        description: Move every track one frame ahead.
+        return:
+            boxes, scores, classid, track_ids: the predicted boxes of the tracks matched by the last update
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        self.advance()
+        result = self.get_results()
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return result
+
+    def advance(self):
+        # Keep the area positive, like SORT
+        shrinking = self.states[:, 2] + self.states[:, 6] <= 0
+        self.states[shrinking, 6] = 0
+
+        self.states = self.states @ STATE_TRANSITION.T
+        self.covariances = STATE_TRANSITION @ self.covariances @ STATE_TRANSITION.T + PROCESS_NOISE
+
+    def update(self, boxes, scores, classid):
+        """
+        description: Move the tracks one frame ahead and correct them with the detections of that frame.
+        param:
+            boxes:      a (N, 4) array of detections [x1, y1, x2, y2]
+            scores:     a (N,) array of scores
+            classid:    a (N,) array of class ids
+        return:
+            boxes, scores, classid, track_ids: the detections in their order with the ID of their track
+        """
+
+        if self.enable_profiling == True:
+            start = now_ns()
+
+        self.advance()
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        iou = box_iou(states_to_boxes(self.states), boxes)
+        iou[self.classid[:, None] != np.asarray(classid)[None, :]] = 0
+        rows, cols = greedy_match(iou, self.iou_threshold)
+
+        # Kalman update of the matched tracks, batched over the tracks
+        if len(rows) > 0:
+            states = self.states[rows]
+            covariances = self.covariances[rows]
+            innovation = boxes_to_measurements(boxes[cols]) - states @ MEASUREMENT.T
+            innovation_covariances = MEASUREMENT @ covariances @ MEASUREMENT.T + MEASUREMENT_NOISE
+            gains = covariances @ MEASUREMENT.T @ np.linalg.inv(innovation_covariances)
+            self.states[rows] = states + (gains @ innovation[:, :, None])[:, :, 0]
+            self.covariances[rows] = (np.eye(7) - gains @ MEASUREMENT) @ covariances
+            self.scores[rows] = np.asarray(scores)[cols]
+
+        self.misses += 1
+        self.misses[rows] = 0
+
+        # Unmatched detections start new tracks
+        new = np.ones(len(boxes), dtype=bool)
+        new[cols] = False
+        num_new = int(new.sum())
+        new_states = np.zeros((num_new, 7))
+        new_states[:, :4] = boxes_to_measurements(boxes[new])
+        new_track_ids = np.arange(self.next_track_id, self.next_track_id + num_new, dtype=np.int64)
+        self.next_track_id += num_new
+
+        detection_track_ids = np.empty(len(boxes), dtype=np.int64)
+        detection_track_ids[cols] = self.track_ids[rows]
+        detection_track_ids[new] = new_track_ids
+
+        self.states = np.concatenate([self.states, new_states])
+        self.covariances = np.concatenate([self.covariances, np.repeat(INITIAL_COVARIANCE[None], num_new, axis=0)])
+        self.track_ids = np.concatenate([self.track_ids, new_track_ids])
+        self.scores = np.concatenate([self.scores, np.asarray(scores, dtype=np.float32)[new]])
+        self.classid = np.concatenate([self.classid, np.asarray(classid, dtype=np.float32)[new]])
+        self.misses = np.concatenate([self.misses, np.zeros(num_new, dtype=np.int64)])
+
+        alive = self.misses <= self.max_age
+        if not alive.all():
+            self.states = self.states[alive]
+            self.covariances = self.covariances[alive]
+            self.track_ids = self.track_ids[alive]
+            self.scores = self.scores[alive]
+            self.classid = self.classid[alive]
+            self.misses = self.misses[alive]
+
+        if self.enable_profiling == True:
+            elapsed = now_ns() - start
+            self.latency.record(elapsed)
+            self.proc_time += elapsed / 1e6
+
+        return boxes.astype(np.float32), np.asarray(scores), np.asarray(classid), detection_track_ids
+
+    def get_results(self):
+        current = self.misses == 0
+        return (states_to_boxes(self.states[current]).astype(np.float32), self.scores[current],
+                self.classid[current], self.track_ids[current])
+
+def benchmark(nums=(10, 50, 100, 200), num_frames=100, repeat=3, seed=0):
+    """
+    description: Print the update and predict time of the tracker on synthetic moving boxes.
+    """
+
+    rng = np.random.RandomState(seed)
+    print("%8s %12s %12s" % ("boxes", "update(ms)", "predict(ms)"))
+    for num in nums:
+        xy = rng.uniform(0, 1800, (num, 2))
+        wh = rng.uniform(20, 120, (num, 2))
+        velocity = rng.uniform(-5, 5, (num, 2))
+        classid = rng.randint(0, 80, num).astype(np.float32)
+        scores = rng.uniform(0.3, 1, num).astype(np.float32)
+
+        update_time = 0
+        predict_time = 0
+        for _ in range(repeat):
+            tracker = SortTracker()
+            for frame in range(num_frames):
+                position = xy + velocity * frame
+                boxes = np.concatenate([position, position + wh], axis=1)
+
+                start = time.time()
+                tracker.update(boxes, scores, classid)
+                update_time += time.time() - start
+
+                start = time.time()
+                tracker.predict()
+                predict_time += time.time() - start
+
+        count = repeat * num_frames
+        print("%8d %12.3f %12.3f" % (num, update_time * 1000 / count, predict_time * 1000 / count))
+
+def check_tracking(num=50, num_frames=30, keyframe_interval=3, noise=1.0, seed=0):
+    """
+    description: Follow synthetic boxes moving at a constant velocity, detected every keyframe_interval frames
+                 with noise px of gaussian jitter on the corners.
+    return:
+        id_switches, max_error: track ID changes of the objects and the largest corner error of a predicted box in pixels
+    """
+
+    rng = np.random.RandomState(seed)
+    xy = rng.uniform(0, 1800, (num, 2))
+    wh = rng.uniform(40, 120, (num, 2))
+    velocity = rng.uniform(-3, 3, (num, 2))
+    classid = np.zeros(num, dtype=np.float32)
+    scores = np.ones(num, dtype=np.float32)
+
+    tracker = SortTracker()
+    object_track_ids = None
+    id_switches = 0
+    max_error = 0
+    for frame in range(num_frames):
+        position = xy + velocity * frame
+        boxes = np.concatenate([position, position + wh], axis=1)
+        if frame % keyframe_interval == 0:
+            _, _, _, track_ids = tracker.update(boxes + rng.normal(0, noise, boxes.shape), scores, classid)
+            if object_track_ids is not None:
+                id_switches += int((track_ids != object_track_ids).sum())
+            object_track_ids = track_ids
+        else:
+            predicted, _, _, track_ids = tracker.predict()
+            order = np.argsort(track_ids)
+            # Tracks are reported in creation order, so they line up with the objects
+            if frame > 2 * keyframe_interval:
+                max_error = max(max_error, float(np.abs(predicted[order] - boxes).max()))
+
+    return id_switches, max_error
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        id_switches, max_error = check_tracking()
+        print('ID switches : {}, max predicted box error : {:.2f} px'.format(id_switches, max_error))
+        sys.exit(1 if id_switches > 0 or max_error > 10.0 else 0)
@@ -0,0 +1,72 @@
+"""
+File: StagingRing.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import queue
+import numpy as np
+
+class StagingRing(object):
+    """
+    description: A StagingRing class that owns a ring of preallocated, contiguous batch buffers.
+                 Frame sources decode or capture straight into a slot and the pre-processor
+                 reads the slot as it is, so a batch is never copied on the host.
+    """
+
+    def __init__(self, input_shape, num_buffers, enable_pagelocked):
+        """
+        param:
+            input_shape:        (batch_size, height, width, channel) of a buffer
+            num_buffers:        number of buffers in the ring
+            enable_pagelocked:  allocate page-locked memory, the host to device copy can then use DMA
+        """
+        print("StagingRing init")
+
+        if enable_pagelocked is True:
+            import pycuda.autoinit
+            import pycuda.driver as cuda
+
+            # PORTABLE keeps the memory pinned for every CUDA context, not only the current one
+            buffers = [cuda.pagelocked_empty(input_shape, np.uint8, mem_flags=cuda.host_alloc_flags.PORTABLE)
+                       for _ in range(num_buffers)]
+        else:
+            buffers = [np.empty(input_shape, dtype=np.uint8) for _ in range(num_buffers)]
+
+        free_slots = queue.Queue()
+        for slot in range(num_buffers):
+            free_slots.put(slot)
+
+        self.buffers = buffers
+        self.free_slots = free_slots
+        self.input_shape = input_shape
+        self.num_buffers = num_buffers
+
+    def destroy(self):
+        print("StagingRing destroy")
+
+        self.buffers = []
+
+    def acquire(self):
+        """
+        description: Wait for a free buffer.
+        return:
+            slot: index of the buffer, None once close() was called
+        """
+
+        return self.free_slots.get()
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def close(self):
+        # Wake up a producer waiting in acquire()
+        self.free_slots.put(None)
+
+    def get_buffer(self, slot):
+        return self.buffers[slot]
@@ -0,0 +1,284 @@
+"""
+File: WorkerPool.py
+
+Authors: Jinwoo Jeong <jw.jeong@keti.re.kr>
+         Sungjei Kim <sungjei.kim@keti.re.kr>
+         Seungho Lee <seunghl@keti.re.kr>
+
+The property of program is under Korea Electronics Technology Institute.
+For more information, contact us at <jw.jeong@keti.re.kr>.
+"""
+
+import time
+import queue
+import multiprocessing
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.8+, the worker pool is not available on older interpreters
+    shared_memory = None
+
+# [x1, y1, x2, y2, score, classid] per box
+RESULT_FIELDS = 6
+
+class SharedRing(object):
+    """
+    description: A SharedRing class that lays out the frame and result slots of the worker pool in shared memory.
+                 Only slot indices travel through the queues, the pixels and the boxes are never pickled.
+    """
+
+    def __init__(self, num_slots, frame_shape, max_boxes, names=None):
+        """
+        param:
+            num_slots:      number of frames in flight
+            frame_shape:    (height, width, channel) of a frame
+            max_boxes:      maximum number of result boxes per frame
+            names:          names of existing blocks to attach to, None creates them
+        """
+
+        if shared_memory is None:
+            raise RuntimeError("The worker pool needs multiprocessing.shared_memory of Python 3.8 or later")
+
+        frames_shape = (num_slots,) + tuple(frame_shape)
+        results_shape = (num_slots, max_boxes, RESULT_FIELDS)
+        frames_size = int(np.prod(frames_shape))
+        results_size = int(np.prod(results_shape)) * 4 + num_slots * 4
+
+        if names is None:
+            self.frames_memory = shared_memory.SharedMemory(create=True, size=frames_size)
+            self.results_memory = shared_memory.SharedMemory(create=True, size=results_size)
+            self.owner = True
+        else:
+            self.frames_memory = shared_memory.SharedMemory(name=names[0])
+            self.results_memory = shared_memory.SharedMemory(name=names[1])
+            # Only the creating process unlinks the blocks, the pool processes share its resource tracker
+            self.owner = False
+
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.max_boxes = max_boxes
+
+        self.frames = np.ndarray(frames_shape, dtype=np.uint8, buffer=self.frames_memory.buf)
+        self.results = np.ndarray(results_shape, dtype=np.float32, buffer=self.results_memory.buf)
+        self.counts = np.ndarray((num_slots,), dtype=np.int32, buffer=self.results_memory.buf, offset=results_size - num_slots * 4)
+
+    def get_names(self):
+        return (self.frames_memory.name, self.results_memory.name)
+
+    def attach(self):
+        """
+        description: Open the same blocks in a worker process.
+        """
+
+        return SharedRing(self.num_slots, self.frame_shape, self.max_boxes, self.get_names())
+
+    def destroy(self):
+        # Views into the blocks have to go before the blocks can be closed
+        self.frames = None
+        self.results = None
+        self.counts = None
+        self.frames_memory.close()
+        self.results_memory.close()
+        if self.owner is True:
+            self.frames_memory.unlink()
+            self.results_memory.unlink()
+
+    def __getstate__(self):
+        # A ring is handed to a process by the names of its blocks
+        return (self.num_slots, self.frame_shape, self.max_boxes, self.get_names())
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def write_results(self, slot, boxes, scores, classid):
+        count = min(len(boxes), self.max_boxes)
+        result = self.results[slot]
+        result[:count, 0:4] = boxes[:count]
+        result[:count, 4] = scores[:count]
+        result[:count, 5] = classid[:count]
+        self.counts[slot] = count
+
+    def read_results(self, slot):
+        """
+        return:
+            boxes, scores, classid: views of the results of a slot, valid until the slot is released
+        """
+
+        result = self.results[slot, :self.counts[slot]]
+        return result[:, 0:4], result[:, 4], result[:, 5]
+
+def capture_process(ring, read_factory, free_slots, tasks, num_workers):
+    ring = ring.attach() if ring.owner is True else ring
+    read = read_factory()
+    frame_index = 0
+    try:
+        while True:
+            slot = free_slots.get()
+            save_name = read(ring.frames[slot])
+            if save_name is False:
+                free_slots.put(slot)
+                break
+            tasks.put((slot, frame_index, save_name))
+            frame_index += 1
+    finally:
+        for _ in range(num_workers):
+            tasks.put(None)
+        ring.destroy()
+
+def worker_process(ring, backend_factory, batch_size, tasks, done, stats):
+    ring = ring.attach() if ring.owner is True else ring
+    backend = backend_factory()
+    batch = np.empty((batch_size,) + ring.frame_shape, dtype=np.uint8)
+
+    frame_count = 0
+    proc_time = 0
+    finished = False
+    while finished is False:
+        task = tasks.get()
+        if task is None:
+            break
+
+        # Take what is already queued, up to a full batch, without waiting for more
+        items = [task]
+        while len(items) < batch_size:
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                finished = True
+                break
+            items.append(task)
+
+        start = time.time()
+        for index, (slot, frame_index, save_name) in enumerate(items):
+            np.copyto(batch[index], ring.frames[slot])
+        output = backend.infer(batch, len(items))
+        result_boxes, result_scores, result_classid = backend.post_process(output, len(items))
+        for index, (slot, frame_index, save_name) in enumerate(items):
+            ring.write_results(slot, result_boxes[index], result_scores[index], result_classid[index])
+            done.put((slot, frame_index, save_name))
+        proc_time += (time.time() - start) * 1000
+        frame_count += len(items)
+
+    stats.put(('worker', frame_count, proc_time))
+    done.put(None)
+    backend.destroy()
+    ring.destroy()
+
+def sink_process(ring, sink_factory, free_slots, done, stats, num_workers):
+    ring = ring.attach() if ring.owner is True else ring
+    sink = sink_factory()
+
+    frame_count = 0
+    finished_workers = 0
+    while finished_workers < num_workers:
+        item = done.get()
+        if item is None:
+            finished_workers += 1
+            continue
+
+        slot, frame_index, save_name = item
+        boxes, scores, classid = ring.read_results(slot)
+        sink.write(save_name, ring.frames[slot], boxes, scores, classid)
+        free_slots.put(slot)
+        frame_count += 1
+
+    sink.destroy()
+    stats.put(('sink', frame_count, 0))
+    ring.destroy()
+
+class WorkerPool(object):
+    """
+    description: A WorkerPool class that runs capture, inference and output in separate processes, so the
+                 Python parts of the post-process, drawing and writing of different frames never share a GIL.
+                 A capture process reads frames into a SharedRing, num_workers processes run a backend on them
+                 and a sink process consumes the frames with their results and frees the slots.
+    """
+
+    def __init__(self, frame_shape, num_workers, num_slots, batch_size, max_boxes):
+        """
+        param:
+            frame_shape:    (height, width, channel) of a frame
+            num_workers:    number of inference and post-process processes
+            num_slots:      number of frames in flight, at least num_workers * batch_size keeps every worker busy
+            batch_size:     maximum number of queued frames a worker runs as one batch
+            max_boxes:      maximum number of result boxes per frame
+        """
+        print("WorkerPool init")
+
+        self.ring = SharedRing(num_slots, frame_shape, max_boxes)
+        self.num_workers = num_workers
+        self.num_slots = num_slots
+        self.batch_size = batch_size
+
+        self.frame_count = 0
+        self.worker_frame_counts = []
+        self.worker_proc_times = []
+
+    def destroy(self):
+        print("WorkerPool destroy")
+
+        self.ring.destroy()
+
+    def run(self, read_factory, backend_factory, sink_factory):
+        """
+        description: Process every frame of a source.
+                     The factories are called in the processes, so they and their arguments must be picklable.
+                     A RuntimeError is raised when any process exits with an error, e.g. read() raised in the capture process.
+        param:
+            read_factory:       returns read(dst), it fills a frame and returns its save name, False at the end
+            backend_factory:    returns a PipelineBackend, one per worker
+            sink_factory:       returns an object with write(save_name, image, boxes, scores, classid) and destroy()
+        return:
+            wall_time: seconds from the start of the processes until every frame reached the sink
+        """
+
+        free_slots = multiprocessing.Queue()
+        tasks = multiprocessing.Queue()
+        done = multiprocessing.Queue()
+        stats = multiprocessing.Queue()
+        for slot in range(self.num_slots):
+            free_slots.put(slot)
+
+        processes = [multiprocessing.Process(target=capture_process, args=(self.ring, read_factory, free_slots, tasks, self.num_workers), name="capture")]
+        for index in range(self.num_workers):
+            processes.append(multiprocessing.Process(target=worker_process, args=(self.ring, backend_factory, self.batch_size, tasks, done, stats), name="worker %d" % index))
+        processes.append(multiprocessing.Process(target=sink_process, args=(self.ring, sink_factory, free_slots, done, stats, self.num_workers), name="sink"))
+
+        start = time.time()
+        for process in processes:
+            process.daemon = True
+            process.start()
+
+        # The stats arrive before the processes exit, a full queue would keep them from exiting
+        results = []
+        while len(results) < self.num_workers + 1:
+            try:
+                results.append(stats.get(timeout=0.1))
+            except queue.Empty:
+                failed = [process for process in processes if process.exitcode not in (None, 0)]
+                if len(failed) > 0:
+                    for process in processes:
+                        process.terminate()
+                    raise RuntimeError("Worker pool process '%s' failed with exit code %d" % (failed[0].name, failed[0].exitcode))
+        wall_time = time.time() - start
+
+        for process in processes:
+            process.join()
+
+        # The capture process still ends the workers when read() raises, so a short run is only seen in the exit codes
+        failed = [process for process in processes if process.exitcode != 0]
+        if len(failed) > 0:
+            raise RuntimeError("Worker pool process '%s' failed with exit code %d" % (failed[0].name, failed[0].exitcode))
+
+        for kind, frame_count, proc_time in results:
+            if kind == 'sink':
+                self.frame_count = frame_count
+            else:
+                self.worker_frame_counts.append(frame_count)
+                self.worker_proc_times.append(proc_time)
+
+        return wall_time